@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+无界面的 HTTP API：聊天轮次以 Server-Sent Events 流式返回，另提供记忆的增删改查
+
+与 Gradio 界面共用 langgraph_memorey 的 get_streaming_response 和记忆存储，
+但不携带每个 chunk 的整页界面数据，适合程序化调用。
+
+- HTTP/1.1 keep-alive：JSON 响应带 Content-Length，SSE 使用 chunked 编码，连接可复用；
+- 背压：token 先合并到缓冲区，按字节数/时间间隔写出，socket 写阻塞时生成器随之暂停，
+  客户端长时间不读或断开时取消本轮（deadline 中止进行中的 LLM 请求）；
+- 计时：每个响应带 X-Request-Id 与 Server-Timing，SSE 在结束事件和 trailer 中给出首字/总耗时；
+- 并发上限：同时进行的聊天超过 API_MAX_CONCURRENT_CHATS 时返回 503；
+- 同一用户的聊天经会话邮箱按到达顺序依次执行，不同用户并行。
+
+接口：
+    POST   /chat                          {"user_id", "message", "enable_search", "timeout", "use_cache"}
+    GET    /memories/<user_id>[?category=job,location&limit=20]
+    GET    /memories/<user_id>/<memory_id>/history
+    PUT    /memories/<user_id>/<memory_id> {"content"}
+    DELETE /memories/<user_id>/<memory_id>
+    GET    /health
+    GET    /metrics/llm                   LLM 调度器排队指标与各副本状态
+    GET    /metrics/turns                 各会话邮箱的排队深度
+
+用法：
+    python api_server.py [--host 0.0.0.0] [--port 8090]
+"""
+
+import argparse
+import json
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from deadline import Deadline
+from langgraph_memorey import (get_ordered_streaming_response, upsert_user_memory, delete_user_memory,
+                               memory_conn, memory_write_lock)
+from memory_schema import fetch_history, fetch_memories
+from tool_registry import get_llm_pool, get_llm_scheduler
+from thinking_parser import ThinkingStreamParser, THINKING
+from thread_mailbox import turn_mailbox
+
+MAX_CONCURRENT_CHATS = int(os.environ.get("API_MAX_CONCURRENT_CHATS", "16"))
+MAX_BODY_BYTES = 64 * 1024
+KEEPALIVE_TIMEOUT = 60        # 空闲连接 / 单次写阻塞的最长时间（秒）
+FLUSH_BYTES = 512             # SSE 缓冲达到该字节数立即写出
+FLUSH_INTERVAL = 0.05         # 否则最多间隔该秒数写出一次
+MAX_CHAT_TIMEOUT = 600        # /chat 请求 timeout 字段的上限（秒）
+
+_chat_slots = threading.BoundedSemaphore(MAX_CONCURRENT_CHATS)
+
+
+class ClientGone(Exception):
+    """客户端断开或长时间不读取"""
+
+
+def _sse_event(event: str, data) -> bytes:
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n".encode("utf-8")
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    server_version = "MemoryChatAPI/1.0"
+
+    def log_message(self, format, *args):
+        print(f"🌐 {self.address_string()} {format % args}")
+
+    # --- 通用工具 ---
+
+    def _start(self):
+        self._request_id = self.headers.get("X-Request-Id") or uuid.uuid4().hex[:12]
+        self._started_at = time.perf_counter()
+
+    def _elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._started_at) * 1000
+
+    def _send_json(self, status: int, data, extra_headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Request-Id", self._request_id)
+        self.send_header("Server-Timing", f"total;dur={self._elapsed_ms():.1f}")
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # 无法确定请求体边界，回复后关闭连接；负数长度会让 rfile.read 一直读到连接关闭
+            self.close_connection = True
+            raise ValueError("Content-Length 必须是非负整数")
+        if length > MAX_BODY_BYTES:
+            # 未读取的请求体会被当作下一个请求解析，回复后关闭连接
+            self.close_connection = True
+            raise ValueError("请求体过大")
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw or b"{}")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"JSON 解析失败: {e}")
+
+    def _route(self):
+        return [unquote(p) for p in urlsplit(self.path).path.split("/") if p]
+
+    # --- 路由 ---
+
+    def do_GET(self):
+        self._start()
+        parts = self._route()
+        if parts == ["health"]:
+            self._send_json(200, {"status": "ok"})
+        elif parts == ["metrics", "llm"]:
+            self._send_json(200, {"scheduler": get_llm_scheduler().snapshot(),
+                                  "endpoints": get_llm_pool().snapshot(), "pool": dict(get_llm_pool().stats)})
+        elif parts == ["metrics", "turns"]:
+            self._send_json(200, turn_mailbox.snapshot())
+        elif len(parts) == 2 and parts[0] == "memories":
+            self._list_memories(parts[1])
+        elif len(parts) == 4 and parts[0] == "memories" and parts[3] == "history":
+            # memory_conn 由所有线程共享，读取也要与写入串行
+            with memory_write_lock:
+                history = fetch_history(memory_conn, parts[1], parts[2])
+            self._send_json(200, {"user_id": parts[1], "memory_id": parts[2], "history": history})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_PUT(self):
+        self._start()
+        parts = self._route()
+        if len(parts) != 3 or parts[0] != "memories":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            body = self._read_json()
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        content = body.get("content")
+        if content is None or not str(content).strip():
+            self._send_json(400, {"error": "content 不能为空"})
+            return
+        upsert_user_memory(parts[1], parts[2], str(content))
+        self._send_json(200, {"user_id": parts[1], "memory_id": parts[2], "content": str(content)})
+
+    def do_DELETE(self):
+        self._start()
+        parts = self._route()
+        if len(parts) != 3 or parts[0] != "memories":
+            self._send_json(404, {"error": "not found"})
+            return
+        if delete_user_memory(parts[1], parts[2]):
+            self._send_json(200, {"deleted": True})
+        else:
+            self._send_json(404, {"error": "记忆不存在"})
+
+    def do_POST(self):
+        self._start()
+        if self._route() != ["chat"]:
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            body = self._read_json()
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        user_id = str(body.get("user_id") or "").strip()
+        message = str(body.get("message") or "").strip()
+        if not user_id or not message:
+            self._send_json(400, {"error": "user_id 和 message 不能为空"})
+            return
+        try:
+            timeout = float(body.get("timeout", 120))
+        except (TypeError, ValueError):
+            timeout = math.nan
+        if not (0 < timeout <= MAX_CHAT_TIMEOUT):
+            self._send_json(400, {"error": f"timeout 必须是 0 到 {MAX_CHAT_TIMEOUT} 之间的秒数"})
+            return
+        if not _chat_slots.acquire(blocking=False):
+            self._send_json(503, {"error": "服务繁忙，请稍后重试"}, {"Retry-After": "1"})
+            return
+        try:
+            self._stream_chat(user_id, message, bool(body.get("enable_search", False)), timeout,
+                              body.get("use_cache"))
+        finally:
+            _chat_slots.release()
+
+    # --- 记忆 ---
+
+    def _list_memories(self, user_id: str):
+        query = parse_qs(urlsplit(self.path).query)
+        categories = [c for value in query.get("category", []) for c in value.split(",") if c]
+        try:
+            limit = int(query["limit"][0]) if "limit" in query else None
+        except ValueError:
+            self._send_json(400, {"error": "limit 必须是整数"})
+            return
+        with memory_write_lock:
+            memories = fetch_memories(memory_conn, user_id, categories or None, limit)
+        self._send_json(200, {"user_id": user_id, "memories": memories})
+
+    # --- SSE 聊天 ---
+
+    def _write_raw(self, data: bytes):
+        """写阻塞超过 KEEPALIVE_TIMEOUT 或连接断开视为客户端离开"""
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError, socket.timeout) as e:
+            raise ClientGone(str(e))
+
+    def _write_chunk(self, data: bytes):
+        """写出一个 HTTP chunk（chunked 编码）"""
+        self._write_raw(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+
+    def _stream_chat(self, user_id: str, message: str, enable_search: bool, timeout: float, use_cache):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("X-Request-Id", self._request_id)
+        self.send_header("Server-Timing", f"setup;dur={self._elapsed_ms():.1f}")
+        self.send_header("Trailer", "Server-Timing")
+        self.end_headers()
+
+        deadline = Deadline(timeout)
+        parser = ThinkingStreamParser()
+        generator = get_ordered_streaming_response(user_id, message, enable_search, deadline=deadline,
+                                                   use_cache=use_cache, typing_delay=0)
+        buffer = []
+        buffered_bytes = 0
+        last_flush = time.perf_counter()
+        first_token_ms = None
+        chunk_count = 0
+
+        def flush():
+            nonlocal buffered_bytes, last_flush
+            if buffer:
+                self._write_chunk(b"".join(buffer))
+                buffer.clear()
+                buffered_bytes = 0
+            last_flush = time.perf_counter()
+
+        def push(events):
+            nonlocal buffered_bytes
+            for kind, text in events:
+                data = _sse_event("thinking" if kind == THINKING else "token", {"text": text})
+                buffer.append(data)
+                buffered_bytes += len(data)
+
+        try:
+            for chunk in generator:
+                if not chunk:
+                    continue
+                chunk_count += 1
+                if first_token_ms is None:
+                    first_token_ms = self._elapsed_ms()
+                push(parser.feed(chunk))
+                # 合并小块写出：缓冲够大或间隔够长才写，写阻塞时生成器自然暂停
+                if buffered_bytes >= FLUSH_BYTES or time.perf_counter() - last_flush >= FLUSH_INTERVAL:
+                    flush()
+            push(parser.finish())
+            total_ms = self._elapsed_ms()
+            buffer.append(_sse_event("done", {
+                "request_id": self._request_id,
+                "chunks": chunk_count,
+                "first_token_ms": round(first_token_ms or total_ms, 1),
+                "total_ms": round(total_ms, 1),
+            }))
+            flush()
+            timing = f"ttft;dur={first_token_ms or total_ms:.1f}, total;dur={total_ms:.1f}"
+            self._write_raw(f"0\r\nServer-Timing: {timing}\r\n\r\n".encode("ascii"))
+        except ClientGone as e:
+            print(f"🔌 客户端已断开，取消请求 {self._request_id}: {e}")
+            deadline.cancel(reason="client_gone")
+            self.close_connection = True
+        finally:
+            # 关闭生成器：未完成时触发其 finally，释放 deadline 与进行中的请求
+            generator.close()
+
+
+def run_server(host: str = "0.0.0.0", port: int = 8090):
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    print(f"🚀 API 服务已启动: http://{host}:{port} (最大并发聊天 {MAX_CONCURRENT_CHATS})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("👋 API 服务已停止")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="记忆助手的无界面 SSE API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8090)
+    args = parser.parse_args()
+    run_server(args.host, args.port)
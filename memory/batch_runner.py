@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+离线批量推理：把 JSONL 中的对话轮次并发送入 LangGraph 工作流
+
+输入每行一个轮次：
+    {"user_id": "u1", "thread_id": "thread_u1", "message": "你好", "enable_search": false, "id": "可选"}
+thread_id 缺省为 thread_{user_id}。
+
+- 流式读取输入，预读的轮次数有上限，内存占用与文件大小无关；
+- 不同会话并发执行，同一会话（或 --serialize-by user 时同一用户）的轮次严格按文件顺序执行
+  （thread_mailbox.MailboxExecutor：每个串行键一个邮箱，键间在 --concurrency 个线程上并行）；
+- --concurrency 只限制同时执行的轮次数；一个轮次内还有后台记忆提取、并发工具调用等 LLM 请求，
+  对 vLLM 的实际并发由共享调度器的 LLM_MAX_CONCURRENCY 限制（见 llm_pool.LLMScheduler）；
+- 结果按完成顺序追加写入输出 JSONL（带输入行号），输出文件即进度检查点，--resume 跳过已完成的行；
+- 定期打印吞吐量（turns/s）。
+
+用法：
+    python batch_runner.py turns.jsonl results.jsonl [--concurrency 8] [--timeout 120] [--resume]
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import time
+from typing import Dict, Optional, Set, Tuple
+
+from langchain_core.messages import HumanMessage
+
+from thread_mailbox import MailboxExecutor
+
+DEFAULT_CONCURRENCY = 8
+MAX_BUFFERED_TURNS = 1000     # 最多预读的未完成轮次数
+REPORT_INTERVAL = 10.0        # 吞吐量打印间隔（秒）
+
+_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+
+def _load_completed(out_path: str) -> Tuple[Set[int], int]:
+    """从已有输出中读取完成的输入行号，以及最后一个完整行之后的字节位置"""
+    completed = set()
+    offset = valid_end = 0
+    if not os.path.exists(out_path):
+        return completed, valid_end
+    with open(out_path, "rb") as f:
+        for line in f:
+            offset += len(line)
+            if not line.endswith(b"\n"):
+                break  # 上次中断时写了半行
+            valid_end = offset
+            try:
+                completed.add(json.loads(line)["line"])
+            except (json.JSONDecodeError, UnicodeDecodeError, KeyError):
+                continue
+    return completed, valid_end
+
+
+def _extract_reply(result) -> str:
+    if result and "messages" in result:
+        for msg in reversed(result["messages"]):
+            if msg.type == "ai" and msg.content and not msg.content.startswith("[System:"):
+                return msg.content
+    return ""
+
+
+def run_turn(turn: Dict, timeout: float) -> Dict:
+    """执行一个轮次，返回输出记录（出错时记录 error）"""
+    from deadline import Deadline
+    from langgraph_memorey import app
+
+    deadline = Deadline(timeout)
+    config = {
+        "configurable": {
+            "user_id": turn["user_id"],
+            "thread_id": turn["thread_id"],
+            "enable_search": turn.get("enable_search", False),
+            "use_response_cache": False,
+            "deadline": deadline,
+        }
+    }
+    record = {"line": turn["line"], "id": turn.get("id"), "user_id": turn["user_id"], "thread_id": turn["thread_id"]}
+    start = time.perf_counter()
+    try:
+        result = app.invoke({"messages": [HumanMessage(content=turn["message"])]}, config)
+        record["reply"] = _extract_reply(result)
+        deadline.release()
+    except Exception as e:
+        deadline.cancel(reason="error")
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return record
+
+
+def run_batch(in_path: str, out_path: str, concurrency: int = DEFAULT_CONCURRENCY,
+              timeout: float = 120, resume: bool = False, serialize_by: str = "thread",
+              max_buffered: int = MAX_BUFFERED_TURNS) -> Dict[str, float]:
+    completed, valid_end = _load_completed(out_path) if resume else (set(), 0)
+    if resume and os.path.exists(out_path):
+        # 截掉中断时写出的半行，否则新记录会接在它后面
+        os.truncate(out_path, valid_end)
+    out = open(out_path, "a" if resume else "w", encoding="utf-8")
+
+    futures: Set[concurrent.futures.Future] = set()
+    stats = {"done": 0, "errors": 0, "skipped": 0}
+    start_time = last_report = time.time()
+
+    print(f"🚀 开始批量推理: {in_path} -> {out_path} (并发 {concurrency}，按 {serialize_by} 串行)")
+    mailbox = MailboxExecutor(max_workers=concurrency, name="batch")
+    with open(in_path, "r", encoding="utf-8") as f:
+        line_iter = enumerate(f, 1)
+        eof = False
+        try:
+            while True:
+                # 1. 预读输入直到缓冲上限，按串行键放入邮箱（同一键的轮次按文件顺序执行）
+                while not eof and len(futures) < max_buffered:
+                    item = next(line_iter, None)
+                    if item is None:
+                        eof = True
+                        break
+                    line_no, line = item
+                    if not line.strip():
+                        continue
+                    if line_no in completed:
+                        stats["skipped"] += 1
+                        continue
+                    turn = json.loads(line)
+                    turn["line"] = line_no
+                    turn.setdefault("thread_id", f"thread_{turn['user_id']}")
+                    key = turn["user_id"] if serialize_by == "user" else turn["thread_id"]
+                    futures.add(mailbox.submit(key, lambda t: run_turn(t, timeout), turn))
+
+                if not futures:
+                    break
+
+                # 2. 等待任意轮次完成，写出结果
+                done, futures = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    record = future.result()
+                    out.write(_ENCODER.encode(record) + "\n")
+                    stats["done"] += 1
+                    if "error" in record:
+                        stats["errors"] += 1
+                out.flush()
+
+                now = time.time()
+                if now - last_report >= REPORT_INTERVAL:
+                    last_report = now
+                    mailbox_stats = mailbox.stats()
+                    print(f"📈 已完成 {stats['done']} 个轮次，{stats['done'] / (now - start_time):.2f} turns/s，"
+                          f"进行中 {mailbox_stats['running']}，排队 {mailbox_stats['queued']}")
+        finally:
+            mailbox.shutdown(wait=True)
+            out.close()
+
+    elapsed = time.time() - start_time
+    stats["elapsed"] = elapsed
+    stats["throughput"] = stats["done"] / elapsed if elapsed > 0 else 0.0
+    print(f"✅ 批量推理完成: {stats['done']} 个轮次（失败 {stats['errors']}，跳过已完成 {stats['skipped']}），"
+          f"耗时 {elapsed:.1f}s，吞吐 {stats['throughput']:.2f} turns/s")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JSONL 对话轮次的离线批量推理")
+    parser.add_argument("input", help="输入 JSONL")
+    parser.add_argument("output", help="输出 JSONL（同时作为进度检查点）")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同时执行的轮次数")
+    parser.add_argument("--timeout", type=float, default=120, help="单个轮次的超时时间（秒）")
+    parser.add_argument("--resume", action="store_true", help="跳过输出文件中已完成的行，继续追加")
+    parser.add_argument("--serialize-by", choices=["thread", "user"], default="thread",
+                        help="按会话还是按用户保证轮次顺序（同一用户的记忆写入需要串行时用 user）")
+    args = parser.parse_args()
+    run_batch(args.input, args.output, args.concurrency, args.timeout, args.resume, args.serialize_by)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+checkpoint 序列化基准：对比原生 SqliteSaver 与 CompressedSqliteSaver
+
+模拟 langgraph_memorey_second 的搜索会话：每轮用户提问 -> 带 web_search 调用的 AI 消息
+-> 数 KB 的搜索结果 ToolMessage -> 回答，搜索结果一直留在状态中。
+不调用 LLM，输出两种存储的数据库文件大小、每轮写入字节数，并校验读回的消息一致。
+
+用法：
+    python bench_checkpoint_serde.py [--turns 30] [--result-size 4000] [--dir /tmp]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from typing import Annotated, Dict, TypedDict
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+
+from checkpoint_store import DEFAULT_CODEC, CompressedSqliteSaver, checkpoint_storage_stats
+
+_WORDS = ("人工智能 机器学习 最新 新闻 发布 模型 推理 技术 公司 市场 数据 研究 用户 产品 开源 "
+          "latest release model inference benchmark open source company market data research").split()
+
+
+class State(TypedDict):
+    messages: Annotated[list[BaseMessage], add_messages]
+
+
+def _fake_search_result(rng: random.Random, size: int) -> str:
+    lines = []
+    i = 0
+    while sum(len(l) for l in lines) < size:
+        i += 1
+        title = " ".join(rng.choice(_WORDS) for _ in range(6))
+        body = " ".join(rng.choice(_WORDS) for _ in range(40))
+        lines.append(f"{i}. {title}\n   摘要: {body}...\n   链接: https://example.com/{rng.randrange(10 ** 8)}")
+    return "\n".join(lines)
+
+
+def _build_app(checkpointer, result_size: int):
+    rng = random.Random(0)
+
+    def agent(state: State):
+        turn = sum(1 for m in state["messages"] if isinstance(m, HumanMessage))
+        call_id = f"call_{turn}"
+        return {"messages": [
+            AIMessage(content="", tool_calls=[{"id": call_id, "name": "web_search",
+                                               "args": {"queries": [f"问题 {turn}"]}}]),
+            ToolMessage(content=_fake_search_result(rng, result_size), tool_call_id=call_id, name="web_search"),
+        ]}
+
+    def answer(state: State):
+        return {"messages": [AIMessage(content="根据搜索结果，" + " ".join(rng.choice(_WORDS) for _ in range(60)))]}
+
+    graph = StateGraph(State)
+    graph.add_node("agent", agent)
+    graph.add_node("answer", answer)
+    graph.add_edge(START, "agent")
+    graph.add_edge("agent", "answer")
+    graph.add_edge("answer", END)
+    return graph.compile(checkpointer=checkpointer)
+
+
+def _run(label: str, db_path: str, compressed: bool, turns: int, result_size: int) -> Dict:
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    saver = CompressedSqliteSaver(conn) if compressed else SqliteSaver(conn)
+    app = _build_app(saver, result_size)
+    config = {"configurable": {"thread_id": "bench"}}
+
+    start = time.perf_counter()
+    for turn in range(turns):
+        app.invoke({"messages": [HumanMessage(content=f"第 {turn} 个问题")]}, config)
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    messages = app.get_state(config).values["messages"]
+    load_ms = (time.perf_counter() - start) * 1000
+
+    stats = checkpoint_storage_stats(conn)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    written = stats["checkpoints_bytes"] + stats["writes_bytes"] + stats["checkpoint_blobs_bytes"]
+    return {
+        "label": label,
+        "db_bytes": os.path.getsize(db_path),
+        "written_bytes": written,
+        "bytes_per_turn": written / turns,
+        "turn_ms": elapsed * 1000 / turns,
+        "load_ms": load_ms,
+        "messages": [(type(m).__name__, m.content) for m in messages],
+        **stats,
+    }
+
+
+def run_benchmark(turns: int = 30, result_size: int = 4000, directory: str = None) -> Dict[str, Dict]:
+    directory = directory or tempfile.mkdtemp(prefix="ckpt_bench_")
+    results = {}
+    for label, compressed in (("SqliteSaver", False), (f"Compressed({DEFAULT_CODEC})", True)):
+        db_path = os.path.join(directory, f"{label.split('(')[0].lower()}.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        results[label] = _run(label, db_path, compressed, turns, result_size)
+
+    baseline, compressed = results.values()
+    assert baseline["messages"] == compressed["messages"], "读回的消息不一致"
+
+    print(f"\n📊 {turns} 轮，每轮搜索结果约 {result_size} 字符")
+    print(f"{'存储':<20}{'数据库大小':>14}{'每轮写入':>14}{'每轮耗时':>12}{'读取状态':>12}")
+    for r in results.values():
+        print(f"{r['label']:<20}{r['db_bytes'] / 1024:>12.1f}KB{r['bytes_per_turn'] / 1024:>12.1f}KB"
+              f"{r['turn_ms']:>10.1f}ms{r['load_ms']:>10.1f}ms")
+    print(f"✅ 数据库缩小 {1 - compressed['db_bytes'] / baseline['db_bytes']:.1%}，"
+          f"每轮写入减少 {1 - compressed['written_bytes'] / baseline['written_bytes']:.1%}，"
+          f"正文表 {compressed['checkpoint_blobs_rows']} 条")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="checkpoint 序列化的体积与写入量对比")
+    parser.add_argument("--turns", type=int, default=30, help="模拟的对话轮数")
+    parser.add_argument("--result-size", type=int, default=4000, help="每轮搜索结果的字符数")
+    parser.add_argument("--dir", default=None, help="数据库文件目录（默认临时目录）")
+    args = parser.parse_args()
+    run_benchmark(args.turns, args.result_size, args.dir)
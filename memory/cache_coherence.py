@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+多进程部署时的进程内缓存一致性
+
+每个 Gradio / API 工作进程都有自己的 memory_cache、conversation_history 和响应缓存，
+其他进程写入的记忆在本进程重启前不可见。这里用 SQLite 自身做变更通知：
+- 写入方在写事务中调用 touch_user(conn, user_id, scope)，为 cache_versions 中该用户、
+  该范围（memory / history）分配一个全局递增的 seq，随写入一起提交；
+- 读取方每轮开始时调用 CacheCoherence.check()：先读 PRAGMA data_version（只有其他连接
+  提交后才会变化，不读任何表），变化时再按 seq 索引取出上次之后变化的 (user_id, scope)，
+  只失效这些用户的缓存，缓存本身照常使用。
+"""
+
+import sqlite3
+import threading
+from typing import Callable, List, Optional, Tuple
+
+SCOPE_MEMORY = "memory"     # user_memories 变化：记忆缓存、记忆版本与响应缓存
+SCOPE_HISTORY = "history"   # 最近对话历史变化
+
+
+def ensure_coherence_schema(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS cache_versions (
+        user_id TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, scope)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_versions_seq ON cache_versions (seq)")
+    conn.commit()
+
+
+def touch_user(conn: sqlite3.Connection, user_id: str, scope: str = SCOPE_MEMORY):
+    """记录用户数据发生变化（不提交事务，随调用方的写入一起提交）"""
+    # seq 在写事务内取 MAX + 1，提交顺序与 seq 顺序一致
+    conn.execute("""
+        INSERT INTO cache_versions (user_id, scope, seq)
+        VALUES (?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM cache_versions))
+        ON CONFLICT(user_id, scope) DO UPDATE SET seq = excluded.seq, updated_at = CURRENT_TIMESTAMP
+    """, (user_id, scope))
+
+
+class CacheCoherence:
+    """检测其他连接/进程提交的用户数据变化，并回调失效对应的缓存（线程安全）"""
+
+    def __init__(self, conn: sqlite3.Connection, on_invalidate: Callable[[str, str], None],
+                 write_lock: Optional[threading.Lock] = None):
+        self.conn = conn
+        self.on_invalidate = on_invalidate
+        # 与写入方共用连接时传入同一把锁，避免读到本连接尚未提交（可能回滚）的 seq
+        self.write_lock = write_lock or threading.Lock()
+        self._lock = threading.Lock()
+        with self.write_lock:
+            self._data_version = self._read_data_version()
+            self._seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM cache_versions").fetchone()[0]
+        self.stats = {"checks": 0, "changes": 0, "invalidated": 0}
+
+    def _read_data_version(self) -> int:
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def check(self) -> List[Tuple[str, str]]:
+        """返回本次失效的 (user_id, scope)；没有其他连接提交时只执行一次 PRAGMA"""
+        with self._lock:
+            self.stats["checks"] += 1
+            with self.write_lock:
+                data_version = self._read_data_version()
+                if data_version == self._data_version:
+                    return []
+                self._data_version = data_version
+                rows = self.conn.execute(
+                    "SELECT user_id, scope, seq FROM cache_versions WHERE seq > ? ORDER BY seq",
+                    (self._seq,)
+                ).fetchall()
+            self.stats["changes"] += 1
+            if not rows:
+                return []
+            self._seq = rows[-1][2]
+            self.stats["invalidated"] += len(rows)
+        changed = [(user_id, scope) for user_id, scope, _ in rows]
+        for user_id, scope in changed:
+            self.on_invalidate(user_id, scope)
+        print(f"🔄 检测到数据库中的新写入，失效缓存: {changed}")
+        return changed
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+LLM 与搜索调用的录制 / 回放磁带，用于可复现、不依赖外部服务的性能分析
+
+图的性能数据受 vLLM 实时延迟和 DDGS 可用性影响，噪声很大。这里：
+- record：共享 HTTP 客户端的每个 LLM 请求照常发出，请求体与响应（状态码、响应头、
+  流式数据块及其时间偏移，含工具调用）写入磁带；DDGS 的每次 text() 查询结果或异常同样写入；
+- replay：不连接 vLLM / DDGS，按请求内容匹配磁带中的记录返回，
+  LLM_CASSETTE_LATENCY=original 时按录制时的首包与数据块间隔回放，zero 时立即返回，
+  用于单独分析图执行、数据库与界面格式化等应用自身的开销。
+
+磁带为 gzip 压缩的 JSONL，每行一次交互。相同请求出现多次时按录制顺序依次回放，
+用完后重复最后一条；回放时找不到匹配的请求抛出 CassetteMiss。
+
+配置：
+    LLM_CASSETTE_MODE=off|record|replay    （默认 off）
+    LLM_CASSETTE_PATH=llm_cassette.jsonl.gz
+    LLM_CASSETTE_LATENCY=original|zero     （回放时的延迟，默认 zero）
+
+用法：
+    python cassette.py info llm_cassette.jsonl.gz
+"""
+
+import argparse
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+CASSETTE_MODE = os.environ.get("LLM_CASSETTE_MODE", "off").lower()
+CASSETTE_PATH = os.environ.get("LLM_CASSETTE_PATH", "llm_cassette.jsonl.gz")
+CASSETTE_LATENCY = os.environ.get("LLM_CASSETTE_LATENCY", "zero").lower()
+
+MODE_OFF, MODE_RECORD, MODE_REPLAY = "off", "record", "replay"
+CASSETTE_FORMAT_VERSION = 1
+
+SSE_DONE = b"data: [DONE]"
+
+# 回放时原样返回的响应头（其余与连接相关的头不保存）
+_KEPT_HEADERS = ("content-type",)
+
+
+class CassetteMiss(Exception):
+    """回放时磁带中没有匹配的请求"""
+
+
+def _request_key(method: str, path: str, body: bytes) -> str:
+    """按方法、路径与规范化的 JSON 请求体计算匹配键（与主机无关，换副本录制也能匹配）"""
+    try:
+        canonical = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False).encode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        canonical = body
+    return hashlib.sha256(method.encode() + b" " + path.encode() + b"\n" + canonical).hexdigest()
+
+
+def _search_key(query: str, max_results: Any) -> str:
+    return hashlib.sha256(json.dumps([query, max_results], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _encode_chunk(chunk: bytes) -> str:
+    # SSE 数据块可能在多字节字符中间切开，用 surrogateescape 无损保存
+    return chunk.decode("utf-8", errors="surrogateescape")
+
+
+def _decode_chunk(text: str) -> bytes:
+    return text.encode("utf-8", errors="surrogateescape")
+
+
+class Cassette:
+    """一盘磁带：录制时追加写入，回放时按键取出（线程安全）"""
+
+    def __init__(self, path: str, mode: str, latency: str = "zero"):
+        if mode not in (MODE_RECORD, MODE_REPLAY):
+            raise ValueError(f"未知的磁带模式: {mode}")
+        self.path = path
+        self.mode = mode
+        self.original_latency = latency == "original"
+        self._lock = threading.Lock()
+        self._file = None
+        self._entries: Dict[str, Deque[Dict]] = {}
+        self._last: Dict[str, Dict] = {}
+        self.stats = {"recorded": 0, "replayed": 0, "misses": 0}
+        if mode == MODE_RECORD:
+            self._file = gzip.open(path, "wt", encoding="utf-8")
+            self._write({"kind": "header", "version": CASSETTE_FORMAT_VERSION, "created_at": time.time()})
+            atexit.register(self.close)
+            print(f"📼 录制 LLM / 搜索调用到 {path}")
+        else:
+            self._load()
+            print(f"📼 从 {path} 回放 {sum(len(v) for v in self._entries.values())} 条记录"
+                  f"（延迟: {'原始' if self.original_latency else '无'}）")
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == MODE_REPLAY
+
+    def _load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry.get("kind") == "header":
+                    continue
+                self._entries.setdefault(entry["key"], deque()).append(entry)
+
+    def _write(self, entry: Dict):
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        # 在多字节字符中间切开的数据块含有代理字符，无法按 UTF-8 写出；
+        # 转成 JSON 的 \udcXX 转义，读取时 json.loads 原样还原
+        line = line.encode("utf-8", errors="backslashreplace").decode("utf-8")
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.flush()
+            if entry["kind"] != "header":
+                self.stats["recorded"] += 1
+
+    def record(self, entry: Dict):
+        self._write(entry)
+
+    def take(self, key: str, description: str) -> Dict:
+        """取出下一条匹配的记录；同一请求的记录用完后重复最后一条"""
+        with self._lock:
+            queue = self._entries.get(key)
+            if queue:
+                entry = queue.popleft()
+                self._last[key] = entry
+            else:
+                entry = self._last.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                raise CassetteMiss(f"磁带 {self.path} 中没有匹配的记录: {description}")
+            self.stats["replayed"] += 1
+        return entry
+
+    def sleep(self, seconds: float):
+        if self.original_latency and seconds > 0:
+            time.sleep(seconds)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# --- LLM（httpx 传输层） ---
+
+class _RecordingStream(httpx.SyncByteStream):
+    """透传响应流，同时记下每个数据块及其相对请求开始的时间；响应完整时在关闭时写入磁带"""
+
+    def __init__(self, stream, on_close: Callable[[List[Tuple[float, str]]], None], start: float):
+        self._stream = stream
+        self._on_close = on_close
+        self._start = start
+        self._chunks: List[Tuple[float, str]] = []
+        self._complete = False
+        self._closed = False
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._chunks.append((round(time.monotonic() - self._start, 4), _encode_chunk(chunk)))
+            # 流式响应以 [DONE] 结束，客户端读到后不再继续读取
+            if SSE_DONE in chunk:
+                self._complete = True
+            yield chunk
+        self._complete = True
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            try:
+                self._stream.close()
+            finally:
+                # 被取消 / 中途放弃的响应不录制，避免回放出截断的内容
+                if self._complete:
+                    self._on_close(self._chunks)
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    """按录制的时间偏移依次产出数据块"""
+
+    def __init__(self, cassette: Cassette, chunks: List, offset: float):
+        self._cassette = cassette
+        self._chunks = chunks
+        self._offset = offset
+
+    def __iter__(self):
+        previous = self._offset
+        for at, text in self._chunks:
+            self._cassette.sleep(at - previous)
+            previous = at
+            yield _decode_chunk(text)
+
+    def close(self):
+        pass
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """录制 / 回放经过它的 HTTP 请求；回放时不调用内层传输"""
+
+    def __init__(self, transport: httpx.BaseTransport, cassette: Cassette):
+        self._transport = transport
+        self.cassette = cassette
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        body = request.read()
+        key = _request_key(request.method, request.url.path, body)
+        if self.cassette.replaying:
+            return self._replay(request, key)
+
+        start = time.monotonic()
+        response = self._transport.handle_request(request)
+        header_latency = round(time.monotonic() - start, 4)
+        status = response.status_code
+        headers = {k: v for k, v in response.headers.items() if k.lower() in _KEPT_HEADERS}
+
+        def save(chunks: List[Tuple[float, str]]):
+            self.cassette.record({
+                "kind": "http", "key": key, "method": request.method, "path": request.url.path,
+                "request": _encode_chunk(body), "status": status, "headers": headers,
+                "latency": header_latency, "chunks": chunks,
+            })
+
+        response.stream = _RecordingStream(response.stream, save, start)
+        return response
+
+    def _replay(self, request: httpx.Request, key: str) -> httpx.Response:
+        entry = self.cassette.take(key, f"{request.method} {request.url.path}")
+        self.cassette.sleep(entry["latency"])
+        return httpx.Response(entry["status"], headers=entry["headers"], request=request,
+                              stream=_ReplayStream(self.cassette, entry["chunks"], entry["latency"]))
+
+    def close(self):
+        self._transport.close()
+
+
+# --- 搜索（DDGS） ---
+
+class CassetteSearch:
+    """DDGS 的录制 / 回放包装：text() 的结果或异常写入或取自磁带，支持 with 语句"""
+
+    def __init__(self, cassette: Cassette, factory: Optional[Callable[..., Any]], **kwargs):
+        self.cassette = cassette
+        # 回放时不创建真正的 DDGS（可以在未安装 ddgs 的机器上回放）
+        self._inner = None if cassette.replaying else factory(**kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._inner is not None and hasattr(self._inner, "__exit__"):
+            self._inner.__exit__(*exc)
+        return False
+
+    def text(self, query: str, max_results: Optional[int] = None, **kwargs) -> List[Dict]:
+        key = _search_key(query, max_results)
+        if self.cassette.replaying:
+            entry = self.cassette.take(key, f"搜索 {query!r}")
+            self.cassette.sleep(entry["latency"])
+            if entry.get("error"):
+                raise RuntimeError(entry["error"])
+            return entry["results"]
+
+        start = time.monotonic()
+        entry = {"kind": "search", "key": key, "query": query, "max_results": max_results}
+        try:
+            results = list(self._inner.text(query, max_results=max_results, **kwargs) or [])
+            entry["results"] = results
+            return results
+        except Exception as e:
+            entry["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            entry["latency"] = round(time.monotonic() - start, 4)
+            self.cassette.record(entry)
+
+
+# --- 全局磁带 ---
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """按环境变量懒加载全局磁带；关闭时返回 None"""
+    global _cassette
+    if CASSETTE_MODE == MODE_OFF:
+        return None
+    if _cassette is None:
+        with _cassette_lock:
+            if _cassette is None:
+                _cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_LATENCY)
+    return _cassette
+
+
+def replaying() -> bool:
+    cassette = get_cassette()
+    return cassette is not None and cassette.replaying
+
+
+def wrap_transport(transport: httpx.BaseTransport) -> httpx.BaseTransport:
+    """开启磁带时在传输层录制 / 回放 LLM 请求"""
+    cassette = get_cassette()
+    return transport if cassette is None else CassetteTransport(transport, cassette)
+
+
+def make_search_client(factory: Optional[Callable[..., Any]], **kwargs):
+    """创建搜索客户端（DDGS）；开启磁带时返回录制 / 回放包装"""
+    cassette = get_cassette()
+    if cassette is None:
+        return factory(**kwargs)
+    return CassetteSearch(cassette, factory, **kwargs)
+
+
+def cassette_info(path: str) -> Dict[str, Any]:
+    """磁带内容统计"""
+    kinds: Counter = Counter()
+    latency = {"http": 0.0, "search": 0.0}
+    chunks = 0
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            kind = entry.get("kind")
+            if kind == "header":
+                continue
+            kinds[kind] += 1
+            latency[kind] = latency.get(kind, 0.0) + entry.get("latency", 0.0) + (
+                entry["chunks"][-1][0] - entry["latency"] if entry.get("chunks") else 0.0)
+            chunks += len(entry.get("chunks", []))
+    return {"path": path, "bytes": os.path.getsize(path), "http": kinds["http"], "search": kinds["search"],
+            "chunks": chunks, "recorded_seconds": {k: round(v, 2) for k, v in latency.items()}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM / 搜索磁带工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info_parser = sub.add_parser("info", help="查看磁带内容统计")
+    info_parser.add_argument("path")
+    args = parser.parse_args()
+    print(json.dumps(cassette_info(args.path), ensure_ascii=False, indent=2))
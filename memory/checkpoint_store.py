@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+压缩的 checkpoint 存储：大消息正文按内容寻址只存一次，其余负载整体压缩
+
+SqliteSaver 每一步都把完整的消息列表序列化写入 checkpoints 表，web_search 返回的
+数 KB 搜索结果留在状态中后，会在该会话之后的每个 checkpoint 中被重复写入。这里：
+1. 序列化前把超过 CHECKPOINT_BLOB_MIN_SIZE 字符的消息正文替换为引用（sha256），
+   正文压缩后写入 checkpoint_blobs 表（INSERT OR IGNORE），同一内容只存一份；
+2. 序列化结果超过 COMPRESS_MIN_SIZE 字节时整体压缩，类型记为 "<codec>+<原类型>"；
+   安装了 zstandard 时使用 zstd，否则使用标准库 zlib；
+3. 正文与 checkpoint 行在同一个事务中提交，不会出现悬空引用；事务提交成功后才把正文记为已入库，
+   提交失败（回滚）时后续 checkpoint 会重新写入正文；
+4. 读取时按类型前缀解压、还原引用，未压缩的旧 checkpoint 照常读取。
+
+CHECKPOINT_COMPRESSION=0 时 make_checkpointer 返回原生的 SqliteSaver。
+效果对比见 bench_checkpoint_serde.py。
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+CHECKPOINT_COMPRESSION = os.environ.get("CHECKPOINT_COMPRESSION", "1") != "0"
+BLOB_MIN_SIZE = int(os.environ.get("CHECKPOINT_BLOB_MIN_SIZE", "1024"))   # 单独存储的消息正文最小字符数
+COMPRESS_MIN_SIZE = 256        # 小于该字节数的负载不压缩
+KNOWN_BLOBS_LIMIT = 10000      # 进程内记录已入库正文哈希的条数上限
+BLOB_CACHE_LIMIT = 256         # 读取时缓存的正文条数
+DEFAULT_CODEC = "zstd" if ZSTD_AVAILABLE else "zlib"
+
+BLOB_REF_PREFIX = "\x00blob:"
+
+_codec_local = threading.local()   # zstd 压缩器不能跨线程并发使用
+
+
+def compress(data: bytes, codec: str = DEFAULT_CODEC) -> bytes:
+    if codec == "zstd":
+        if not hasattr(_codec_local, "zstd"):
+            _codec_local.zstd = zstandard.ZstdCompressor(level=3)
+        return _codec_local.zstd.compress(data)
+    return zlib.compress(data, 1)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("checkpoint 使用 zstd 压缩，请安装 zstandard 包")
+        if not hasattr(_codec_local, "zstd_d"):
+            _codec_local.zstd_d = zstandard.ZstdDecompressor()
+        return _codec_local.zstd_d.decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"未知的压缩格式: {codec}")
+
+
+class CompressedSerializer:
+    """包装 JsonPlusSerializer：抽出大消息正文、整体压缩"""
+
+    CODECS = ("zstd", "zlib")
+
+    def __init__(self, inner=None, blob_min_size: int = BLOB_MIN_SIZE, codec: str = DEFAULT_CODEC):
+        self.inner = inner or JsonPlusSerializer()
+        self.blob_min_size = blob_min_size
+        self.codec = codec
+        self.conn: Optional[sqlite3.Connection] = None   # 由 CompressedSqliteSaver 设置，读取正文用
+        self._local = threading.local()                  # 本线程待写入的正文
+        self._lock = threading.Lock()
+        self._known: "OrderedDict[str, None]" = OrderedDict()
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self.stats = {"payload_bytes": 0, "raw_bytes": 0, "blob_new": 0, "blob_reused": 0, "blob_bytes": 0}
+
+    # --- 序列化 ---
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = self.inner.dumps_typed(self._externalize(obj))
+        raw_size = len(data)
+        if raw_size >= COMPRESS_MIN_SIZE:
+            type_, data = f"{self.codec}+{type_}", compress(data, self.codec)
+        with self._lock:
+            self.stats["raw_bytes"] += raw_size
+            self.stats["payload_bytes"] += len(data)
+        return type_, data
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        codec, _, inner_type = type_.partition("+")
+        if inner_type and codec in self.CODECS:
+            return self._internalize(self.inner.loads_typed((inner_type, decompress(payload, codec))))
+        return self.inner.loads_typed(data)
+
+    def _externalize(self, obj: Any) -> Any:
+        """把大消息正文替换为引用；没有替换时返回原对象，不做多余的拷贝"""
+        if isinstance(obj, BaseMessage):
+            content = obj.content
+            if isinstance(content, str) and len(content) >= self.blob_min_size:
+                return obj.model_copy(update={"content": BLOB_REF_PREFIX + self._stage_blob(content)})
+            return obj
+        if isinstance(obj, dict):
+            changed = {k: self._externalize(v) for k, v in obj.items()}
+            return changed if any(changed[k] is not v for k, v in obj.items()) else obj
+        if isinstance(obj, (list, tuple)):
+            changed = [self._externalize(v) for v in obj]
+            if any(a is not b for a, b in zip(changed, obj)):
+                return changed if isinstance(obj, list) else type(obj)(changed)
+        return obj
+
+    def _stage_blob(self, content: str) -> str:
+        encoded = content.encode("utf-8")
+        digest = hashlib.sha256(encoded).hexdigest()
+        pending = self._pending()
+        with self._lock:
+            known = digest in self._known
+            if known:
+                self._known.move_to_end(digest)
+        if known or digest in pending:
+            with self._lock:
+                self.stats["blob_reused"] += 1
+            return digest
+        pending[digest] = (self.codec, compress(encoded, self.codec), len(encoded))
+        return digest
+
+    def _pending(self) -> Dict[str, Tuple[str, bytes, int]]:
+        if not hasattr(self._local, "pending"):
+            self._local.pending = {}
+        return self._local.pending
+
+    def flush_pending(self, cur: sqlite3.Cursor) -> List[Tuple[str, int]]:
+        """在 checkpoint 所在的事务中写入本线程新产生的正文，返回写入的 (哈希, 压缩后字节数)
+
+        返回值在事务提交成功后交给 mark_committed()；提交前就记为已入库的话，
+        事务回滚后后续 checkpoint 会引用从未存下的正文。
+        """
+        pending = self._pending()
+        if not pending:
+            return []
+        rows = [(digest, codec, data, size) for digest, (codec, data, size) in pending.items()]
+        cur.executemany(
+            "INSERT OR IGNORE INTO checkpoint_blobs (hash, codec, data, size) VALUES (?, ?, ?, ?)", rows
+        )
+        pending.clear()
+        return [(digest, len(data)) for digest, _, data, _ in rows]
+
+    def mark_committed(self, flushed: List[Tuple[str, int]]):
+        """事务已提交：之后的 checkpoint 只需引用这些正文"""
+        if not flushed:
+            return
+        with self._lock:
+            for digest, size in flushed:
+                self._known[digest] = None
+                self.stats["blob_new"] += 1
+                self.stats["blob_bytes"] += size
+            while len(self._known) > KNOWN_BLOBS_LIMIT:
+                self._known.popitem(last=False)
+
+    # --- 反序列化 ---
+
+    def _internalize(self, obj: Any) -> Any:
+        """还原消息正文引用（反序列化得到的是新对象，可以直接修改）"""
+        if isinstance(obj, BaseMessage):
+            if isinstance(obj.content, str) and obj.content.startswith(BLOB_REF_PREFIX):
+                obj.content = self._load_blob(obj.content[len(BLOB_REF_PREFIX):])
+        elif isinstance(obj, dict):
+            for value in obj.values():
+                self._internalize(value)
+        elif isinstance(obj, (list, tuple)):
+            for value in obj:
+                self._internalize(value)
+        return obj
+
+    def _load_blob(self, digest: str) -> str:
+        with self._lock:
+            if digest in self._cache:
+                self._cache.move_to_end(digest)
+                return self._cache[digest]
+        pending = self._pending().get(digest)
+        row = pending[:2] if pending else self.conn.execute(
+            "SELECT codec, data FROM checkpoint_blobs WHERE hash = ?", (digest,)
+        ).fetchone()
+        if row is None:
+            print(f"⚠️ checkpoint 正文缺失: {digest[:12]}")
+            return "[内容已丢失]"
+        content = decompress(row[1], row[0]).decode("utf-8")
+        with self._lock:
+            self._cache[digest] = content
+            while len(self._cache) > BLOB_CACHE_LIMIT:
+                self._cache.popitem(last=False)
+        return content
+
+
+class CompressedSqliteSaver(SqliteSaver):
+    """使用 CompressedSerializer 的 SqliteSaver，正文与 checkpoint 在同一事务中提交"""
+
+    def __init__(self, conn: sqlite3.Connection, *, serde: Optional[CompressedSerializer] = None):
+        serde = serde or CompressedSerializer()
+        super().__init__(conn, serde=serde)
+        self.blob_serde = serde
+        serde.conn = conn
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS checkpoint_blobs (
+            hash TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            data BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        self.conn.commit()
+
+    @contextmanager
+    def cursor(self, transaction: bool = True):
+        # put 在进入 cursor 前序列化、put_writes 在 cursor 内序列化，两种情况都在提交前写入正文
+        flushed = []
+        with super().cursor(transaction) as cur:
+            yield cur
+            if transaction:
+                flushed = self.blob_serde.flush_pending(cur)
+        # 父类退出时提交；提交失败会抛出异常，不会执行到这里
+        self.blob_serde.mark_committed(flushed)
+
+
+def make_checkpointer(conn: sqlite3.Connection) -> SqliteSaver:
+    if CHECKPOINT_COMPRESSION:
+        return CompressedSqliteSaver(conn)
+    return SqliteSaver(conn)
+
+
+def checkpoint_storage_stats(conn: sqlite3.Connection) -> Dict[str, int]:
+    """checkpoint 相关表的行数与字节数"""
+    stats: Dict[str, int] = {}
+    queries: List[Tuple[str, str]] = [
+        ("checkpoints", "SELECT COUNT(*), COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints"),
+        ("writes", "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM writes"),
+        ("checkpoint_blobs", "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM checkpoint_blobs"),
+    ]
+    for table, sql in queries:
+        try:
+            count, size = conn.execute(sql).fetchone()
+        except sqlite3.OperationalError:
+            count, size = 0, 0
+        stats[f"{table}_rows"] = count
+        stats[f"{table}_bytes"] = size
+    return stats
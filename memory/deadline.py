@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+可取消的请求截止时间（Deadline）
+
+一个 Deadline 贯穿一次对话轮次：
+- 通过 config["configurable"]["deadline"] 传入工作流，节点边界处检查；
+- 节点执行期间通过 contextvar 激活，共享 HTTP 客户端的 DeadlineTransport
+  据此收紧超时，并在取消时关闭正在读取的响应流，立即中止 LLM 请求；
+- 搜索等阻塞等待使用 deadline.wait()，取消后立刻返回。
+"""
+
+import contextvars
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+import httpx
+from langchain_core.runnables import RunnableConfig
+
+
+class DeadlineExceeded(Exception):
+    """截止时间已到或请求已被取消"""
+
+
+class Deadline:
+    """带取消能力的截止时间"""
+
+    def __init__(self, timeout_seconds: float):
+        self.timeout_seconds = timeout_seconds
+        self.expires_at = time.monotonic() + timeout_seconds
+        self._cancelled = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self.reason = ""
+        # 到期时自动触发取消，让进行中的请求也能被中止
+        self._timer = threading.Timer(timeout_seconds, self.cancel, kwargs={"reason": "timeout"})
+        self._timer.daemon = True
+        self._timer.start()
+
+    def remaining(self) -> float:
+        """剩余秒数（已取消时为 0）"""
+        if self._cancelled.is_set():
+            return 0.0
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self._cancelled.is_set() or time.monotonic() >= self.expires_at
+
+    def cancel(self, reason: str = "cancelled"):
+        """取消请求：唤醒所有等待者并执行已注册的中止回调"""
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self.reason = reason
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        self._timer.cancel()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ 取消回调执行失败: {e}")
+
+    def release(self):
+        """正常完成后停止计时器（不触发取消）"""
+        self._timer.cancel()
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """注册取消回调，返回注销函数；若已取消则立即执行"""
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._callbacks.append(callback)
+
+                def unregister():
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+                return unregister
+        callback()
+        return lambda: None
+
+    def check(self, where: str = ""):
+        """已过期则抛出 DeadlineExceeded"""
+        if self.expired:
+            if not self._cancelled.is_set():
+                self.cancel(reason="timeout")
+            raise DeadlineExceeded(f"{where or '请求'} 已超时或被取消 ({self.reason})")
+
+    def wait(self, seconds: float) -> bool:
+        """可被取消打断的 sleep，返回 False 表示期间已取消/过期"""
+        self._cancelled.wait(min(seconds, self.remaining()))
+        return not self.expired
+
+
+# 当前线程（上下文）激活的截止时间
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar(
+    "current_deadline", default=None
+)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def get_deadline(config: Optional[RunnableConfig]) -> Optional[Deadline]:
+    """从 LangGraph config 中取出截止时间"""
+    if not config:
+        return None
+    return config.get("configurable", {}).get("deadline")
+
+
+@contextmanager
+def activate(deadline: Optional[Deadline]):
+    """在当前上下文中激活截止时间"""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def deadline_node(fn):
+    """包装图节点：进入节点前检查截止时间，并在节点执行期间激活它"""
+    accepts_config = "config" in inspect.signature(fn).parameters
+
+    def wrapper(state, config: RunnableConfig):
+        deadline = get_deadline(config)
+        if deadline is not None:
+            deadline.check(f"节点 {fn.__name__}")
+        with activate(deadline):
+            return fn(state, config) if accepts_config else fn(state)
+
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+
+class _DeadlineStream(httpx.SyncByteStream):
+    """响应流包装：关闭时注销取消回调"""
+
+    def __init__(self, stream, unregister: Callable[[], None]):
+        self._stream = stream
+        self._unregister = unregister
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        self._unregister()
+        self._stream.close()
+
+
+class DeadlineTransport(httpx.BaseTransport):
+    """按当前截止时间收紧超时，并在取消时关闭进行中的响应"""
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        deadline = current_deadline()
+        if deadline is None:
+            return self._transport.handle_request(request)
+
+        deadline.check("HTTP 请求")
+        remaining = deadline.remaining()
+        timeout = dict(request.extensions.get("timeout", {}))
+        for key in ("connect", "read", "write", "pool"):
+            value = timeout.get(key)
+            timeout[key] = remaining if value is None else min(value, remaining)
+        request.extensions["timeout"] = timeout
+
+        response = self._transport.handle_request(request)
+        stream = response.stream
+        unregister = deadline.on_cancel(stream.close)
+        response.stream = _DeadlineStream(stream, unregister)
+        return response
+
+    def close(self):
+        self._transport.close()
@@ -7,22 +7,16 @@ import time
 import asyncio
 from typing import List, Tuple, Optional, Dict
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
-from langgraph_memorey import app, stream_with_timeout, parse_thinking_content
+from langgraph_memorey import app, stream_with_timeout, load_memory_block
+from thread_mailbox import COALESCED, turn_mailbox
+from thinking_parser import ThinkingStreamParser, render_thinking_markdown
 
 DB_PATH = "ai_memory.db"
 
 def get_formatted_memories(user_id: str) -> str:
     try:
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.execute(
-            "SELECT memory_id, content FROM user_memories WHERE user_id = ? ORDER BY updated_at DESC", 
-            (user_id,)
-        )
-        rows = cursor.fetchall()
-        conn.close()
-        if not rows: return "📭 目前数据库中无记录。"
-        return "\n\n".join([f"📌 {r['memory_id']}\n   └ {r['content']}" for r in rows])
+        # 物化的展示块（记忆写入时重建），与提示词共用同一份缓存
+        return load_memory_block(user_id)["display"]
     except Exception as e:
         return f"读取记忆出错: {str(e)}"
 
@@ -35,18 +29,21 @@ def chat_stream_real(user_id: str, user_input: str, history: List[Dict[str, str]
     history.append({"role": "assistant", "content": ""})
     
     trace_steps = ["🚀 开始流式推理..."]
+    # 同一用户上一轮尚未结束时，本轮在该会话的邮箱中排队
+    queued = turn_mailbox.depth(f"thread_{user_id}")
+    if queued:
+        trace_steps.append(f"📬 前面还有 {queued} 个轮次，排队中...")
     
     yield history, "\n".join(trace_steps), get_formatted_memories(user_id), ""
     
     start_time = time.time()
     accumulated_content = ""
-    thinking_content = ""
-    final_answer = ""
-    in_thinking = False
+    # 增量解析思考标签，生成过程中实时渲染折叠的思考区
+    thinking_parser = ThinkingStreamParser()
     
     try:
         # 使用真正的流式响应
-        from langgraph_memorey import get_streaming_response
+        from langgraph_memorey import get_ordered_streaming_response
         
         # 开始调用之前，显示搜索状态
         if enable_search:
@@ -58,14 +55,20 @@ def chat_stream_real(user_id: str, user_input: str, history: List[Dict[str, str]
             yield history, "\n".join(trace_steps), get_formatted_memories(user_id), ""
         
         chunk_count = 0
-        for chunk in get_streaming_response(user_id, user_input, enable_search):
+        # 连按回车时，排队中的上一条输入与本条合并成一轮回答
+        for chunk in get_ordered_streaming_response(user_id, user_input, enable_search, coalesce=True):
+            if chunk is COALESCED:
+                history[-1]["content"] = "📬 已与下一条消息合并回答"
+                trace_steps.append("📬 排队中的消息已合并进下一轮")
+                yield history, "\n".join(trace_steps), get_formatted_memories(user_id), ""
+                return
             if chunk:
                 chunk_count += 1
                 accumulated_content += chunk
-                
-                # 简化处理逻辑，先不处理thinking标签
-                # 直接显示累积的内容
-                history[-1]["content"] = accumulated_content
+                thinking_parser.feed(chunk)
+                history[-1]["content"] = render_thinking_markdown(
+                    thinking_parser.thinking, thinking_parser.answer, generating=thinking_parser.in_thinking
+                )
                 
                 # 实时更新界面
                 elapsed_time = time.time() - start_time
@@ -76,6 +79,8 @@ def chat_stream_real(user_id: str, user_input: str, history: List[Dict[str, str]
                     f"📦 已收到 {chunk_count} 个chunk",
                     f"📝 当前长度: {len(accumulated_content)} 字符"
                 ]
+                if thinking_parser.in_thinking:
+                    current_trace.append("🤔 模型思考中...")
                 
                 # 如果启用了搜索，添加搜索完成的提示
                 if enable_search and chunk_count > 1:
@@ -85,30 +90,9 @@ def chat_stream_real(user_id: str, user_input: str, history: List[Dict[str, str]
                 # 添加小延迟，让用户能看到打字效果
                 time.sleep(0.02)
         
-        # 处理thinking标签（在流式完成后）
-        thinking_tags = ['<thinking>', '<思考>', '<recollection>']
-        has_thinking = any(tag in accumulated_content for tag in thinking_tags)
-        
-        if has_thinking:
-            thinking_content, final_answer = parse_thinking_content(accumulated_content)
-            
-            if thinking_content:
-                # 重新格式化显示
-                display_content = f"""
-<details>
-<summary>🤔 思考过程 (点击展开/折叠)</summary>
-
-{thinking_content}
-
-</details>
-
-**💡 最终回答：**
-
-{final_answer}"""
-                history[-1]["content"] = display_content
-        else:
-            # 如果没有thinking标签，使用完整的累积内容作为最终回答
-            history[-1]["content"] = accumulated_content
+        # 流结束：输出被暂存的尾部，收起思考区
+        thinking_parser.finish()
+        history[-1]["content"] = render_thinking_markdown(thinking_parser.thinking, thinking_parser.answer)
         
         # 完成
         total_time = time.time() - start_time
@@ -125,9 +109,30 @@ def chat_stream_real(user_id: str, user_input: str, history: List[Dict[str, str]
             f"📚 对话历史: {history_count} 条记录"
         ]
         
-        # 使用AI判断是否需要记忆更新
+        # 响应缓存命中率（仅在开启缓存时显示）
+        from response_cache import RESPONSE_CACHE_ENABLED, response_cache
+        if RESPONSE_CACHE_ENABLED:
+            cache_stats = response_cache.stats()
+            final_trace.append(f"🗃️ 响应缓存命中率: {cache_stats['hit_rate']:.0%} ({cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']})")
+        
+        # 本地记忆门控节省的 LLM 调用
+        from memory_gate import memory_gate
+        gate_stats = memory_gate.stats()
+        if gate_stats["bootstrap"]:
+            final_trace.append("🚦 记忆门控: 观察模式（尚未训练门控模型，不跳过 LLM 调用）")
+        elif gate_stats["checked"]:
+            final_trace.append(f"🚦 记忆门控节省 LLM 调用: {gate_stats['skipped']}/{gate_stats['checked']} ({gate_stats['saved_ratio']:.0%})")
+        
+        # 并发相同搜索 / 记忆分类被合并掉的调用
+        from single_flight import classify_flight, search_flight
+        for label, flight in (("搜索", search_flight), ("记忆分类", classify_flight)):
+            flight_stats = flight.stats()
+            if flight_stats["suppressed"]:
+                final_trace.append(f"🔗 合并重复{label}调用: {flight_stats['suppressed']}/{flight_stats['calls']}")
+        
+        # 使用AI判断是否需要记忆更新（后台记忆更新已为本轮做过门控和记录，这里不重复计数）
         from langgraph_memorey import check_if_needs_memory_update
-        has_memory_info = check_if_needs_memory_update(user_input)
+        has_memory_info = check_if_needs_memory_update(user_input, record=False)
         
         if has_memory_info:
             final_trace.append("🧠 AI检测到个人信息，正在后台更新记忆...")
@@ -137,7 +142,7 @@ def chat_stream_real(user_id: str, user_input: str, history: List[Dict[str, str]
         # 等待一下让记忆更新完成，然后刷新记忆显示
         if has_memory_info:
             time.sleep(3)  # 给AI分析和记忆更新更多时间
-            final_trace[-2] = "✅ 智能记忆更新完成"
+            final_trace[-1] = "✅ 智能记忆更新完成"
             yield history, "\n".join(final_trace), get_formatted_memories(user_id), ""
         
     except Exception as e:
@@ -165,7 +170,7 @@ def chat_stream_backup(user_id: str, user_input: str, history: List[Dict[str, st
     
     try:
         # 使用带超时的流式处理
-        stream_generator = stream_with_timeout(input_state, config, timeout_seconds=20)
+        stream_generator = stream_with_timeout(input_state, config, timeout_seconds=20, coalesce=True)
         
         # 处理流式结果
         has_valid_response = False
@@ -182,6 +187,12 @@ def chat_stream_backup(user_id: str, user_input: str, history: List[Dict[str, st
             
             chunk, is_timeout = stream_result
             
+            if chunk is COALESCED:
+                history[-1]["content"] = "📬 已与下一条消息合并回答"
+                trace_steps.append("📬 排队中的消息已合并进下一轮")
+                yield history, "\n".join(trace_steps), get_formatted_memories(user_id), ""
+                return
+            
             if is_timeout:
                 # 处理超时情况
                 history[-1]["content"] = "⏰ 思考时间过长，为了更好的用户体验，我将提供一个快速回答。如果您需要更详细的分析，请重新提问。"
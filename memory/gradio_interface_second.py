@@ -5,7 +5,10 @@ import gradio as gr
 import time
 import sqlite3
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
-from langgraph_memorey_second import app, parse_thinking_content
+from langgraph_memorey_second import app
+from thinking_parser import ThinkingStreamParser, render_thinking_markdown
+from request_profiler import profile_generator
+from memory_schema import get_memory_block
 
 DB_PATH = "ai_memory.db"
 
@@ -13,10 +16,10 @@ def get_formatted_memories(user_id: str) -> str:
     try:
         # 使用只读连接避免与写事务冲突
         conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
-        cursor = conn.execute("SELECT memory_id, content FROM user_memories WHERE user_id = ? ORDER BY updated_at DESC", (user_id,))
-        rows = cursor.fetchall()
+        # 物化的展示块（记忆写入时重建），一次主键查询
+        display = get_memory_block(conn, user_id)["display"]
         conn.close()
-        return "\n\n".join([f"📌 {r[0]}\n   └ {r[1]}" for r in rows]) or "📭 目前数据库中无记录。"
+        return display
     except Exception as e:
         return f"📭 暂无记忆记录 ({str(e)})"
 
@@ -38,14 +41,18 @@ def chat_stream_real(user_id: str, user_input: str, history: list, enable_search
     
     # 跟踪累积的助手回答
     accumulated_content = ""
+    # 增量解析思考标签，生成过程中实时渲染折叠的思考区
+    thinking_parser = ThinkingStreamParser()
 
     try:
         # 1. 使用 stream_mode="messages" 获取真正的 Token 级流式输出
-        for msg, metadata in app.stream(
+        stream = app.stream(
             {"messages": [HumanMessage(content=user_input)]}, 
             config, 
             stream_mode="messages"  # 关键改动：切换到 messages 模式
-        ):
+        )
+        # 指定用户或被抽样时对本轮开启性能分析，否则原样返回
+        for msg, metadata in profile_generator(user_id, stream, label="app.stream"):
             # 2. 从 metadata 中获取节点信息（用于追踪执行轨迹）
             node_name = metadata.get("langgraph_node")
             if node_name and f"📍 节点: {node_name}" not in trace_steps:
@@ -100,13 +107,16 @@ def chat_stream_real(user_id: str, user_input: str, history: list, enable_search
                 if not hasattr(msg, "tool_calls") or not msg.tool_calls:
                     # 使用自己的累积变量来确保正确追加
                     accumulated_content += msg.content
-                    history[-1]["content"] = accumulated_content
+                    thinking_parser.feed(msg.content)
+                    history[-1]["content"] = render_thinking_markdown(
+                        thinking_parser.thinking, thinking_parser.answer, generating=thinking_parser.in_thinking
+                    )
                     yield history, "\n".join(trace_steps), get_formatted_memories(user_id), ""
 
-        # 最终处理思考内容折叠
-        thinking, final_ans = parse_thinking_content(history[-1]["content"])
-        if thinking:
-            history[-1]["content"] = f"<details><summary>🤔 思考过程 (点击展开)</summary>\n\n{thinking}\n\n</details>\n\n{final_ans}"
+        # 流结束：输出被暂存的尾部，收起思考区
+        if accumulated_content:
+            thinking_parser.finish()
+            history[-1]["content"] = render_thinking_markdown(thinking_parser.thinking, thinking_parser.answer)
         
         trace_steps.append("✅ 响应生成完毕")
         yield history, "\n".join(trace_steps), get_formatted_memories(user_id), ""
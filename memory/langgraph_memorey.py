@@ -2,24 +2,45 @@
 import sqlite3
 from typing import Annotated, TypedDict, Literal, Dict, Optional, Any, List
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, RemoveMessage, ToolMessage
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, ToolMessage
 from langchain_core.tools import tool
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.store.sqlite import SqliteStore
+from tool_registry import ToolRegistry, get_llm_pool, get_shared_http_client
+from llm_pool import PRIORITY_BACKGROUND, PRIORITY_CLASSIFY, hedged, prioritized
+from deadline import Deadline, DeadlineExceeded, activate, current_deadline, deadline_node
+from response_cache import RESPONSE_CACHE_ENABLED, context_digest, is_follow_up, response_cache
+from page_fetch import SEARCH_FETCH_PAGES, fetch_relevant_passages
+from search_postprocess import rank_and_dedupe
+from thinking_parser import split_thinking
+from memory_gate import memory_gate
+from request_profiler import attach as attach_profile, current_session as current_profile_session, profiled_turn
+from memory_importance import AccessTracker, enforce_budget, prune_processed_tool_calls
+from memory_schema import delete_memory, ensure_memory_schema, fetch_memories, get_memory_block, upsert_memory
+from checkpoint_store import make_checkpointer
+from cache_coherence import SCOPE_HISTORY, SCOPE_MEMORY, CacheCoherence, touch_user
+from single_flight import classify_flight, search_flight, search_key
+from thread_compaction import ThreadCompactor
+from tool_executor import ToolExecutor
+from thread_mailbox import COALESCED, merge_turn_inputs, merge_user_inputs, turn_mailbox
+from cassette import make_search_client, replaying as cassette_replaying
 
 # 导入搜索功能
 import asyncio
 import concurrent.futures
+import threading
 import time
 try:
     from ddgs import DDGS
     SEARCH_AVAILABLE = True
 except ImportError:
-    print("⚠️ 搜索功能不可用：请安装 ddgs 包 (pip install ddgs)")
-    SEARCH_AVAILABLE = False
+    DDGS = None
+    # 回放磁带时搜索结果来自磁带，不需要 ddgs
+    SEARCH_AVAILABLE = cassette_replaying()
+    if not SEARCH_AVAILABLE:
+        print("⚠️ 搜索功能不可用：请安装 ddgs 包 (pip install ddgs)")
 
 # --- 1. 定义状态与工具 ---
 
@@ -30,7 +51,8 @@ class State(TypedDict):
 # 创建独立的SQLite连接
 # 连接1：用于工作流的checkpoint和存储
 workflow_conn = sqlite3.connect("ai_memory.db", check_same_thread=False)
-checkpointer = SqliteSaver(workflow_conn)
+# 大消息正文按内容寻址只存一次，checkpoint 负载压缩（CHECKPOINT_COMPRESSION=0 关闭）
+checkpointer = make_checkpointer(workflow_conn)
 sqlite_store = SqliteStore(workflow_conn)
 
 # 连接2：用于用户记忆管理（避免嵌套事务问题）
@@ -38,16 +60,28 @@ memory_conn = sqlite3.connect("ai_memory.db", check_same_thread=False)
 
 # 确保记忆表存在（如果不存在则创建）
 try:
-    # 创建记忆表
+    # 创建记忆表（结构化列、类别/时间索引、历史表、使用统计列与冷表）
+    ensure_memory_schema(memory_conn)
+    # 已处理的工具调用索引：reflect_and_store 据此跳过旧的工具结果，保证写入幂等
     memory_conn.execute("""
-    CREATE TABLE IF NOT EXISTS user_memories (
+    CREATE TABLE IF NOT EXISTS processed_tool_calls (
+        thread_id TEXT NOT NULL,
+        tool_call_id TEXT NOT NULL,
+        processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (thread_id, tool_call_id)
+    )
+    """)
+    # 每个用户最近的对话，多个工作进程共享
+    memory_conn.execute("""
+    CREATE TABLE IF NOT EXISTS conversation_turns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id TEXT NOT NULL,
-        memory_id TEXT NOT NULL,
-        content TEXT NOT NULL,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        PRIMARY KEY (user_id, memory_id)
+        user_message TEXT NOT NULL,
+        assistant_message TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     """)
+    memory_conn.execute("CREATE INDEX IF NOT EXISTS idx_conversation_turns_user ON conversation_turns (user_id, id)")
     memory_conn.commit()
 except sqlite3.Error as e:
     print(f"SQLite表创建错误: {e}")
@@ -55,8 +89,178 @@ except sqlite3.Error as e:
 # 内存缓存，用于提高性能
 memory_cache: Dict[str, Dict[str, Dict[str, str]]] = {}
 
-# 对话历史缓存，存储每个用户的最近对话
+# 对话历史缓存，存储每个用户的最近对话（持久化在 conversation_turns 中）
 conversation_history: Dict[str, List[Dict[str, str]]] = {}
+HISTORY_LIMIT = 10
+
+# 用户记忆版本号：每次写入 user_memories 后递增，响应缓存据此失效
+memory_versions: Dict[str, int] = {}
+
+# 物化记忆块缓存：{"version", "prompt", "display"}，来自 user_memory_blocks
+memory_blocks: Dict[str, Dict[str, Any]] = {}
+
+def bump_memory_version(user_id: str):
+    """记录用户记忆发生变化，并清除该用户的记忆块缓存和响应缓存"""
+    memory_versions[user_id] = memory_versions.get(user_id, 0) + 1
+    memory_blocks.pop(user_id, None)
+    response_cache.invalidate_user(user_id)
+
+def load_memory_block(user_id: str) -> Dict[str, Any]:
+    """读取用户格式化好的记忆块（提示词 / 展示文本），优先使用内存缓存"""
+    cache_coherence.check()
+    block = memory_blocks.get(user_id)
+    if block is not None:
+        return block
+    try:
+        block = get_memory_block(memory_conn, user_id)
+        memory_blocks[user_id] = block
+    except sqlite3.Error as e:
+        print(f"读取记忆块错误: {e}")
+        block = {"version": 0, "prompt": "", "display": ""}
+    return block
+
+def load_user_memories(user_id: str) -> Dict[str, Dict[str, str]]:
+    """读取用户的长期记忆（不含已归档的冷记忆，最新的在前），优先使用内存缓存"""
+    # 其他进程写入过该用户的记忆时，先失效本进程的缓存
+    cache_coherence.check()
+    if user_id in memory_cache:
+        return memory_cache[user_id]
+    user_memories = {}
+    try:
+        # 从SQLite数据库查询（走 (user_id, updated_at) 索引）
+        for row in fetch_memories(memory_conn, user_id):
+            user_memories[row["memory_id"]] = {"data": row["content"], "category": row["category"]}
+        # 更新缓存
+        memory_cache[user_id] = user_memories
+    except sqlite3.Error as e:
+        print(f"从SQLite检索记忆错误: {e}")
+    return user_memories
+
+# 记忆写入在共享连接上按批提交，避免不同线程的语句混进同一个事务
+memory_write_lock = threading.Lock()
+
+# processed_tool_calls 的过期记录随记忆写入顺带清理，最多每隔该秒数清理一次
+PROCESSED_CALL_PRUNE_INTERVAL = 3600.0
+_last_processed_call_prune = 0.0
+
+# 记忆使用记录，按批次写回（与记忆写入共用锁）
+access_tracker = AccessTracker(memory_conn, write_lock=memory_write_lock)
+
+def invalidate_user_cache(user_id: str, scope: str):
+    """其他进程修改了用户数据：只失效该用户对应的缓存"""
+    if scope == SCOPE_MEMORY:
+        memory_cache.pop(user_id, None)
+        bump_memory_version(user_id)
+    elif scope == SCOPE_HISTORY:
+        conversation_history.pop(user_id, None)
+
+# 跨进程缓存一致性：每轮开始时检查 PRAGMA data_version
+cache_coherence = CacheCoherence(memory_conn, invalidate_user_cache, write_lock=memory_write_lock)
+
+def load_conversation_history(user_id: str) -> List[Dict[str, str]]:
+    """读取用户最近的对话，优先使用内存缓存"""
+    cache_coherence.check()
+    if user_id in conversation_history:
+        return conversation_history[user_id]
+    history = []
+    try:
+        rows = memory_conn.execute(
+            "SELECT user_message, assistant_message FROM conversation_turns WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, HISTORY_LIMIT)
+        ).fetchall()
+        history = [{"user": u, "assistant": a} for u, a in reversed(rows)]
+        conversation_history[user_id] = history
+    except sqlite3.Error as e:
+        print(f"从SQLite读取对话历史错误: {e}")
+    return history
+
+def append_conversation_turn(user_id: str, user_message: str, assistant_message: str):
+    """保存一轮对话，只保留最近 HISTORY_LIMIT 轮，并通知其他进程"""
+    with memory_write_lock:
+        try:
+            memory_conn.execute(
+                "INSERT INTO conversation_turns (user_id, user_message, assistant_message) VALUES (?, ?, ?)",
+                (user_id, user_message, assistant_message)
+            )
+            memory_conn.execute("""
+                DELETE FROM conversation_turns WHERE user_id = ? AND id NOT IN (
+                    SELECT id FROM conversation_turns WHERE user_id = ? ORDER BY id DESC LIMIT ?
+                )
+            """, (user_id, user_id, HISTORY_LIMIT))
+            touch_user(memory_conn, user_id, SCOPE_HISTORY)
+            memory_conn.commit()
+        except sqlite3.Error as e:
+            memory_conn.rollback()
+            print(f"保存对话历史错误: {e}")
+    
+    history = conversation_history.get(user_id)
+    if history is not None:
+        history.append({"user": user_message, "assistant": assistant_message})
+        del history[:-HISTORY_LIMIT]
+
+def apply_memory_writes(user_id: str, writes: List[tuple], thread_id: Optional[str] = None,
+                        source: str = "tool") -> int:
+    """
+    在一个事务中应用一批记忆写入，返回实际应用的条数。
+    writes 中每项为 (tool_call_id, action, memory_id, content)，action 为 'upsert' 或 'delete'。
+    给定 thread_id 时，已处理过的 tool_call_id 会被跳过，并在同一事务中记入 processed_tool_calls，
+    重复执行同一批写入不会产生副作用。source 记录写入来源（tool / extractor / manual），
+    每次变更都会追加到 user_memories_history。
+    """
+    with memory_write_lock:
+        if thread_id:
+            call_ids = [w[0] for w in writes if w[0]]
+            if call_ids:
+                done = {row[0] for row in memory_conn.execute(
+                    f"SELECT tool_call_id FROM processed_tool_calls WHERE thread_id = ? "
+                    f"AND tool_call_id IN ({','.join('?' * len(call_ids))})",
+                    [thread_id, *call_ids]
+                )}
+                writes = [w for w in writes if w[0] not in done]
+        if not writes:
+            return 0
+        
+        try:
+            for _, action, memory_id, content in writes:
+                if action == "upsert":
+                    upsert_memory(memory_conn, user_id, memory_id, content, source=source)
+                elif action == "delete":
+                    delete_memory(memory_conn, user_id, memory_id, source=source)
+            if thread_id:
+                memory_conn.executemany(
+                    "INSERT OR IGNORE INTO processed_tool_calls (thread_id, tool_call_id) VALUES (?, ?)",
+                    [(thread_id, w[0]) for w in writes if w[0]]
+                )
+            memory_conn.commit()
+        except sqlite3.Error:
+            memory_conn.rollback()
+            raise
+        if any(w[1] == "upsert" for w in writes):
+            enforce_budget(memory_conn, user_id)
+        global _last_processed_call_prune
+        if thread_id and time.monotonic() - _last_processed_call_prune >= PROCESSED_CALL_PRUNE_INTERVAL:
+            _last_processed_call_prune = time.monotonic()
+            prune_processed_tool_calls(memory_conn)
+    
+    # 清除内存缓存，下次读取时按新的顺序与类别重新加载
+    memory_cache.pop(user_id, None)
+    bump_memory_version(user_id)
+    return len(writes)
+
+def upsert_user_memory(user_id: str, memory_id: str, content: str, source: str = "manual"):
+    """写入（或覆盖）一条用户记忆，同时更新内存缓存和记忆版本；超出预算时归档低价值记忆"""
+    apply_memory_writes(user_id, [(None, "upsert", memory_id, content)], source=source)
+
+def delete_user_memory(user_id: str, memory_id: str, source: str = "manual") -> bool:
+    """删除一条用户记忆，返回是否确实删除了记录"""
+    with memory_write_lock:
+        deleted = delete_memory(memory_conn, user_id, memory_id, source=source)
+        memory_conn.commit()
+    
+    # 更新内存缓存
+    memory_cache.pop(user_id, None)
+    bump_memory_version(user_id)
+    return deleted
 
 @tool
 def manage_memory(content: Any, action: Literal['upsert', 'delete'], memory_id: str):
@@ -81,12 +285,21 @@ def web_search(queries: List[str], max_results: int = 3):
     if not SEARCH_AVAILABLE:
         return "搜索功能不可用：请安装 ddgs 包"
     
+    # 当前轮次的截止时间（由节点或调用方激活），取消后不再发起新的查询
+    deadline = current_deadline()
+    
     def _single_search_sync(query: str):
         """执行单个搜索查询"""
         try:
             print(f"🔍 搜索: {query}")
-            ddgs = DDGS()
-            time.sleep(0.5)  # 避免被限制
+            if deadline is not None:
+                # DDGS 的超时不超过剩余时间；等待可被取消打断
+                ddgs = make_search_client(DDGS, timeout=max(1, min(5, int(deadline.remaining()))))
+                if not deadline.wait(0.5):  # 避免被限制
+                    return {"query": query, "error": "cancelled", "count": 0}
+            else:
+                ddgs = make_search_client(DDGS)
+                time.sleep(0.5)  # 避免被限制
             
             results = []
             try:
@@ -104,8 +317,9 @@ def web_search(queries: List[str], max_results: int = 3):
                 import traceback
                 traceback.print_exc()
                 
-                # 尝试英文搜索
-                if any('\u4e00' <= char <= '\u9fff' for char in query):
+                # 尝试英文搜索（已取消时跳过）
+                cancelled = deadline is not None and deadline.expired
+                if not cancelled and any('\u4e00' <= char <= '\u9fff' for char in query):
                     english_query = _translate_to_english(query)
                     print(f"🔄 尝试英文搜索: {english_query}")
                     try:
@@ -146,26 +360,46 @@ def web_search(queries: List[str], max_results: int = 3):
     # 执行搜索
     all_results = []
     for query in queries[:5]:  # 限制最多5个查询
-        result = _single_search_sync(query)
-        all_results.append(result)
+        if deadline is not None and deadline.expired:
+            print(f"⏹️ 截止时间已到，跳过剩余搜索")
+            break
+        # 其他请求正在搜索相同（归一化后）的搜索词时，等待并共享它的结果
+        try:
+            result = search_flight.do(search_key(query, max_results), lambda: _single_search_sync(query))
+        except DeadlineExceeded:
+            print(f"⏹️ 截止时间已到，跳过剩余搜索")
+            break
+        all_results.append({**result, "query": query})
     
-    # 格式化返回结果
-    formatted_results = []
-    for result in all_results:
-        if result.get("count", 0) > 0:
-            formatted_results.append(f"搜索词: {result['query']}")
-            for i, item in enumerate(result['results'], 1):
-                title = item.get('title', 'N/A')
-                body = item.get('body', 'N/A')[:200]
-                href = item.get('href', 'N/A')
-                formatted_results.append(f"{i}. {title}")
-                formatted_results.append(f"   摘要: {body}...")
-                formatted_results.append(f"   链接: {href}")
-            formatted_results.append("")
-    
-    if not formatted_results:
+    # 跨查询合并结果：近似去重、按与搜索词的相关性排序，并限制总 Token 数
+    search_question = " ".join(queries)
+    raw_items = [
+        {**item, "query": result["query"]}
+        for result in all_results if result.get("count", 0) > 0
+        for item in result["results"]
+    ]
+    ranked_items = rank_and_dedupe(raw_items, search_question, max_results=max_results * 2)
+    
+    if not ranked_items:
         return "未找到相关搜索结果"
     
+    # 可选：抓取排名靠前的页面正文，只保留与查询相关的段落
+    page_passages = {}
+    if SEARCH_FETCH_PAGES:
+        page_passages = fetch_relevant_passages([item.get('href') for item in ranked_items], search_question)
+    
+    # 格式化返回结果
+    formatted_results = [f"搜索词: {', '.join(r['query'] for r in all_results if r.get('count', 0) > 0)}"]
+    for i, item in enumerate(ranked_items, 1):
+        title = item.get('title', 'N/A')
+        body = (item.get('body') or 'N/A')[:200]
+        href = item.get('href', 'N/A')
+        formatted_results.append(f"{i}. {title}")
+        formatted_results.append(f"   摘要: {body}...")
+        if href in page_passages:
+            formatted_results.append(f"   正文: {page_passages[href]}")
+        formatted_results.append(f"   链接: {href}")
+    
     return "\n".join(formatted_results)
 
 # --- 2. 节点逻辑实现 ---
@@ -175,11 +409,48 @@ llm = ChatOpenAI(
     model="",  # 设置一个默认模型名称
     temperature=0.7,
     openai_api_key="EMPTY",  # vLLM 不需要实际 Key，但字段不能为 None
-    openai_api_base="http://192.168.1.159:7022/v1",  # 指向 vLLM 的服务地址
+    openai_api_base=get_llm_pool().base_url,  # 指向 vLLM 服务（VLLM_BASE_URLS 配置多个副本时在传输层路由）
     max_tokens=4000,  # 设置默认的最大token数
-    timeout=30  # 设置超时时间
+    timeout=30,  # 设置超时时间
+    streaming=True,  # 流式读取响应，取消时可立即中止进行中的请求
+    http_client=get_shared_http_client()  # 复用长连接
 )
 
+# 非交互式调用的调度优先级：负载高时让位于用户正在等待的回答，后台提取/摘要可被拒绝
+classify_llm = prioritized(llm, PRIORITY_CLASSIFY)
+background_llm = prioritized(llm, PRIORITY_BACKGROUND)
+
+# 预先绑定常用工具集合，避免每轮对话重复生成工具 schema
+tool_registry = ToolRegistry(llm, [manage_memory, web_search])
+tool_registry.warmup(["manage_memory"], ["manage_memory", "web_search"])
+
+# 一条 AI 消息中的工具调用并发执行（每个调用有超时，web_search 另有并发上限）
+tool_executor = ToolExecutor([manage_memory, web_search])
+
+def memory_tool_writes(tool_calls) -> List[tuple]:
+    """从 manage_memory 调用中取出有效的记忆写入 (tool_call_id, action, memory_id, content)"""
+    return [
+        (tool_call["id"], tool_call["args"]["action"], tool_call["args"]["memory_id"],
+         tool_call["args"].get("content", ""))
+        for tool_call in tool_calls
+        if tool_call["name"] == "manage_memory"
+        and tool_call["args"].get("action") in ("upsert", "delete") and tool_call["args"].get("memory_id")
+    ]
+
+def memory_write_batch(user_id: str, thread_id: Optional[str] = None):
+    """manage_memory 的批量处理函数：同一条消息中的全部记忆写入在一个事务中应用"""
+    def handle(tool_calls):
+        writes = memory_tool_writes(tool_calls)
+        applied = apply_memory_writes(user_id, writes, thread_id) if writes else 0
+        print(f"💾 本轮记忆写入: 应用 {applied} 条，跳过已处理 {len(writes) - applied} 条")
+        by_id = {w[0]: w for w in writes}
+        return [
+            manage_memory.func(by_id[tc["id"]][3], by_id[tc["id"]][1], by_id[tc["id"]][2])
+            if tc["id"] in by_id else "记忆参数无效，未写入"
+            for tc in tool_calls
+        ]
+    return handle
+
 def call_model_stream(state: State, config: RunnableConfig):
     """简化的模型调用节点，返回完整内容"""
     # 获取用户信息
@@ -187,26 +458,10 @@ def call_model_stream(state: State, config: RunnableConfig):
     enable_search = config["configurable"].get("enable_search", False)
     
     # 从SQLite存储中检索长期记忆
-    user_memories = {}
-    try:
-        # 先从缓存中获取
-        if user_id in memory_cache:
-            user_memories = memory_cache[user_id]
-        else:
-            # 从SQLite数据库查询
-            cursor = memory_conn.execute("SELECT memory_id, content FROM user_memories WHERE user_id = ?", (user_id,))
-            for row in cursor.fetchall():
-                memory_id, content = row
-                user_memories[memory_id] = {"data": content}
-            # 更新缓存
-            memory_cache[user_id] = user_memories
-    except sqlite3.Error as e:
-        print(f"从SQLite检索记忆错误: {e}")
+    user_memories = load_user_memories(user_id)
     
-    memories_list = []
-    for mem_id, mem_data in user_memories.items():
-        memories_list.append(f"- {mem_id}: {mem_data['data']}")
-    info = "\n".join(memories_list)
+    # 物化的记忆块：写入时才重新格式化，这里只是一次缓存查询
+    info = load_memory_block(user_id)["prompt"]
     
     # 构建系统提示
     search_instruction = ""
@@ -225,30 +480,50 @@ def call_model_stream(state: State, config: RunnableConfig):
     
     messages = [SystemMessage(content=system_prompt)] + state["messages"]
     
-    # 检查是否需要记忆功能
     user_message = state['messages'][-1].content.lower() if state['messages'] else ""
-    needs_memory = any(keyword in user_message for keyword in ['我叫', '我是', '我的名字', '我住在', '我工作', '我喜欢'])
+    
+    # 响应缓存（可选）：只对直接回答用户提问的 agent 调用生效，工具后的回复不缓存
+    use_cache = config["configurable"].get("use_response_cache", RESPONSE_CACHE_ENABLED)
+    cache_query = None
+    if use_cache and state["messages"] and isinstance(state["messages"][-1], HumanMessage):
+        cache_query = state["messages"][-1].content
+        # 追问的回答取决于前文，前文摘要并入作用域；独立问题不带前文，同一会话里重复提问可以命中
+        context = context_digest(str(m.content) for m in state["messages"][:-1]) if is_follow_up(cache_query) else ""
+        cache_scope = f"agent|search={bool(enable_search and SEARCH_AVAILABLE)}|ctx={context}"
+        cache_version = memory_versions.get(user_id, 0)
+        cached_answer = response_cache.get(user_id, cache_query, cache_version, scope=cache_scope)
+        if cached_answer is not None:
+            print(f"🗃️ 响应缓存命中 (命中率: {response_cache.stats()['hit_rate']:.0%})")
+            from langchain_core.messages import AIMessage
+            return {"messages": [AIMessage(content=cached_answer)]}
     
     try:
         print(f"🔍 调用模型...")
         print(f"🔍 搜索功能: {'启用' if enable_search else '禁用'}")
         
-        # 统一工具调用方式：根据搜索开关和记忆需求决定绑定的工具列表
-        tools_to_bind = [manage_memory]  # 始终包含记忆管理工具
-        if enable_search and SEARCH_AVAILABLE:
-            tools_to_bind.append(web_search)  # 启用搜索时添加搜索工具
-        
+        # 统一工具调用方式：始终包含记忆管理工具，根据搜索开关决定是否添加搜索工具
+        tools_to_bind = ["manage_memory"]
         print(f"🧠 启用记忆工具...")
         if enable_search and SEARCH_AVAILABLE:
+            tools_to_bind.append("web_search")  # 启用搜索时添加搜索工具
             print("🔍 启用搜索工具...")
         
-        # 使用统一的工具绑定调用
-        response = llm.bind_tools(tools_to_bind).invoke(messages)
+        # 使用缓存的工具绑定调用；流式界面对首字延迟敏感，开启对冲请求
+        response = hedged(tool_registry.get(*tools_to_bind)).invoke(messages)
         
         print(f"🔍 模型响应完成，长度: {len(response.content) if response.content else 0}")
+        # 记录本轮用到的记忆（批量写回）
+        access_tracker.record_relevant(user_id, user_memories, f"{user_message} {response.content or ''}")
+        
+        # 只缓存没有工具调用的完整回答
+        if cache_query and response.content and not getattr(response, "tool_calls", None):
+            response_cache.put(user_id, cache_query, cache_version, response.content, scope=cache_scope)
         return {"messages": [response]}
         
     except Exception as e:
+        deadline = current_deadline()
+        if deadline is not None and deadline.expired:
+            raise DeadlineExceeded(f"模型调用已取消: {e}") from e
         print(f"❌ 模型调用失败: {e}")
         import traceback
         traceback.print_exc()
@@ -262,26 +537,10 @@ def call_model(state: State, config: RunnableConfig):
     user_id = config["configurable"].get("user_id", "default_user")
     
     # 从SQLite存储中检索长期记忆
-    user_memories = {}
-    try:
-        # 先从缓存中获取
-        if user_id in memory_cache:
-            user_memories = memory_cache[user_id]
-        else:
-            # 从SQLite数据库查询
-            cursor = memory_conn.execute("SELECT memory_id, content FROM user_memories WHERE user_id = ?", (user_id,))
-            for row in cursor.fetchall():
-                memory_id, content = row
-                user_memories[memory_id] = {"data": content}
-            # 更新缓存
-            memory_cache[user_id] = user_memories
-    except sqlite3.Error as e:
-        print(f"从SQLite检索记忆错误: {e}")
+    user_memories = load_user_memories(user_id)
     
-    memories_list = []
-    for mem_id, mem_data in user_memories.items():
-        memories_list.append(f"- {mem_id}: {mem_data['data']}")
-    info = "\n".join(memories_list)
+    # 物化的记忆块：写入时才重新格式化，这里只是一次缓存查询
+    info = load_memory_block(user_id)["prompt"]
     
     system_prompt = f"""你是一个友好的AI助手，具备长期记忆功能。
 
@@ -300,22 +559,23 @@ def call_model(state: State, config: RunnableConfig):
         print(f"🔍 调用模型，消息数量: {len(messages)}")
         print(f"🔍 最后一条用户消息: {state['messages'][-1].content if state['messages'] else 'None'}")
         
-        # 检查是否需要记忆功能（如果用户提到个人信息）
         user_message = state['messages'][-1].content.lower() if state['messages'] else ""
-        needs_memory = any(keyword in user_message for keyword in ['我叫', '我是', '我的名字', '我住在', '我工作', '我喜欢'])
         
-        # 统一工具调用方式：始终包含记忆管理工具
-        tools_to_bind = [manage_memory]  # 始终包含记忆管理工具
+        # 统一工具调用方式：始终包含记忆管理工具（门控只用于额外的记忆判断/提取调用）
         print("🧠 记忆工具已启用...")
         
-        # 使用统一的工具绑定调用
-        response = llm.bind_tools(tools_to_bind).invoke(messages)
+        # 使用缓存的工具绑定调用
+        response = tool_registry.get("manage_memory").invoke(messages)
         
         print(f"🔍 模型响应类型: {type(response)}")
         print(f"🔍 模型响应长度: {len(response.content) if hasattr(response, 'content') and response.content else 0}")
+        access_tracker.record_relevant(user_id, user_memories, f"{user_message} {response.content or ''}")
         
         return {"messages": [response]}
     except Exception as e:
+        deadline = current_deadline()
+        if deadline is not None and deadline.expired:
+            raise DeadlineExceeded(f"模型调用已取消: {e}") from e
         print(f"❌ 模型调用失败: {e}")
         import traceback
         traceback.print_exc()
@@ -325,100 +585,67 @@ def call_model(state: State, config: RunnableConfig):
         return {"messages": [fallback_response]}
 
 def tool_node(state: State, config: RunnableConfig):
-    """工具执行节点：执行工具调用并返回ToolMessage"""
+    """工具执行节点：并发执行本条消息的全部工具调用，按调用顺序返回ToolMessage
+    
+    manage_memory 只返回确认，记忆由随后的 reflect 节点在一个事务中写入。
+    """
     last_msg = state["messages"][-1]
     
     if not hasattr(last_msg, 'tool_calls') or not last_msg.tool_calls:
         return {"messages": []}
     
-    tool_messages = []
-    for tool_call in last_msg.tool_calls:
-        if tool_call["name"] == "manage_memory":
-            args = tool_call["args"]
-            
-            # 执行工具调用
-            result = manage_memory.invoke(args)
-            
-            # 创建ToolMessage
-            tool_msg = ToolMessage(
-                content=result,
-                tool_call_id=tool_call["id"],
-                name=tool_call["name"]
-            )
-            tool_messages.append(tool_msg)
-    
-    return {"messages": tool_messages}
+    return {"messages": tool_executor.run(last_msg.tool_calls)}
 
 
 def reflect_and_store(state: State, config: RunnableConfig):
-    """后台反思节点：解析工具调用结果并更新SQLite存储"""
+    """后台反思节点：解析本轮新的工具调用结果并更新SQLite存储"""
     user_id = config["configurable"].get("user_id", "default_user")
+    thread_id = config["configurable"].get("thread_id")
     
-    # 获取所有工具消息
-    tool_messages = [msg for msg in state["messages"] if isinstance(msg, ToolMessage)]
-    if not tool_messages:
+    # 只看本轮的工具结果：从末尾向前收集 ToolMessage，直到发起这些调用的 AI 消息，
+    # 之前轮次已处理过的工具结果不再扫描（O(本轮新消息)）
+    new_results = set()
+    trigger = None
+    for msg in reversed(state["messages"]):
+        if isinstance(msg, ToolMessage):
+            new_results.add(msg.tool_call_id)
+        elif getattr(msg, "tool_calls", None):
+            trigger = msg
+            break
+        else:
+            break
+    if not new_results or trigger is None:
         return {"messages": []}
     
-    # 解析工具调用结果并更新数据库
-    for tool_msg in tool_messages:
-        # 找到对应的工具调用
-        for msg in reversed(state["messages"]):
-            if hasattr(msg, 'tool_calls') and msg.tool_calls:
-                for tool_call in msg.tool_calls:
-                    if tool_call["id"] == tool_msg.tool_call_id and tool_call["name"] == "manage_memory":
-                        args = tool_call["args"]
-                        
-                        try:
-                            if args["action"] == "upsert":
-                                # 更新SQLite数据库（使用独立连接）
-                                memory_conn.execute(
-                                    "INSERT OR REPLACE INTO user_memories (user_id, memory_id, content) VALUES (?, ?, ?)",
-                                    (user_id, args["memory_id"], args["content"])
-                                )
-                                memory_conn.commit()
-                                
-                                # 更新内存缓存
-                                if user_id not in memory_cache:
-                                    memory_cache[user_id] = {}
-                                memory_cache[user_id][args["memory_id"]] = {"data": args["content"]}
-                                
-                            elif args["action"] == "delete":
-                                # 从SQLite数据库删除（使用独立连接）
-                                memory_conn.execute(
-                                    "DELETE FROM user_memories WHERE user_id = ? AND memory_id = ?",
-                                    (user_id, args["memory_id"])
-                                )
-                                memory_conn.commit()
-                                
-                                # 更新内存缓存
-                                if user_id in memory_cache and args["memory_id"] in memory_cache[user_id]:
-                                    del memory_cache[user_id][args["memory_id"]]
-                                    # 如果用户没有记忆了，从缓存中删除用户
-                                    if not memory_cache[user_id]:
-                                        del memory_cache[user_id]
-                                        
-                        except sqlite3.Error as e:
-                            print(f"SQLite更新错误: {e}")
-                        break
+    # 本轮的记忆写入作为一个幂等批次应用
+    writes = memory_tool_writes([tc for tc in trigger.tool_calls if tc["id"] in new_results])
+    if writes:
+        try:
+            applied = apply_memory_writes(user_id, writes, thread_id)
+            print(f"💾 本轮记忆写入: 应用 {applied} 条，跳过已处理 {len(writes) - applied} 条")
+        except sqlite3.Error as e:
+            print(f"SQLite更新错误: {e}")
         
     return {"messages": [SystemMessage(content="[System: Memory Database Updated]")]}
 
-def summarize_cleanup(state: State):
-    """自动清理节点：如果消息过长，压缩历史并删除旧消息"""
-    if len(state["messages"]) <= 10:
-        return {"messages": [], "summary": state.get("summary", "")}
-
-    # 生成摘要逻辑
+def summarize_history(messages: List[BaseMessage]) -> str:
+    """生成会话摘要（在后台压缩线程中调用）"""
     summary_prompt = "请根据对话历史更新总结，确保剔除已被纠正的错误，只保留最新事实。"
-    response = llm.invoke(state["messages"] + [HumanMessage(content=summary_prompt)], max_tokens=150)
-    
-    # 物理删除旧消息（RemoveMessage 指令）
-    delete_old_msgs = [RemoveMessage(id=m.id) for m in state["messages"][:-3]]
-    
-    return {
-        "summary": response.content,
-        "messages": delete_old_msgs
-    }
+    response = background_llm.invoke(list(messages) + [HumanMessage(content=summary_prompt)], max_tokens=150)
+    return response.content
+
+# 摘要在后台生成，不占用户等待时间；结果在该会话下一轮开始时应用
+compactor = ThreadCompactor(summarize_history)
+
+def apply_compaction(state: State, config: RunnableConfig):
+    """轮次开始节点：应用上一轮后台生成的摘要，删除已被摘要覆盖的旧消息"""
+    update = compactor.take(config["configurable"].get("thread_id"), state["messages"])
+    return update or {"messages": []}
+
+def summarize_cleanup(state: State, config: RunnableConfig):
+    """自动清理节点：如果消息过长，安排后台压缩历史（本轮不等待）"""
+    compactor.schedule(config["configurable"].get("thread_id"), state["messages"])
+    return {"messages": []}
 
 # --- 3. 构建工作流图 ---
 
@@ -429,15 +656,18 @@ def route_after_agent(state: State):
     return "cleanup"
 
 # 注册节点
+# 每个节点都经过 deadline_node 包装：进入前检查截止时间，超时/取消后不再继续执行
 workflow = StateGraph(State)
-workflow.add_node("agent", call_model_stream)  # 使用流式节点
-workflow.add_node("tool", tool_node)  # 添加工具执行节点
-workflow.add_node("reflect", reflect_and_store)
-workflow.add_node("reply_after_tool", call_model_stream)  # 工具后回复也使用流式
-workflow.add_node("cleanup", summarize_cleanup)
+workflow.add_node("compact", deadline_node(apply_compaction))  # 应用上一轮的后台压缩结果
+workflow.add_node("agent", deadline_node(call_model_stream))  # 使用流式节点
+workflow.add_node("tool", deadline_node(tool_node))  # 添加工具执行节点
+workflow.add_node("reflect", deadline_node(reflect_and_store))
+workflow.add_node("reply_after_tool", deadline_node(call_model_stream))  # 工具后回复也使用流式
+workflow.add_node("cleanup", deadline_node(summarize_cleanup))
 
 # 设定连线
-workflow.add_edge(START, "agent")
+workflow.add_edge(START, "compact")
+workflow.add_edge("compact", "agent")
 
 # 条件路由：如果有工具调用则到tool节点，否则到cleanup节点
 workflow.add_conditional_edges(
@@ -483,8 +713,9 @@ def get_langgraph_response(user_id: str, user_input: str, enable_search: bool =
         print(f"🔍 使用LangGraph工作流...")
         print(f"🔍 搜索功能: {'启用' if enable_search else '禁用'}")
         
-        # 使用工作流处理
-        result = app.invoke(input_state, config)
+        # 同一会话的轮次经邮箱按序执行，不同会话并行
+        result = turn_mailbox.submit(config["configurable"]["thread_id"],
+                                     lambda state: app.invoke(state, config), input_state).result()
         
         # 获取最后的AI回复
         if result and "messages" in result:
@@ -501,32 +732,29 @@ def get_langgraph_response(user_id: str, user_input: str, enable_search: bool =
         return f"抱歉，处理过程中出现错误: {str(e)}"
 
 # 添加一个专门的流式处理函数
-def get_streaming_response(user_id: str, user_input: str, enable_search: bool = False):
-    """直接的流式响应函数，绕过LangGraph工作流"""
+@profiled_turn(lambda *args, **kwargs: kwargs.get("user_id", args[0] if args else ""))
+def get_streaming_response(user_id: str, user_input: str, enable_search: bool = False,
+                           timeout_seconds: float = 120, deadline: Optional[Deadline] = None,
+                           use_cache: Optional[bool] = None, typing_delay: float = 0.01):
+    """直接的流式响应函数，绕过LangGraph工作流
+    
+    整个轮次受 deadline 约束：超时或调用方关闭生成器时，进行中的 LLM 请求和搜索被中止。
+    use_cache 为 None 时按 RESPONSE_CACHE_ENABLED 决定是否使用响应缓存。
+    typing_delay 为模拟打字效果的每块间隔，非界面调用方可传 0。
+    """
+    if deadline is None:
+        deadline = Deadline(timeout_seconds)
+    if use_cache is None:
+        use_cache = RESPONSE_CACHE_ENABLED
+    completed = False
     # 从SQLite存储中检索长期记忆
-    user_memories = {}
-    try:
-        # 先从缓存中获取
-        if user_id in memory_cache:
-            user_memories = memory_cache[user_id]
-        else:
-            # 从SQLite数据库查询
-            cursor = memory_conn.execute("SELECT memory_id, content FROM user_memories WHERE user_id = ?", (user_id,))
-            for row in cursor.fetchall():
-                memory_id, content = row
-                user_memories[memory_id] = {"data": content}
-            # 更新缓存
-            memory_cache[user_id] = user_memories
-    except sqlite3.Error as e:
-        print(f"从SQLite检索记忆错误: {e}")
+    user_memories = load_user_memories(user_id)
     
-    memories_list = []
-    for mem_id, mem_data in user_memories.items():
-        memories_list.append(f"- {mem_id}: {mem_data['data']}")
-    info = "\n".join(memories_list)
+    # 物化的记忆块：写入时才重新格式化，这里只是一次缓存查询
+    info = load_memory_block(user_id)["prompt"]
     
     # 获取用户的对话历史（最近5次）
-    user_history = conversation_history.get(user_id, [])
+    user_history = load_conversation_history(user_id)
     recent_history = user_history[-5:] if len(user_history) > 5 else user_history
     
     # 构建历史对话文本
@@ -575,14 +803,28 @@ def get_streaming_response(user_id: str, user_input: str, enable_search: bool =
         # 为大模型绑定搜索工具，让它可以在需要时请求搜索
         if enable_search and SEARCH_AVAILABLE:
             print(f"🔧 绑定搜索工具，让大模型自主决定是否需要搜索")
-            llm_with_tools = llm.bind_tools([manage_memory, web_search])
+            llm_with_tools = tool_registry.get("manage_memory", "web_search")
         else:
-            llm_with_tools = llm.bind_tools([manage_memory])
+            llm_with_tools = tool_registry.get("manage_memory")
+        
+        # 响应缓存（可选）：同一用户在记忆未变化时重复提问，直接返回上次的回答
+        # 只有追问才把最近对话的摘要并入作用域，见 response_cache.is_follow_up
+        context = (context_digest(f"{conv['user']}\n{conv['assistant']}" for conv in recent_history)
+                   if is_follow_up(user_input) else "")
+        cache_scope = f"stream|search={bool(enable_search and SEARCH_AVAILABLE)}|ctx={context}"
+        cache_version = memory_versions.get(user_id, 0)
+        cached_answer = response_cache.get(user_id, user_input, cache_version, scope=cache_scope) if use_cache else None
         
-        # 第一次调用大模型，让它决定是否需要搜索
-        print(f"🧠 第一次调用大模型，等待决策...")
-        first_response = llm_with_tools.invoke(messages)
-        print(f"✅ 第一次调用完成，响应类型: {type(first_response)}")
+        if cached_answer is not None:
+            print(f"🗃️ 响应缓存命中 (命中率: {response_cache.stats()['hit_rate']:.0%})，跳过模型调用")
+            from langchain_core.messages import AIMessage
+            first_response = AIMessage(content=cached_answer)
+        else:
+            # 第一次调用大模型，让它决定是否需要搜索
+            print(f"🧠 第一次调用大模型，等待决策...")
+            with activate(deadline):
+                first_response = hedged(llm_with_tools).invoke(messages)
+            print(f"✅ 第一次调用完成，响应类型: {type(first_response)}")
         
         # 检查大模型是否请求了搜索工具调用
         search_performed = False
@@ -591,49 +833,39 @@ def get_streaming_response(user_id: str, user_input: str, enable_search: bool =
         if hasattr(first_response, 'tool_calls') and first_response.tool_calls:
             print(f"🔧 检测到工具调用: {first_response.tool_calls}")
             
-            # 检查是否是搜索工具调用
-            for tool_call in first_response.tool_calls:
-                if tool_call["name"] == "web_search":
-                    print(f"🔍 大模型请求搜索: {tool_call['args']}")
-                    
-                    # 执行搜索
-                    try:
-                        queries = tool_call["args"].get("queries", [])
-                        max_results = tool_call["args"].get("max_results", 3)
-                        
-                        # 确保有搜索关键词
-                        if not queries:
-                            # 如果没有指定关键词，使用用户输入
-                            queries = [user_input]
-                        
-                        print(f"📡 执行搜索查询: {queries}")
-                        search_result = web_search.invoke({"queries": queries, "max_results": max_results})
-                        print(f"✅ 搜索完成，结果长度: {len(search_result)}")
-                        print(f"🔍 搜索结果: {search_result[:200]}...")
-                        
-                        # 创建工具消息，将搜索结果返回给大模型
-                        from langchain_core.messages import ToolMessage
-                        tool_message = ToolMessage(
-                            content=search_result,
-                            tool_call_id=tool_call["id"],
-                            name=tool_call["name"]
-                        )
-                        
-                        # 将工具消息添加到对话历史
-                        messages.append(first_response)
-                        messages.append(tool_message)
-                        
-                        # 第二次调用大模型，使用搜索结果生成最终回答
-                        print(f"🧠 第二次调用大模型，基于搜索结果生成回答...")
-                        final_response = llm_with_tools.invoke(messages)
-                        print(f"✅ 第二次调用完成，响应长度: {len(final_response.content) if hasattr(final_response, 'content') and final_response.content else 0}")
-                        
-                        search_performed = True
-                        break
-                    except Exception as e:
-                        print(f"❌ 搜索执行失败: {e}")
-                        import traceback
-                        traceback.print_exc()
+            # 没有指定搜索关键词的搜索调用使用用户输入
+            tool_calls = [
+                {**tc, "args": {**tc["args"], "queries": tc["args"].get("queries") or [user_input]}}
+                if tc["name"] == "web_search" else tc
+                for tc in first_response.tool_calls
+            ]
+            try:
+                # 全部工具调用并发执行；记忆写入在一个事务中应用
+                deadline.check("工具调用")
+                with activate(deadline):
+                    tool_messages = tool_executor.run(
+                        tool_calls, batch_handlers={"manage_memory": memory_write_batch(user_id, f"thread_{user_id}")}
+                    )
+                print(f"✅ 工具调用完成: {[(m.name, m.status, len(m.content)) for m in tool_messages]}")
+                
+                # 将工具结果返回给大模型
+                messages.append(first_response)
+                messages.extend(tool_messages)
+                
+                # 第二次调用大模型，基于工具结果生成最终回答
+                print(f"🧠 第二次调用大模型，基于工具结果生成回答...")
+                deadline.check("第二次模型调用")
+                with activate(deadline):
+                    final_response = llm_with_tools.invoke(messages)
+                print(f"✅ 第二次调用完成，响应长度: {len(final_response.content) if hasattr(final_response, 'content') and final_response.content else 0}")
+                
+                search_performed = any(tc["name"] == "web_search" for tc in tool_calls)
+            except Exception as e:
+                if deadline.expired:
+                    raise
+                print(f"❌ 工具执行失败: {e}")
+                import traceback
+                traceback.print_exc()
         
         # 对最终响应进行流式输出
         if hasattr(final_response, 'content') and final_response.content:
@@ -642,32 +874,35 @@ def get_streaming_response(user_id: str, user_input: str, enable_search: bool =
             print(f"📤 响应内容: {full_content}")
             print(f"📤 响应长度: {len(full_content)}")
             
-            # 模拟流式输出效果
-            for i in range(0, len(full_content), 2):
-                chunk = full_content[i:i+2]
-                # print(f"📤 Yield chunk: '{chunk}'")
-                yield chunk
-                time.sleep(0.01)  # 添加小延迟，营造打字效果
+            if cached_answer is not None:
+                # 缓存命中：立即整块输出
+                yield full_content
+            else:
+                # 模拟流式输出效果
+                for i in range(0, len(full_content), 2):
+                    chunk = full_content[i:i+2]
+                    # print(f"📤 Yield chunk: '{chunk}'")
+                    yield chunk
+                    # 添加小延迟，营造打字效果；调用方放弃时立即醒来
+                    if typing_delay and not deadline.wait(typing_delay):
+                        deadline.check("流式输出")
+                
+                if use_cache and not getattr(final_response, "tool_calls", None):
+                    response_cache.put(user_id, user_input, cache_version, full_content, scope=cache_scope)
             
             print(f"📤 流式输出完成")
         else:
             print(f"⚠️  未收到有效的大模型响应")
             yield "抱歉，我没有收到有效的回复。请稍后再试。"
         
-        # 保存当前对话到历史记录
-        if user_id not in conversation_history:
-            conversation_history[user_id] = []
-        
-        conversation_history[user_id].append({
-            "user": user_input,
-            "assistant": full_content if 'full_content' in locals() else ""
-        })
+        # 保存当前对话到历史记录（只保留最近10次对话，用户+助手为一次）
+        assistant_reply = full_content if 'full_content' in locals() else ""
+        append_conversation_turn(user_id, user_input, assistant_reply)
         
-        # 只保留最近10次对话（用户+助手为一次）
-        if len(conversation_history[user_id]) > 10:
-            conversation_history[user_id] = conversation_history[user_id][-10:]
+        print(f"💾 已保存对话历史")
         
-        print(f"💾 已保存对话历史，当前总数: {len(conversation_history[user_id])}")
+        # 记录本轮用到的记忆（批量写回）
+        access_tracker.record_relevant(user_id, user_memories, f"{user_input} {assistant_reply}")
         
         # 流式输出完成后，异步处理记忆更新
         import threading
@@ -681,19 +916,58 @@ def get_streaming_response(user_id: str, user_input: str, enable_search: bool =
             except Exception as e:
                 print(f"❌ 延迟记忆更新失败: {e}")
         
-        # 启动后台线程处理记忆更新
-        memory_thread = threading.Thread(target=delayed_memory_update)
-        memory_thread.daemon = True
-        memory_thread.start()
+        # 启动后台线程处理记忆更新（缓存命中说明同样的输入在当前记忆版本下已分析过）
+        if cached_answer is None:
+            memory_thread = threading.Thread(target=delayed_memory_update)
+            memory_thread.daemon = True
+            memory_thread.start()
+        completed = True
         
     except Exception as e:
-        print(f"❌ 流式调用失败: {e}")
-        import traceback
-        traceback.print_exc()
-        yield "抱歉，我遇到了一些技术问题。请稍后再试。"
+        if deadline.expired:
+            print(f"⏹️ 流式调用已取消: {e}")
+            yield "⏰ 处理时间过长，本次请求已取消，请重新提问。"
+        else:
+            print(f"❌ 流式调用失败: {e}")
+            import traceback
+            traceback.print_exc()
+            yield "抱歉，我遇到了一些技术问题。请稍后再试。"
+    finally:
+        # 正常完成只停止计时器；异常或调用方放弃（GeneratorExit）时取消，释放进行中的请求
+        if completed:
+            deadline.release()
+        else:
+            deadline.cancel(reason="abandoned")
+
+def get_ordered_streaming_response(user_id: str, user_input: str, enable_search: bool = False,
+                                   coalesce: bool = False, timeout_seconds: float = 120,
+                                   deadline: Optional[Deadline] = None, **kwargs):
+    """按会话串行的 get_streaming_response：同一用户的轮次经邮箱依次执行，不同用户并行
+
+    coalesce=True 时，排队中尚未开始的上一条输入与本条合并成一轮回答，
+    被合并的调用只产出一次 COALESCED。其余参数原样传给 get_streaming_response。
+    截止时间在这里创建（排队等待计入超时）；调用方关闭生成器时立即取消它，
+    工作线程中进行中的 LLM 请求与工具调用随之中止，会话邮箱随即空出给下一轮。
+    """
+    if deadline is None:
+        deadline = Deadline(timeout_seconds)
+    try:
+        yield from turn_mailbox.stream(
+            f"thread_{user_id}",
+            lambda text: get_streaming_response(user_id, text, enable_search, deadline=deadline, **kwargs),
+            user_input,
+            merge=merge_user_inputs if coalesce else None,
+            on_abandon=lambda: deadline.cancel(reason="abandoned"),
+        )
+    finally:
+        # 被合并进下一轮时 get_streaming_response 不会执行，由这里停止计时器
+        deadline.release()
 
 def update_memory_from_conversation(user_id: str, user_input: str, ai_response: str):
     """从对话中提取并更新用户记忆 - 使用AI智能判断"""
+    # 本地门控：明显不含个人信息的轮次不调用提取模型
+    if not memory_gate.should_extract(user_input):
+        return
     
     # 使用AI来判断是否包含需要记忆的信息
     analysis_prompt = f"""请分析用户的话，判断是否包含需要长期记忆的个人信息。
@@ -731,12 +1005,14 @@ def update_memory_from_conversation(user_id: str, user_input: str, ai_response:
         analysis_messages = [SystemMessage(content=analysis_prompt)]
         
         # 使用AI分析用户输入
-        analysis_response = llm.invoke(analysis_messages)
+        analysis_response = background_llm.invoke(analysis_messages)
         analysis_result = analysis_response.content.strip()
         
         print(f"🧠 AI分析结果: {analysis_result}")
+        has_memory_info = bool(analysis_result and analysis_result != "无" and ":" in analysis_result)
+        memory_gate.log_decision(user_input, has_memory_info)
         
-        if analysis_result and analysis_result != "无" and ":" in analysis_result:
+        if has_memory_info:
             # 解析AI的分析结果
             try:
                 memory_type, memory_content = analysis_result.split(":", 1)
@@ -748,16 +1024,7 @@ def update_memory_from_conversation(user_id: str, user_input: str, ai_response:
                     
                     # 更新数据库
                     try:
-                        memory_conn.execute(
-                            "INSERT OR REPLACE INTO user_memories (user_id, memory_id, content) VALUES (?, ?, ?)",
-                            (user_id, memory_type, memory_content)
-                        )
-                        memory_conn.commit()
-                        
-                        # 更新内存缓存
-                        if user_id not in memory_cache:
-                            memory_cache[user_id] = {}
-                        memory_cache[user_id][memory_type] = {"data": memory_content}
+                        upsert_user_memory(user_id, memory_type, memory_content, source="extractor")
                         
                         print(f"✅ 记忆已更新: {memory_type} -> {memory_content}")
                         
@@ -770,8 +1037,15 @@ def update_memory_from_conversation(user_id: str, user_input: str, ai_response:
     except Exception as e:
         print(f"❌ AI记忆分析失败: {e}")
 
-def check_if_needs_memory_update(user_input: str):
-    """使用AI判断是否需要记忆更新"""
+def check_if_needs_memory_update(user_input: str, record: bool = True):
+    """使用AI判断是否需要记忆更新（本地门控判定无关时不调用模型）
+
+    record=False 用于本轮已由 update_memory_from_conversation 做过门控和记录的场景：
+    只查看门控结果，不计入门控统计，也不写入训练日志。
+    """
+    if not (memory_gate.should_extract(user_input) if record else memory_gate.peek(user_input)):
+        return False
+    
     check_prompt = f"""请判断用户的这句话是否包含需要长期记忆的个人信息。
 
 用户说: "{user_input}"
@@ -784,101 +1058,115 @@ def check_if_needs_memory_update(user_input: str):
         from langchain_core.messages import SystemMessage
         check_messages = [SystemMessage(content=check_prompt)]
         
-        check_response = llm.invoke(check_messages)
-        result = check_response.content.strip()
+        # 提示词只取决于用户输入，相同输入的并发判断共用一次模型调用
+        result = classify_flight.do(check_prompt, lambda: classify_llm.invoke(check_messages).content).strip()
         
+        if record:
+            memory_gate.log_decision(user_input, "是" in result)
         return "是" in result
         
     except Exception as e:
         print(f"❌ AI记忆检查失败: {e}")
         return False
 
-def stream_with_timeout(input_state, config, timeout_seconds=20):
+@profiled_turn(lambda input_state, config, *args, **kwargs: config.get("configurable", {}).get("user_id", ""))
+def stream_with_timeout(input_state, config, timeout_seconds=20, coalesce=False):
     """
     带超时的流式处理函数 - 生成器版本，支持实时流式输出
+    
+    截止时间通过 config 传入工作流的每个节点；超时或调用方关闭生成器时取消它，
+    工作线程中进行中的 LLM 请求、搜索和后续节点（含数据库写入）随之中止。
+    同一 thread_id 的轮次经邮箱按序执行，排队等待计入超时时间；
+    coalesce=True 时排队中尚未开始的上一轮与本轮合并，上一轮产出 (COALESCED, False) 后结束。
+    产出 (chunk, False)；超时产出 (None, True)；出错产出 None。
     """
-    import threading
     import queue
     
+    deadline = Deadline(timeout_seconds)
+    config = {**config, "configurable": {**config.get("configurable", {}), "deadline": deadline}}
     result_queue = queue.Queue()
-    exception_queue = queue.Queue()
     
-    def run_stream():
+    # 开启了单请求分析时，工作线程也加入同一个分析会话
+    profile_session = current_profile_session()
+    
+    def run_stream(state):
+        # 排队期间已超时或被放弃的轮次不再执行
+        if deadline.expired:
+            result_queue.put(('error', "排队期间已取消"))
+            return
         try:
-            for chunk in app.stream(input_state, config, stream_mode="updates"):
-                result_queue.put(('chunk', chunk))
+            with attach_profile(profile_session):
+                for chunk in app.stream(state, config, stream_mode="updates"):
+                    result_queue.put(('chunk', chunk))
             result_queue.put(('done', None))
         except Exception as e:
-            exception_queue.put(e)
+            if deadline.expired:
+                print(f"⏹️ 工作流已取消: {e}")
             result_queue.put(('error', str(e)))
     
-    # 启动流式处理线程
-    thread = threading.Thread(target=run_stream)
-    thread.daemon = True
-    thread.start()
-    
-    start_time = time.time()
+    # 交给该会话的邮箱执行：同一会话的上一轮结束后才开始
+    future = turn_mailbox.submit(
+        config["configurable"].get("thread_id"), run_stream, input_state,
+        merge=merge_turn_inputs if coalesce else None,
+    )
+    future.add_done_callback(
+        lambda f: result_queue.put(('coalesced', None)) if not f.cancelled() and f.exception() is None
+        and f.result() is COALESCED else None
+    )
     
-    while True:
-        try:
-            # 检查是否超时
-            elapsed = time.time() - start_time
-            if elapsed > timeout_seconds:
-                return None, True  # 超时
-            
-            # 尝试获取结果，设置短超时避免阻塞
+    finished = False
+    try:
+        while True:
+            # 阻塞等待下一个结果，直到截止时间（事件驱动，无轮询）
             try:
-                item_type, item_data = result_queue.get(timeout=0.1)
-                
-                if item_type == 'chunk':
-                    yield item_data, False  # 返回chunk和非超时标志
-                elif item_type == 'done':
-                    return  # 正常完成
-                elif item_type == 'error':
-                    return None, False  # 错误，但不是超时
-                    
+                item_type, item_data = result_queue.get(timeout=deadline.remaining())
             except queue.Empty:
-                continue  # 继续等待
-                
-        except Exception as e:
-            print(f"流式处理异常: {e}")
-            return None, False
+                deadline.cancel(reason="timeout")
+                yield None, True  # 超时
+                return
+            
+            if item_type == 'chunk':
+                yield item_data, False  # 返回chunk和非超时标志
+            elif item_type == 'done':
+                finished = True
+                return  # 正常完成
+            elif item_type == 'coalesced':
+                finished = True
+                yield COALESCED, False  # 已合并进下一轮
+                return
+            elif item_type == 'error':
+                if deadline.expired:
+                    yield None, True  # 因超时被中止
+                else:
+                    yield None  # 错误，但不是超时
+                return
+    finally:
+        # 超时、出错或调用方放弃时取消截止时间，工作线程立即停止后续工作
+        if finished:
+            deadline.release()
+        else:
+            deadline.cancel(reason="abandoned")
+            future.cancel()  # 仍在排队时直接出队
 
 def parse_thinking_content(content):
     """
     解析思考内容，分离思考过程和最终回答
     支持多种思考标签：<thinking>、<思考>、<recollection>
+    流式场景请直接使用 thinking_parser.ThinkingStreamParser 增量解析
     """
     if not content:
         return "", ""
-    
-    # 定义支持的思考标签对
-    thinking_tags = [
-        ('<thinking>', '</thinking>'),
-        ('<思考>', '</思考>'),
-        ('<recollection>', '</recollection>')
-    ]
-    
-    # 尝试找到任何一种思考标签
-    for start_tag, end_tag in thinking_tags:
-        thinking_start = content.find(start_tag)
-        thinking_end = content.find(end_tag)
-        
-        if thinking_start != -1 and thinking_end != -1:
-            # 提取思考过程
-            thinking_content = content[thinking_start + len(start_tag):thinking_end].strip()
-            # 提取最终回答
-            final_answer = content[thinking_end + len(end_tag):].strip()
-            return thinking_content, final_answer
-    
-    # 如果没有找到任何思考标签，整个内容作为最终回答
-    return "", content
+    return split_thinking(content)
 
 # 添加退出处理函数，确保数据库连接被正确关闭
 import atexit
 
 def close_connections():
     try:
+        access_tracker.flush()
+        compactor.shutdown()
+        tool_executor.shutdown()
+        turn_mailbox.shutdown(wait=False)
         workflow_conn.close()
         memory_conn.close()
         print("✅ SQLite数据库连接已关闭")
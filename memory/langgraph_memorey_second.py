@@ -7,29 +7,30 @@ from langchain_core.tools import tool
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.prebuilt import ToolNode
 import concurrent.futures
 from typing import List, Dict, Any
 import time
 from ddgs import DDGS
+from tool_registry import ToolRegistry, get_llm_pool, get_shared_http_client
+from page_fetch import SEARCH_FETCH_PAGES, fetch_relevant_passages
+from search_postprocess import rank_and_dedupe
+from thinking_parser import split_thinking
+from memory_importance import AccessTracker, enforce_budget
+from memory_schema import delete_memory, ensure_memory_schema, get_memory_block, upsert_memory
+from checkpoint_store import make_checkpointer
+from single_flight import search_flight, search_key
+from cassette import make_search_client
 
 ## --- 数据库与状态定义 ---
 DB_PATH = "ai_memory.db"
 workflow_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-checkpointer = SqliteSaver(workflow_conn)
-
-# 确保用户记忆表存在
-workflow_conn.execute("""
-CREATE TABLE IF NOT EXISTS user_memories (
-    user_id TEXT NOT NULL,
-    memory_id TEXT NOT NULL,
-    content TEXT NOT NULL,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    PRIMARY KEY (user_id, memory_id)
-)
-""")
-workflow_conn.commit()
+# 搜索结果留在状态中，按内容寻址只存一次（CHECKPOINT_COMPRESSION=0 关闭）
+checkpointer = make_checkpointer(workflow_conn)
+
+# 确保用户记忆表存在（结构化列、索引、历史表、使用统计列与冷表）
+ensure_memory_schema(workflow_conn)
+access_tracker = AccessTracker(workflow_conn)
 
 class State(TypedDict):
     messages: Annotated[list[BaseMessage], add_messages]
@@ -55,7 +56,7 @@ def web_search(queries: List[str], max_results: int = 3):
             try:
                 # 每次搜索稍微随机延迟，降低被封概率
                 time.sleep(0.2 * (attempt + 1)) 
-                with DDGS() as ddgs:
+                with make_search_client(DDGS) as ddgs:
                     # 使用 list 强转生成器，捕获可能的 API 错误
                     search_results = list(ddgs.text(query, max_results=max_results))
                     return search_results if search_results else []
@@ -66,27 +67,37 @@ def web_search(queries: List[str], max_results: int = 3):
                 print(f"⚠️ 搜索 '{query}' 第 {attempt+1} 次尝试失败: {e}")
         return []
 
+    def _shared_search(query: str) -> List[Dict[str, Any]]:
+        """其他请求正在搜索相同（归一化后）的关键词时，等待并共享它的结果"""
+        return search_flight.do(search_key(query, max_results), lambda: _safe_single_search(query))
+
     # 1. 使用线程池并发执行搜索，显著提升速度
     all_raw_results = []
     # 限制总搜索词条数，防止任务过重
     active_queries = queries[:3] 
     
     with concurrent.futures.ThreadPoolExecutor(max_workers=len(active_queries)) as executor:
-        future_to_query = {executor.submit(_safe_single_search, q): q for q in active_queries}
+        future_to_query = {executor.submit(_shared_search, q): q for q in active_queries}
         for future in concurrent.futures.as_completed(future_to_query):
             all_raw_results.extend(future.result())
 
-    # 2. 结果去重 (基于 URL)
-    unique_results = {}
-    for res in all_raw_results:
-        url = res.get('href')
-        if url and url not in unique_results:
-            unique_results[url] = res
+    # 2. 结果去重（URL + 跨查询近似重复）并按与搜索词的相关性排序，限制总 Token 数
+    ranked_results = rank_and_dedupe(
+        [res for res in all_raw_results if res.get('href')],
+        " ".join(active_queries),
+        max_results=max_results * 2,
+    )
+    unique_results = {res['href']: res for res in ranked_results}
 
     # 3. 格式化输出
     if not unique_results:
         return "❌ 联网搜索未找到相关结果，请尝试更换关键词或稍后再试。"
 
+    # 4. 可选：抓取前几个来源的页面正文，只保留与查询相关的段落
+    page_passages = {}
+    if SEARCH_FETCH_PAGES:
+        page_passages = fetch_relevant_passages(list(unique_results.keys()), " ".join(active_queries))
+
     formatted_parts = [f"🌐 联网搜索完成，找到 {len(unique_results)} 条唯一来源：\n"]
     for i, res in enumerate(unique_results.values(), 1):
         title = res.get('title', '无标题')
@@ -98,6 +109,8 @@ def web_search(queries: List[str], max_results: int = 3):
         
         formatted_parts.append(f"[{i}] {title}")
         formatted_parts.append(f"    内容: {clean_snippet}...")
+        if url in page_passages:
+            formatted_parts.append(f"    正文: {page_passages[url]}")
         formatted_parts.append(f"    来源: {url}\n")
 
     return "\n".join(formatted_parts)
@@ -105,19 +118,22 @@ def web_search(queries: List[str], max_results: int = 3):
 llm = ChatOpenAI(
     model="gpt-4o", 
     temperature=0.7, 
-    openai_api_base="http://192.168.1.159:7022/v1", 
+    openai_api_base=get_llm_pool().base_url,  # 多副本时在传输层路由
     openai_api_key="EMPTY",
-    streaming=True
+    streaming=True,
+    http_client=get_shared_http_client()  # 复用长连接
 )
 
+# 预先绑定工具集合，按是否启用搜索取用
+tool_registry = ToolRegistry(llm, [manage_memory, web_search])
+tool_registry.warmup(["manage_memory"], ["manage_memory", "web_search"])
+
 def call_model_node(state: State, config: RunnableConfig):
     user_id = config["configurable"].get("user_id", "default_user")
     enable_search = config["configurable"].get("enable_search", False)
     
-    # 修复 SyntaxError: 先在外部处理逻辑，避免在 f-string 中使用反斜杠
-    cursor = workflow_conn.execute("SELECT memory_id, content FROM user_memories WHERE user_id = ?", (user_id,))
-    memories_list = [f"- {r[0]}: {r[1]}" for r in cursor.fetchall()]
-    memories_str = "\n".join(memories_list) if memories_list else "暂无记录"
+    # 物化的记忆块（写入时重建），一次主键查询
+    memories_str = get_memory_block(workflow_conn, user_id)["prompt"] or "暂无记录"
     
     system_prompt = f"""你是一个具备长期记忆的助手。
 【用户记忆】：
@@ -130,13 +146,16 @@ def call_model_node(state: State, config: RunnableConfig):
 5.复杂问题请使用 <thinking>标签记录思考。如果用户提到新个人信息，请调用 manage_memory 工具。
 6.请严格使用与用户提问时完全相同的语言来回答问题，绝对不能使用其他语言。例如，如果用户用中文提问，就必须用中文回答；如果用户用英文提问，就必须用英文回答。"""
  
-    # 动态绑定工具
-    tools = [manage_memory]
+    # 动态选择已缓存的工具绑定
+    tools = ["manage_memory"]
     if enable_search:
-        tools.append(web_search)
+        tools.append("web_search")
     
-    bound_llm = llm.bind_tools(tools)
+    bound_llm = tool_registry.get(*tools)
     response = bound_llm.invoke([SystemMessage(content=system_prompt)] + state["messages"])
+    # 记录本轮用到的记忆（批量写回）
+    last_user = state["messages"][-1].content if state["messages"] else ""
+    access_tracker.record_relevant(user_id, {m: {"data": c} for m, c in rows}, f"{last_user} {response.content or ''}")
     return {"messages": [response]}
 
 from langchain_core.messages import RemoveMessage, AIMessage, ToolMessage, SystemMessage
@@ -162,16 +181,11 @@ def reflect_and_store_node(state: State, config: RunnableConfig):
                     args = tc["args"]
                     # 数据库持久化
                     if args.get("action") == "upsert":
-                        workflow_conn.execute(
-                            "INSERT OR REPLACE INTO user_memories (user_id, memory_id, content) VALUES (?, ?, ?)",
-                            (user_id, args["memory_id"], args["content"])
-                        )
+                        upsert_memory(workflow_conn, user_id, args["memory_id"], args["content"], source="tool")
                     elif args.get("action") == "delete":
-                        workflow_conn.execute(
-                            "DELETE FROM user_memories WHERE user_id = ? AND memory_id = ?",
-                            (user_id, args["memory_id"])
-                        )
+                        delete_memory(workflow_conn, user_id, args["memory_id"], source="tool")
             workflow_conn.commit()
+            enforce_budget(workflow_conn, user_id)
 
         # 核心：使用 RemoveMessage 抹除记忆相关的消息，实现静默
         # 这样回到 agent 节点时，它不知道自己刚刚存过记忆，也就不会回复“已更新”
@@ -216,9 +230,4 @@ workflow.add_edge("summarize", END)
 app = workflow.compile(checkpointer=checkpointer)
 
 def parse_thinking_content(content: str):
-    for s, e in [('<thinking>', '</thinking>'), ('<思考>', '</思考>')]:
-        if s in content and e in content:
-            thinking = content.split(s)[1].split(e)[0]
-            answer = content.split(e)[1].strip()
-            return thinking, answer
-    return "", content
+    return split_thinking(content)
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+多副本 vLLM 端点池：按在途请求数路由、健康探测与摘除、可选的对冲请求
+
+以 httpx 传输层的形式接入共享 HTTP 客户端（tool_registry.get_shared_http_client），
+ChatOpenAI 仍然只配置一个 openai_api_base（池中第一个地址），请求在传输层被改写到选中的副本：
+- 路由：选择在途请求最少的健康副本，相同时选探测延迟更低的；流式响应关闭时才算请求结束；
+- 健康检查：后台线程每 LLM_HEALTH_INTERVAL 秒 GET <base>/models，记录延迟；
+  探测或请求连续失败 LLM_MAX_FAILURES 次的副本被摘除 LLM_EJECT_SECONDS 秒，之后探测成功即恢复；
+- 连接失败（请求未发出）时自动换一个副本重试；
+- 对冲：带 X-LLM-Hedge 头的请求（见 hedged()），主副本在 LLM_HEDGE_DELAY 秒内没有返回首个数据块时，
+  向另一个副本发送同样的请求，先返回首块的一方胜出，另一方被关闭。用于首字延迟敏感的调用。
+  注意：一个对冲请求在 LLMScheduler 中只占一个并发名额，却可能向上游发出两个请求，
+  副本侧的在途请求数因此可能超过 LLM_MAX_CONCURRENCY（每个对冲中的调用最多多出一个）。
+
+LLMScheduler 包在端点池外层，按优先级对所有 LLM 调用做准入控制：
+- 优先级由 X-LLM-Priority 头给出（见 prioritized()），不带头的请求视为交互式回答；
+- 全局并发上限 LLM_MAX_CONCURRENCY，分类 / 后台各有单独的并发上限；
+- 有空位时按 交互 > 分类 > 后台 的顺序放行排队的请求；
+- 交互式请求排队数达到 LLM_SHED_QUEUE_DEPTH 时，后台请求（记忆提取、摘要）直接拒绝，
+  已在排队的后台请求也被移出；拒绝或排队超时返回 503（x-should-retry: false，不重试）；
+- snapshot() 给出各类别的排队数、在途数、等待时间与拒绝数。
+
+配置：VLLM_BASE_URLS=http://a:7022/v1,http://b:7022/v1
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional
+
+import httpx
+
+from deadline import DeadlineExceeded, current_deadline
+
+DEFAULT_BASE_URL = "http://192.168.1.159:7022/v1"
+LLM_BASE_URLS = [u.strip().rstrip("/") for u in os.environ.get("VLLM_BASE_URLS", DEFAULT_BASE_URL).split(",")
+                 if u.strip()]
+LLM_HEALTH_INTERVAL = float(os.environ.get("LLM_HEALTH_INTERVAL", "10"))
+LLM_HEALTH_TIMEOUT = 2.0
+LLM_MAX_FAILURES = int(os.environ.get("LLM_MAX_FAILURES", "3"))
+LLM_EJECT_SECONDS = float(os.environ.get("LLM_EJECT_SECONDS", "30"))
+LLM_HEDGE_DELAY = float(os.environ.get("LLM_HEDGE_DELAY", "1.0"))
+
+HEDGE_HEADER = "X-LLM-Hedge"
+
+# 调度优先级（从高到低）
+PRIORITY_INTERACTIVE = "interactive"   # 面向用户的回答生成
+PRIORITY_CLASSIFY = "classify"         # 记忆分类判断，短小但不面向用户
+PRIORITY_BACKGROUND = "background"     # 记忆提取、会话摘要
+PRIORITY_ORDER = (PRIORITY_INTERACTIVE, PRIORITY_CLASSIFY, PRIORITY_BACKGROUND)
+PRIORITY_HEADER = "X-LLM-Priority"
+
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+LLM_CLASS_LIMITS = {
+    PRIORITY_CLASSIFY: int(os.environ.get("LLM_CLASSIFY_CONCURRENCY", "4")),
+    PRIORITY_BACKGROUND: int(os.environ.get("LLM_BACKGROUND_CONCURRENCY", "2")),
+}
+LLM_SHED_QUEUE_DEPTH = int(os.environ.get("LLM_SHED_QUEUE_DEPTH", "4"))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "30"))
+
+
+class Endpoint:
+    """一个 vLLM 副本的状态"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.url = httpx.URL(base_url)
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.latency = None          # 探测 / 首包延迟的指数移动平均（秒）
+        self.requests = 0
+        self.errors = 0
+        self.hedges_won = 0
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def observe_latency(self, seconds: float):
+        self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    """响应流包装：可带上已读出的首块，关闭时（只一次）结束在途计数"""
+
+    def __init__(self, stream, on_close, first_chunk: Optional[bytes] = None, iterator=None):
+        self._stream = stream
+        self._on_close = on_close
+        self._first_chunk = first_chunk
+        self._iterator = iterator
+        self._closed = False
+
+    def __iter__(self):
+        if self._first_chunk:
+            yield self._first_chunk
+        yield from (self._iterator if self._iterator is not None else self._stream)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            try:
+                self._stream.close()
+            finally:
+                self._on_close()
+
+
+class EndpointPool(httpx.BaseTransport):
+    """把发往池地址的请求路由到多个副本的 httpx 传输层；其他地址直接透传"""
+
+    def __init__(self, base_urls: Iterable[str], transport: Optional[httpx.BaseTransport] = None,
+                 health_interval: float = LLM_HEALTH_INTERVAL, max_failures: int = LLM_MAX_FAILURES,
+                 eject_seconds: float = LLM_EJECT_SECONDS, hedge_delay: float = LLM_HEDGE_DELAY):
+        self.endpoints = [Endpoint(u.rstrip("/")) for u in base_urls]
+        if not self.endpoints:
+            raise ValueError("至少需要一个 LLM 端点")
+        self._transport = transport or httpx.HTTPTransport()
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.hedge_delay = hedge_delay
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.stats = {"requests": 0, "retries": 0, "hedged": 0, "ejections": 0}
+        self._prober = None
+        if health_interval > 0 and len(self.endpoints) > 1:
+            self._prober = threading.Thread(target=self._probe_loop, args=(health_interval,),
+                                            name="llm-health", daemon=True)
+            self._prober.start()
+
+    @property
+    def base_url(self) -> str:
+        """ChatOpenAI 使用的地址：池中第一个副本，请求会在传输层改写"""
+        return self.endpoints[0].base_url
+
+    # --- 路由 ---
+
+    def pick(self, exclude: Iterable[Endpoint] = ()) -> Optional[Endpoint]:
+        """选出在途请求最少的健康副本；全部被摘除时退回最早恢复的副本"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in exclude]
+            if not candidates:
+                return None
+            healthy = [e for e in candidates if e.healthy(now)]
+            if healthy:
+                endpoint = min(healthy, key=lambda e: (e.outstanding, e.latency if e.latency is not None else 0.0))
+            else:
+                endpoint = min(candidates, key=lambda e: e.ejected_until)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+        return endpoint
+
+    def _release(self, endpoint: Endpoint):
+        with self._lock:
+            endpoint.outstanding -= 1
+
+    def _record_failure(self, endpoint: Endpoint, reason: str):
+        with self._lock:
+            endpoint.errors += 1
+            endpoint.failures += 1
+            if endpoint.failures >= self.max_failures and endpoint.healthy(time.monotonic()):
+                endpoint.ejected_until = time.monotonic() + self.eject_seconds
+                self.stats["ejections"] += 1
+                print(f"🚫 LLM 副本 {endpoint.base_url} 连续失败 {endpoint.failures} 次，摘除 {self.eject_seconds:.0f}s ({reason})")
+
+    def _record_success(self, endpoint: Endpoint, latency: Optional[float] = None):
+        with self._lock:
+            endpoint.failures = 0
+            if latency is not None:
+                endpoint.observe_latency(latency)
+
+    def _owns(self, url: httpx.URL) -> Optional[str]:
+        """请求是否发往池地址，返回去掉池路径前缀后的相对路径"""
+        base = self.endpoints[0].url
+        if (url.scheme, url.host, url.port) != (base.scheme, base.host, base.port):
+            return None
+        if not url.path.startswith(base.path):
+            return None
+        return url.path[len(base.path):]
+
+    def _rewrite(self, request: httpx.Request, endpoint: Endpoint, suffix: str) -> httpx.Request:
+        url = endpoint.url.copy_with(path=endpoint.url.path + suffix, query=request.url.query or None)
+        headers = [(k, v) for k, v in request.headers.raw if k.decode("latin-1").lower() not in ("host", HEDGE_HEADER.lower(), PRIORITY_HEADER.lower())]
+        routed = httpx.Request(request.method, url, headers=headers, content=request.content,
+                               extensions=request.extensions)
+        return routed
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        suffix = self._owns(request.url)
+        if suffix is None:
+            return self._transport.handle_request(request)
+        request.read()   # 重试 / 对冲需要重复发送请求体
+        with self._lock:
+            self.stats["requests"] += 1
+        if request.headers.get(HEDGE_HEADER) and len(self.endpoints) > 1 and self.hedge_delay >= 0:
+            return self._send_hedged(request, suffix)
+
+        tried: List[Endpoint] = []
+        while True:
+            endpoint = self.pick(exclude=tried)
+            tried.append(endpoint)
+            try:
+                return self._send(request, endpoint, suffix)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                # 连接失败时请求尚未发出，可以安全地换副本重试
+                if len(tried) == len(self.endpoints):
+                    raise
+                with self._lock:
+                    self.stats["retries"] += 1
+                print(f"⚠️ LLM 副本 {endpoint.base_url} 连接失败，换副本重试: {e}")
+
+    def _send(self, request: httpx.Request, endpoint: Endpoint, suffix: str) -> httpx.Response:
+        start = time.monotonic()
+        try:
+            response = self._transport.handle_request(self._rewrite(request, endpoint, suffix))
+        except httpx.TransportError as e:
+            self._release(endpoint)
+            self._record_failure(endpoint, type(e).__name__)
+            raise
+        if response.status_code >= 500:
+            self._record_failure(endpoint, f"HTTP {response.status_code}")
+        else:
+            self._record_success(endpoint, time.monotonic() - start)
+        response.stream = _TrackedStream(response.stream, lambda: self._release(endpoint))
+        return response
+
+    # --- 对冲 ---
+
+    def _send_hedged(self, request: httpx.Request, suffix: str) -> httpx.Response:
+        results: "queue.Queue" = queue.Queue()
+
+        def attempt(endpoint: Endpoint):
+            try:
+                response = self._send(request, endpoint, suffix)
+            except Exception as e:
+                results.put((endpoint, None, None, None, e))
+                return
+            try:
+                iterator = iter(response.stream)
+                first_chunk = next(iterator, b"")
+            except Exception as e:
+                # 读取首块失败也要关闭响应，否则该副本的在途计数不会减少
+                response.close()
+                results.put((endpoint, None, None, None, e))
+                return
+            results.put((endpoint, response, first_chunk, iterator, None))
+
+        primary = self.pick()
+        threading.Thread(target=attempt, args=(primary,), name="llm-hedge", daemon=True).start()
+        launched = [primary]
+        pending = 1
+        error = None
+        deadline_for_hedge = time.monotonic() + self.hedge_delay
+        while pending:
+            timeout = deadline_for_hedge - time.monotonic() if len(launched) == 1 else None
+            try:
+                endpoint, response, first_chunk, iterator, exc = results.get(
+                    timeout=max(0.0, timeout) if timeout is not None else None
+                )
+            except queue.Empty:
+                endpoint = None
+                exc = None
+            if endpoint is None or exc is not None:
+                # 主副本超过对冲延迟未返回首块，或已失败：向另一个副本发送
+                if exc is not None:
+                    pending -= 1
+                    error = exc
+                if len(launched) == 1:
+                    secondary = self.pick(exclude=launched)
+                    if secondary is not None:
+                        with self._lock:
+                            self.stats["hedged"] += 1
+                        print(f"🏇 对冲请求: {primary.base_url} 首块超过 {self.hedge_delay}s，同时发往 {secondary.base_url}")
+                        threading.Thread(target=attempt, args=(secondary,), name="llm-hedge", daemon=True).start()
+                        launched.append(secondary)
+                        pending += 1
+                continue
+            pending -= 1
+            if len(launched) > 1:
+                with self._lock:
+                    endpoint.hedges_won += 1
+                # 后到的一方在返回后立即关闭
+                threading.Thread(target=self._close_losers, args=(results, pending), daemon=True).start()
+            response.stream = _TrackedStream(response.stream, lambda: None, first_chunk, iterator)
+            return response
+        raise error
+
+    @staticmethod
+    def _close_losers(results: "queue.Queue", pending: int):
+        for _ in range(pending):
+            _, response, _, _, exc = results.get()
+            if exc is None:
+                response.close()
+
+    # --- 健康探测 ---
+
+    def probe(self, endpoint: Endpoint) -> bool:
+        start = time.monotonic()
+        try:
+            response = self._transport.handle_request(httpx.Request(
+                "GET", endpoint.url.copy_with(path=endpoint.url.path + "/models"),
+                extensions={"timeout": {"connect": LLM_HEALTH_TIMEOUT, "read": LLM_HEALTH_TIMEOUT,
+                                        "write": LLM_HEALTH_TIMEOUT, "pool": LLM_HEALTH_TIMEOUT}},
+            ))
+            response.read()
+            response.close()
+            ok = response.status_code < 500
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            with self._lock:
+                recovered = not endpoint.healthy(time.monotonic())
+                endpoint.failures = 0
+                endpoint.ejected_until = 0.0
+                endpoint.observe_latency(time.monotonic() - start)
+            if recovered:
+                print(f"✅ LLM 副本 {endpoint.base_url} 探测成功，恢复路由")
+        else:
+            self._record_failure(endpoint, "健康探测失败")
+        return ok
+
+    def _probe_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            for endpoint in self.endpoints:
+                self.probe(endpoint)
+
+    def snapshot(self) -> List[Dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "base_url": e.base_url,
+                "healthy": e.healthy(now),
+                "outstanding": e.outstanding,
+                "latency_ms": round(e.latency * 1000, 1) if e.latency is not None else None,
+                "requests": e.requests,
+                "errors": e.errors,
+                "hedges_won": e.hedges_won,
+            } for e in self.endpoints]
+
+    def close(self):
+        self._stop.set()
+        self._transport.close()
+
+
+class _Waiter:
+    """一个排队中的请求"""
+
+    __slots__ = ("priority", "event", "enqueued_at", "granted", "shed")
+
+    def __init__(self, priority: str):
+        self.priority = priority
+        self.event = threading.Event()
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.shed = False
+
+
+class LLMScheduler(httpx.BaseTransport):
+    """按优先级准入 LLM 请求的 httpx 传输层：全局 / 分类并发上限、优先级排队、后台请求降级"""
+
+    def __init__(self, transport: httpx.BaseTransport, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 class_limits: Optional[Dict[str, int]] = None, shed_queue_depth: int = LLM_SHED_QUEUE_DEPTH,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT, shed_priorities: Iterable[str] = (PRIORITY_BACKGROUND,)):
+        self._transport = transport
+        self.max_concurrency = max_concurrency
+        self.class_limits = dict(LLM_CLASS_LIMITS if class_limits is None else class_limits)
+        self.shed_queue_depth = shed_queue_depth
+        self.queue_timeout = queue_timeout
+        self.shed_priorities = frozenset(shed_priorities)
+        self._lock = threading.Lock()
+        self._queues: Dict[str, Deque[_Waiter]] = {p: deque() for p in PRIORITY_ORDER}
+        self._running = {p: 0 for p in PRIORITY_ORDER}
+        self._running_total = 0
+        self._stats = {p: {"requests": 0, "admitted": 0, "shed": 0, "timeouts": 0, "cancelled": 0,
+                           "wait_total": 0.0, "wait_max": 0.0} for p in PRIORITY_ORDER}
+
+    # --- 准入 ---
+
+    def _can_run(self, priority: str) -> bool:
+        if self._running_total >= self.max_concurrency:
+            return False
+        limit = self.class_limits.get(priority)
+        return limit is None or self._running[priority] < limit
+
+    def _admit(self, waiter: _Waiter):
+        waiter.granted = True
+        self._running[waiter.priority] += 1
+        self._running_total += 1
+        wait = time.monotonic() - waiter.enqueued_at
+        stats = self._stats[waiter.priority]
+        stats["admitted"] += 1
+        stats["wait_total"] += wait
+        stats["wait_max"] = max(stats["wait_max"], wait)
+        waiter.event.set()
+
+    def _dispatch(self):
+        """按优先级放行排队的请求（调用方持有锁）"""
+        for priority in PRIORITY_ORDER:
+            waiting = self._queues[priority]
+            while waiting and self._can_run(priority):
+                self._admit(waiting.popleft())
+
+    def _shed_queued(self):
+        """交互式排队过深时，移出排队中的可降级请求（调用方持有锁）"""
+        for priority in self.shed_priorities:
+            waiting = self._queues[priority]
+            while waiting:
+                waiter = waiting.popleft()
+                waiter.shed = True
+                self._stats[priority]["shed"] += 1
+                waiter.event.set()
+
+    def _acquire(self, priority: str) -> _Waiter:
+        waiter = _Waiter(priority)
+        with self._lock:
+            self._stats[priority]["requests"] += 1
+            interactive_depth = len(self._queues[PRIORITY_INTERACTIVE])
+            if priority in self.shed_priorities and interactive_depth >= self.shed_queue_depth:
+                waiter.shed = True
+                self._stats[priority]["shed"] += 1
+                return waiter
+            self._queues[priority].append(waiter)
+            self._dispatch()
+            if len(self._queues[PRIORITY_INTERACTIVE]) >= self.shed_queue_depth:
+                self._shed_queued()
+        if not waiter.event.is_set():
+            self._wait(waiter)
+        return waiter
+
+    def _wait(self, waiter: _Waiter):
+        """排队等待；截止时间到或超过 queue_timeout（交互式只受截止时间约束）时放弃"""
+        deadline = current_deadline()
+        timeout = None if waiter.priority == PRIORITY_INTERACTIVE else self.queue_timeout
+        unregister = lambda: None
+        if deadline is not None:
+            unregister = deadline.on_cancel(waiter.event.set)
+            timeout = deadline.remaining() if timeout is None else min(timeout, deadline.remaining())
+        try:
+            waiter.event.wait(timeout)
+        finally:
+            unregister()
+        with self._lock:
+            if waiter.granted or waiter.shed:
+                return
+            self._queues[waiter.priority].remove(waiter)
+            if deadline is not None and deadline.expired:
+                self._stats[waiter.priority]["cancelled"] += 1
+                raise DeadlineExceeded("LLM 请求排队时已超时或被取消")
+            self._stats[waiter.priority]["timeouts"] += 1
+            waiter.shed = True
+
+    def _release(self, priority: str):
+        with self._lock:
+            self._running[priority] -= 1
+            self._running_total -= 1
+            self._dispatch()
+
+    @staticmethod
+    def _overloaded(request: httpx.Request, priority: str) -> httpx.Response:
+        print(f"🚦 LLM 调度: 拒绝 {priority} 请求（交互式请求排队过深或排队超时）")
+        return httpx.Response(503, headers={"x-should-retry": "false"}, request=request,
+                              json={"error": {"message": f"LLM 调度器繁忙，已拒绝 {priority} 请求",
+                                              "type": "overloaded"}})
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        priority = request.headers.get(PRIORITY_HEADER, PRIORITY_INTERACTIVE)
+        if priority not in self._queues:
+            priority = PRIORITY_INTERACTIVE
+        waiter = self._acquire(priority)
+        if waiter.shed:
+            return self._overloaded(request, priority)
+        try:
+            response = self._transport.handle_request(request)
+        except BaseException:
+            self._release(priority)
+            raise
+        response.stream = _TrackedStream(response.stream, lambda: self._release(priority))
+        return response
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """各优先级的排队 / 在途数与累计统计"""
+        with self._lock:
+            classes = {}
+            for priority in PRIORITY_ORDER:
+                stats = self._stats[priority]
+                admitted = stats["admitted"]
+                classes[priority] = {
+                    "queued": len(self._queues[priority]),
+                    "running": self._running[priority],
+                    "limit": self.class_limits.get(priority),
+                    "requests": stats["requests"],
+                    "admitted": admitted,
+                    "shed": stats["shed"],
+                    "timeouts": stats["timeouts"],
+                    "cancelled": stats["cancelled"],
+                    "avg_wait_ms": round(stats["wait_total"] / admitted * 1000, 1) if admitted else 0.0,
+                    "max_wait_ms": round(stats["wait_max"] * 1000, 1),
+                }
+            return {"max_concurrency": self.max_concurrency, "running": self._running_total, "classes": classes}
+
+    def close(self):
+        self._transport.close()
+
+
+def hedged(runnable):
+    """对首字延迟敏感的调用开启对冲请求"""
+    return runnable.bind(extra_headers={HEDGE_HEADER: "1"})
+
+
+def prioritized(runnable, priority: str):
+    """为非交互式调用指定调度优先级（PRIORITY_CLASSIFY / PRIORITY_BACKGROUND）"""
+    return runnable.bind(extra_headers={PRIORITY_HEADER: priority})
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+离线记忆整理任务：合并同一用户下重复或近似重复的记忆条目
+
+update_memory_from_conversation 和 manage_memory 会写入各种自由命名的键
+（user_job / job / occupation ...），时间一长每个提示词都会被重复事实撑大。
+本任务按用户：
+1. 用本地的键名同义词表 + 字符 n-gram 相似度把近似条目聚类；
+2. 内容相近的簇合并为一个规范键，保留最新的内容；只有一条的簇不改名；
+3. “键相近但内容差异大”的疑难簇可能是不同事实（如 hobby_music / hobby_sport），
+   只有开启 --use-llm 且 LLM 确实给出合并结果时才合并，否则原样保留，不丢内容；
+   每个用户的疑难簇只发一次批量 LLM 请求；
+4. 增量运行：只处理自上次整理后记忆有变化的用户。
+
+用法：
+    python memory_consolidation.py [--db ai_memory.db] [--user USER_ID] [--use-llm] [--dry-run]
+"""
+
+import argparse
+import json
+import re
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from memory_schema import canonical_key, delete_memory, ensure_memory_schema, key_tokens, upsert_memory
+
+DB_PATH = "ai_memory.db"
+
+# 键名相似度 / 内容相似度阈值
+KEY_SIMILARITY_THRESHOLD = 0.6
+CONTENT_SIMILARITY_THRESHOLD = 0.5
+
+
+def _ensure_state_table(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS memory_consolidation_state (
+        user_id TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        consolidated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.commit()
+
+
+def _ngrams(text: str, n: int = 2) -> set:
+    text = re.sub(r"\s+", "", text.lower())
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _jaccard(a: set, b: set) -> float:
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+def cluster_memories(rows: List[Tuple[str, str, str]]) -> List[List[Tuple[str, str, str]]]:
+    """
+    将 (memory_id, content, updated_at) 聚类（并查集）。
+    同一规范键、或键名 n-gram 相似、或内容高度相似的条目归为一簇。
+    """
+    parent = list(range(len(rows)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[rj] = ri
+
+    canon = [canonical_key(r[0]) for r in rows]
+    key_grams = [_ngrams("_".join(key_tokens(r[0]))) for r in rows]
+    content_grams = [_ngrams(r[1]) for r in rows]
+
+    for i in range(len(rows)):
+        for j in range(i + 1, len(rows)):
+            if canon[i] and canon[i] == canon[j]:
+                union(i, j)
+            elif _jaccard(key_grams[i], key_grams[j]) >= KEY_SIMILARITY_THRESHOLD:
+                union(i, j)
+            elif _jaccard(content_grams[i], content_grams[j]) >= 0.8:
+                union(i, j)
+
+    clusters: Dict[int, List[Tuple[str, str, str]]] = {}
+    for i, row in enumerate(rows):
+        clusters.setdefault(find(i), []).append(row)
+    return list(clusters.values())
+
+
+def _pick_canonical_id(cluster: List[Tuple[str, str, str]]) -> str:
+    """优先使用同义词表中的规范键，其次使用簇中最短的键"""
+    for memory_id, _, _ in cluster:
+        key = canonical_key(memory_id)
+        if key:
+            return key
+    return min((r[0] for r in cluster), key=len)
+
+
+def _is_hard_case(cluster: List[Tuple[str, str, str]]) -> bool:
+    """簇内内容互不相似（可能是不同事实或需要综合），交给 LLM 判断"""
+    grams = [_ngrams(r[1]) for r in cluster]
+    for i in range(len(grams)):
+        for j in range(i + 1, len(grams)):
+            if _jaccard(grams[i], grams[j]) < CONTENT_SIMILARITY_THRESHOLD:
+                return True
+    return False
+
+
+def _resolve_with_llm(llm, user_id: str, hard_clusters: List[List[Tuple[str, str, str]]]) -> Dict[int, str]:
+    """对一个用户的所有疑难簇发一次批量 LLM 请求，返回 {簇序号: 合并后的内容}"""
+    from langchain_core.messages import HumanMessage
+
+    lines = []
+    for idx, cluster in enumerate(hard_clusters):
+        items = "; ".join(f"{m}={c} (更新于 {u})" for m, c, u in cluster)
+        lines.append(f"{idx}. {items}")
+    prompt = f"""下面是同一用户的若干组可能重复的记忆条目，每组内的条目描述同一类事实。
+请把每组合并成一句简洁的事实描述；若组内信息互相矛盾，以更新时间最新的为准。
+
+{chr(10).join(lines)}
+
+只返回 JSON 对象，键为组序号，值为合并后的内容，例如：{{"0": "在教育行业工作"}}"""
+
+    try:
+        response = llm.invoke([HumanMessage(content=prompt)])
+        text = response.content.strip()
+        text = text[text.find("{"):text.rfind("}") + 1]
+        merged = json.loads(text)
+        return {int(k): str(v) for k, v in merged.items() if str(v).strip()}
+    except Exception as e:
+        print(f"⚠️ 用户 {user_id} 的 LLM 合并失败，疑难簇保持不变: {e}")
+        return {}
+
+
+def _fingerprint(conn: sqlite3.Connection, user_id: str) -> str:
+    count, latest = conn.execute(
+        "SELECT COUNT(*), MAX(updated_at) FROM user_memories WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    return f"{count}|{latest}"
+
+
+def consolidate_user(conn: sqlite3.Connection, user_id: str, llm=None, dry_run: bool = False) -> Dict[str, int]:
+    """整理单个用户的记忆，返回统计信息"""
+    rows = conn.execute(
+        "SELECT memory_id, content, updated_at FROM user_memories WHERE user_id = ? ORDER BY updated_at DESC",
+        (user_id,)
+    ).fetchall()
+    # 只有一条的簇不改名：重命名不减少条目，却可能把键归错类
+    clusters = [c for c in cluster_memories(rows) if len(c) > 1]
+
+    hard = [c for c in clusters if _is_hard_case(c)]
+    llm_merged = _resolve_with_llm(llm, user_id, hard) if hard and llm is not None else {}
+    hard_index = {id(c): i for i, c in enumerate(hard)}
+
+    merged_count = removed_count = skipped_count = 0
+    for cluster in clusters:
+        target_id = _pick_canonical_id(cluster)
+        if id(cluster) in hard_index:
+            # 疑难簇：没有 LLM 给出的合并结果时原样保留
+            content = llm_merged.get(hard_index[id(cluster)])
+            if content is None:
+                print(f"⏭️ {user_id}: {[r[0] for r in cluster]} 内容差异大，保持不变")
+                skipped_count += 1
+                continue
+        else:
+            # 行已按 updated_at DESC 排序，簇内第一条即最新内容
+            content = cluster[0][1]
+        old_ids = [r[0] for r in cluster]
+        print(f"🧩 {user_id}: {old_ids} -> {target_id} = {content}")
+        merged_count += 1
+        removed_count += len([m for m in old_ids if m != target_id])
+        if dry_run:
+            continue
+        # 旧键删除、规范键更新都写入历史表，合并结果可追溯
+        for memory_id in old_ids:
+            if memory_id != target_id:
+                delete_memory(conn, user_id, memory_id, source="consolidation", operation="merge")
+        upsert_memory(conn, user_id, target_id, content, source="consolidation")
+
+    if not dry_run:
+        conn.execute(
+            "INSERT OR REPLACE INTO memory_consolidation_state (user_id, fingerprint) VALUES (?, ?)",
+            (user_id, _fingerprint(conn, user_id))
+        )
+        conn.commit()
+    return {"clusters": merged_count, "removed": removed_count, "llm_resolved": len(llm_merged),
+            "skipped_hard": skipped_count}
+
+
+def users_needing_consolidation(conn: sqlite3.Connection) -> List[str]:
+    """只返回自上次整理后记忆有变化的用户"""
+    rows = conn.execute("""
+        SELECT m.user_id, COUNT(*) || '|' || MAX(m.updated_at) AS fp, s.fingerprint
+        FROM user_memories m
+        LEFT JOIN memory_consolidation_state s ON s.user_id = m.user_id
+        GROUP BY m.user_id
+    """).fetchall()
+    return [user_id for user_id, fp, last_fp in rows if fp != last_fp]
+
+
+def run_consolidation(db_path: str = DB_PATH, user_id: Optional[str] = None,
+                      use_llm: bool = False, dry_run: bool = False, force: bool = False):
+    conn = sqlite3.connect(db_path)
+    ensure_memory_schema(conn)
+    _ensure_state_table(conn)
+
+    llm = None
+    if use_llm:
+        from langgraph_memorey import llm
+
+    if user_id:
+        users = [user_id]
+    elif force:
+        users = [r[0] for r in conn.execute("SELECT DISTINCT user_id FROM user_memories")]
+    else:
+        users = users_needing_consolidation(conn)
+
+    start_time = time.time()
+    print(f"🚀 开始整理记忆，待处理用户数: {len(users)}")
+    totals = {"clusters": 0, "removed": 0, "llm_resolved": 0, "skipped_hard": 0}
+    for uid in users:
+        stats = consolidate_user(conn, uid, llm=llm, dry_run=dry_run)
+        for k in totals:
+            totals[k] += stats[k]
+    conn.close()
+    print(f"✅ 整理完成，耗时 {time.time() - start_time:.2f}s: 合并 {totals['clusters']} 组，"
+          f"替换 {totals['removed']} 个旧键，LLM 处理 {totals['llm_resolved']} 组，"
+          f"保留 {totals['skipped_hard']} 组内容差异大的条目"
+          f"{'（dry-run，未写入）' if dry_run else ''}")
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线合并近似重复的用户记忆")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite 数据库路径")
+    parser.add_argument("--user", default=None, help="只整理指定用户")
+    parser.add_argument("--use-llm", action="store_true", help="疑难簇使用一次批量 LLM 调用合并")
+    parser.add_argument("--dry-run", action="store_true", help="只打印合并计划，不写入数据库")
+    parser.add_argument("--force", action="store_true", help="忽略增量状态，整理所有用户")
+    args = parser.parse_args()
+    run_consolidation(args.db, args.user, args.use_llm, args.dry_run, args.force)
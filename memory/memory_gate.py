@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+记忆提取的本地门控：在调用 LLM 判断/提取个人信息之前，先用本地 CPU 模型过滤
+
+大多数轮次不包含个人事实，却都要发一次 LLM 分类（check_if_needs_memory_update）
+和/或一次提取调用（update_memory_from_conversation）。门控由两部分组成：
+1. 规则：扩展的自述句式（我叫/我住在/我在…工作/my name is ...），命中即放行；
+2. 字符 n-gram（1~3 字）哈希特征的逻辑回归，可从历史 LLM 判断日志训练。
+概率低于阈值（MEMORY_GATE_THRESHOLD，偏向召回）的轮次直接跳过 LLM 调用，并计入节省次数。
+
+设置 MEMORY_GATE_LOG（例如 memory_gate_log.jsonl）后，每次真正调用 LLM 判断的结果会连同用户原话
+追加到该文件，作为下一次训练的数据。日志含用户个人信息且不断增长，默认不记录，只在收集训练数据时开启。
+为了让日志里也有被门控判为无关的轮次（否则漏判永远学不到）：
+- 尚未加载模型时只做观察，每一轮都调用 LLM 判断；
+- 加载模型后，被跳过的轮次仍按 MEMORY_GATE_EXPLORE_RATE 的比例抽样调用 LLM（探索）。
+
+仓库不附带训练好的模型，因此开箱即用时门控处于观察（bootstrap）模式，不节省任何 LLM 调用，
+stats() 中 bootstrap 为 True。要开启过滤：设置 MEMORY_GATE_LOG 运行一段时间收集标签，
+再执行 train 生成 MEMORY_GATE_MODEL 指向的模型文件并重启。
+
+用法：
+    python memory_gate.py train [--log memory_gate_log.jsonl] [--model memory_gate_model.json]
+    python memory_gate.py check "我叫张三"
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+GATE_THRESHOLD = float(os.environ.get("MEMORY_GATE_THRESHOLD", "0.3"))
+GATE_MODEL_PATH = os.environ.get("MEMORY_GATE_MODEL", "memory_gate_model.json")
+DEFAULT_LOG_PATH = "memory_gate_log.jsonl"
+GATE_LOG_PATH = os.environ.get("MEMORY_GATE_LOG", "")   # 为空时不记录 LLM 判断（日志含用户原话）
+GATE_EXPLORE_RATE = float(os.environ.get("MEMORY_GATE_EXPLORE_RATE", "0.05"))
+
+NUM_FEATURES = 1 << 18
+NGRAM_SIZES = (1, 2, 3)
+
+# 自述个人信息的句式：命中即放行（保证召回）
+_POSITIVE_PATTERNS = [re.compile(p, re.IGNORECASE) for p in [
+    r"我(的名字)?(叫|是|姓)",
+    r"(叫我|称呼我)",
+    r"我(现在|目前|一直)?(住在|住|在.{1,10}(住|生活|工作|上班|上学|读书))",
+    r"我(今年|已经)?\d+\s*岁",
+    r"我(的)?(生日|年龄|职业|工作|专业|学校|公司|爱好|兴趣|老家|家乡)",
+    r"我(喜欢|爱|讨厌|不喜欢|擅长|从事|毕业|就读|在读|学的|学习)",
+    r"我(老婆|老公|妻子|丈夫|孩子|儿子|女儿|爸|妈|父母|家里|家人|女朋友|男朋友)",
+    r"我(是|属于).{0,6}(的人|性格|血型)",
+    r"(记住|别忘了|忘掉|忘记|删除|删掉).{0,8}(我|这)",
+    r"\bmy (name|job|birthday|wife|husband|hobby|hobbies|age)\b",
+    r"\bi(?:'m| am) (a|an|\d+)\b",
+    r"\bi (live|work|study|like|love|hate)\b",
+    r"\bcall me\b",
+]]
+
+# 常用于日志/训练的标签
+POSITIVE = 1
+NEGATIVE = 0
+
+
+def _features(text: str) -> Dict[int, float]:
+    """字符 n-gram 哈希特征（按长度归一化的词频）"""
+    text = re.sub(r"\s+", " ", text.lower().strip())
+    counts: Dict[int, float] = {}
+    for n in NGRAM_SIZES:
+        for i in range(len(text) - n + 1):
+            idx = zlib.crc32(f"{n}:{text[i:i + n]}".encode("utf-8")) % NUM_FEATURES
+            counts[idx] = counts.get(idx, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {k: v / norm for k, v in counts.items()}
+
+
+def rule_match(text: str) -> bool:
+    return any(p.search(text) for p in _POSITIVE_PATTERNS)
+
+
+class NgramLogisticModel:
+    """稀疏字符 n-gram 逻辑回归（纯 Python，SGD 训练）"""
+
+    def __init__(self, weights: Optional[Dict[int, float]] = None, bias: float = 0.0):
+        self.weights = weights or {}
+        self.bias = bias
+
+    def predict_proba(self, text: str) -> float:
+        z = self.bias + sum(self.weights.get(k, 0.0) * v for k, v in _features(text).items())
+        z = max(-30.0, min(30.0, z))
+        return 1.0 / (1.0 + math.exp(-z))
+
+    def fit(self, samples: List[Tuple[str, int]], epochs: int = 8, lr: float = 0.5, l2: float = 1e-4):
+        positives = sum(label for _, label in samples) or 1
+        negatives = (len(samples) - positives) or 1
+        # 按类别频率加权，正样本稀少时仍保持召回
+        class_weight = {POSITIVE: len(samples) / (2 * positives), NEGATIVE: len(samples) / (2 * negatives)}
+        featurized = [(_features(text), label) for text, label in samples]
+        rng = random.Random(0)
+        for epoch in range(epochs):
+            rng.shuffle(featurized)
+            step = lr / (1 + epoch)
+            for feats, label in featurized:
+                z = self.bias + sum(self.weights.get(k, 0.0) * v for k, v in feats.items())
+                p = 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, z))))
+                grad = (p - label) * class_weight[label]
+                for k, v in feats.items():
+                    w = self.weights.get(k, 0.0)
+                    self.weights[k] = w - step * (grad * v + l2 * w)
+                self.bias -= step * grad
+        return self
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"bias": self.bias, "weights": {str(k): round(v, 6) for k, v in self.weights.items() if abs(v) > 1e-6}}, f)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["NgramLogisticModel"]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return cls({int(k): v for k, v in data["weights"].items()}, data["bias"])
+
+
+class MemoryGate:
+    """是否需要调用 LLM 做记忆判断/提取的本地门控，附带节省统计（线程安全）"""
+
+    def __init__(self, model: Optional[NgramLogisticModel] = None, threshold: float = GATE_THRESHOLD,
+                 log_path: Optional[str] = GATE_LOG_PATH, explore_rate: float = GATE_EXPLORE_RATE):
+        self.model = model
+        self.threshold = threshold
+        self.log_path = log_path
+        self.explore_rate = explore_rate
+        self._rng = random.Random()
+        self._lock = threading.Lock()
+        self._stats = {"checked": 0, "passed": 0, "skipped": 0, "explored": 0, "rule_hits": 0,
+                       "llm_positive": 0, "llm_negative": 0}
+
+    def score(self, text: str) -> float:
+        """需要提取的概率；规则命中记为 1"""
+        if rule_match(text):
+            return 1.0
+        if self.model is None:
+            return 0.0
+        return self.model.predict_proba(text)
+
+    def peek(self, text: str) -> bool:
+        """门控是否判为相关；不计入统计、不做探索采样，供同一轮次的重复查询使用"""
+        return self.score(text) >= self.threshold
+
+    def should_extract(self, text: str) -> bool:
+        """是否调用 LLM 判断；门控判为无关的轮次在无模型时全部、有模型时按比例仍然放行以收集标签
+
+        每个轮次只应调用一次（计入统计），同一轮次的其他判断使用 peek()。
+        """
+        score = self.score(text)
+        passed = score >= self.threshold
+        explored = not passed and (self.model is None or self._rng.random() < self.explore_rate)
+        with self._lock:
+            self._stats["checked"] += 1
+            if passed:
+                self._stats["passed"] += 1
+            elif explored:
+                self._stats["explored"] += 1
+            else:
+                self._stats["skipped"] += 1
+            if score == 1.0:
+                self._stats["rule_hits"] += 1
+        if explored:
+            print(f"🚦 记忆门控: 得分 {score:.2f} < {self.threshold}，探索采样，仍调用 LLM 判断以收集标签")
+        elif not passed:
+            print(f"🚦 记忆门控: 跳过 LLM 判断 (得分 {score:.2f} < {self.threshold})")
+        return passed or explored
+
+    def log_decision(self, text: str, needs_memory: bool):
+        """记录一次 LLM 的判断结果，作为训练数据（gate 字段记录门控当时是否放行，便于统计漏判）"""
+        gate_passed = self.score(text) >= self.threshold
+        with self._lock:
+            self._stats["llm_positive" if needs_memory else "llm_negative"] += 1
+            if not self.log_path:
+                return
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"text": text, "label": POSITIVE if needs_memory else NEGATIVE,
+                                        "gate": gate_passed}, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"⚠️ 写入门控日志失败: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["saved_ratio"] = stats["skipped"] / stats["checked"] if stats["checked"] else 0.0
+        stats["bootstrap"] = self.model is None   # 未加载模型：只观察，不跳过任何 LLM 调用
+        return stats
+
+
+def load_samples(path: str) -> List[Tuple[str, int]]:
+    """读取门控日志；同一文本以最后一次 LLM 判断为准"""
+    latest: Dict[str, int] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                latest[record["text"]] = int(record["label"])
+            except (json.JSONDecodeError, KeyError, ValueError):
+                continue
+    return list(latest.items())
+
+
+def evaluate(gate: MemoryGate, samples: Iterable[Tuple[str, int]]) -> Dict[str, float]:
+    tp = fp = fn = tn = 0
+    for text, label in samples:
+        predicted = gate.score(text) >= gate.threshold
+        if predicted and label:
+            tp += 1
+        elif predicted:
+            fp += 1
+        elif label:
+            fn += 1
+        else:
+            tn += 1
+    total = tp + fp + fn + tn
+    return {
+        "recall": tp / (tp + fn) if tp + fn else 1.0,
+        "precision": tp / (tp + fp) if tp + fp else 1.0,
+        "skip_rate": (fn + tn) / total if total else 0.0,
+    }
+
+
+def train(log_path: str = GATE_LOG_PATH or DEFAULT_LOG_PATH, model_path: str = GATE_MODEL_PATH,
+          threshold: float = GATE_THRESHOLD, epochs: int = 8) -> Dict[str, float]:
+    """从日志训练模型，用 20% 留出集报告召回率和可节省的调用比例"""
+    samples = load_samples(log_path)
+    if len(samples) < 10:
+        raise ValueError(f"训练样本过少: {len(samples)}")
+    random.Random(42).shuffle(samples)
+    split = max(1, len(samples) // 5)
+    holdout, train_set = samples[:split], samples[split:]
+
+    model = NgramLogisticModel().fit(train_set, epochs=epochs)
+    metrics = evaluate(MemoryGate(model, threshold, log_path=None), holdout)
+    print(f"📊 留出集 ({len(holdout)} 条) 阈值 {threshold}: 召回 {metrics['recall']:.1%}，"
+          f"精确 {metrics['precision']:.1%}，可跳过 {metrics['skip_rate']:.1%} 的 LLM 调用")
+
+    # 用全部样本重新训练后保存
+    NgramLogisticModel().fit(samples, epochs=epochs).save(model_path)
+    print(f"✅ 门控模型已保存: {model_path} (样本 {len(samples)} 条)")
+    return metrics
+
+
+memory_gate = MemoryGate(NgramLogisticModel.load(GATE_MODEL_PATH))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="记忆提取门控的训练与检查")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train_parser = sub.add_parser("train", help="从 LLM 判断日志训练门控模型")
+    train_parser.add_argument("--log", default=GATE_LOG_PATH or DEFAULT_LOG_PATH)
+    train_parser.add_argument("--model", default=GATE_MODEL_PATH)
+    train_parser.add_argument("--threshold", type=float, default=GATE_THRESHOLD)
+    train_parser.add_argument("--epochs", type=int, default=8)
+    check_parser = sub.add_parser("check", help="查看一句话的门控得分")
+    check_parser.add_argument("text")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        train(args.log, args.model, args.threshold, args.epochs)
+    else:
+        print(f"得分: {memory_gate.score(args.text):.3f} (阈值 {memory_gate.threshold})")
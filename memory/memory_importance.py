@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+长期记忆的重要性评分与衰减淘汰
+
+user_memories 只增不减，提示词中的记忆块会越来越大。这里：
+1. 为记忆增加 access_count / last_used 列，记录被用到的次数和最近一次使用时间；
+   使用记录先累积在内存中，按批次（条数或时间间隔）一次 executemany 写回，而不是每次读取都写库；
+2. 重要性 = 类别权重 × (近因衰减 × 0.6 + 使用频率 × 0.4)，近因按半衰期指数衰减；
+3. 每个用户有记忆条数预算，超出预算时把得分最低的记忆移到冷表 user_memories_archive，
+   冷表不会被加载进提示词；姓名等关键类别不会被淘汰；
+4. 同一维护路径顺带清理 processed_tool_calls 中超过保留期的记录：幂等索引只需覆盖
+   可能被重试或重放的近期轮次，否则它会随工具调用次数无限增长。
+
+用法（离线批量整理）：
+    python memory_importance.py [--db ai_memory.db] [--user USER_ID] [--budget 30] [--dry-run]
+"""
+
+import argparse
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from memory_schema import canonical_key, delete_memory, ensure_memory_schema
+
+DB_PATH = "ai_memory.db"
+
+MEMORY_BUDGET = int(os.environ.get("MEMORY_BUDGET", "30"))   # 每个用户保留的记忆条数
+HALF_LIFE_DAYS = 30.0          # 近因得分的半衰期
+FREQUENCY_SATURATION = 20      # 使用次数达到该值时频率得分为 1
+FLUSH_EVERY = 200              # 使用记录累积到该条数时写回
+FLUSH_INTERVAL = 30.0          # 或距上次写回超过该秒数时写回
+PROCESSED_CALL_RETENTION_DAYS = float(os.environ.get("PROCESSED_CALL_RETENTION_DAYS", "7"))
+
+# 类别权重：按 memory_schema 的规范键归类
+CATEGORY_WEIGHTS = {
+    "user_name": 1.0,
+    "user_identity": 0.9,
+    "user_job": 0.8,
+    "user_location": 0.8,
+    "user_family": 0.8,
+    "user_age": 0.7,
+    "user_study": 0.6,
+    "user_hobby": 0.5,
+    "user_personality": 0.5,
+    "user_diet": 0.5,
+}
+DEFAULT_CATEGORY_WEIGHT = 0.4
+PINNED_CATEGORIES = {"user_name"}   # 从不淘汰
+
+
+def ensure_importance_schema(conn: sqlite3.Connection):
+    """为 user_memories 增加使用统计列，并创建冷表"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(user_memories)")}
+    if "access_count" not in columns:
+        conn.execute("ALTER TABLE user_memories ADD COLUMN access_count INTEGER NOT NULL DEFAULT 0")
+    if "last_used" not in columns:
+        conn.execute("ALTER TABLE user_memories ADD COLUMN last_used TIMESTAMP")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_memories_archive (
+        user_id TEXT NOT NULL,
+        memory_id TEXT NOT NULL,
+        content TEXT NOT NULL,
+        updated_at TIMESTAMP,
+        access_count INTEGER NOT NULL DEFAULT 0,
+        last_used TIMESTAMP,
+        importance REAL,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, memory_id)
+    )
+    """)
+    conn.commit()
+
+
+def _age_days(timestamp: Optional[str], now: float) -> float:
+    if not timestamp:
+        return HALF_LIFE_DAYS * 4
+    try:
+        ts = datetime.strptime(timestamp[:19], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return HALF_LIFE_DAYS * 4
+    return max(0.0, (now - ts) / 86400)
+
+
+def importance_score(memory_id: str, access_count: int, last_used: Optional[str],
+                     updated_at: Optional[str], now: Optional[float] = None) -> float:
+    """综合近因、频率和类别的重要性得分（0~1）"""
+    now = now or time.time()
+    # 从未被用到的记忆按写入时间计算近因
+    recency = 0.5 ** (_age_days(last_used or updated_at, now) / HALF_LIFE_DAYS)
+    frequency = min(1.0, math.log1p(access_count) / math.log1p(FREQUENCY_SATURATION))
+    weight = CATEGORY_WEIGHTS.get(canonical_key(memory_id) or "", DEFAULT_CATEGORY_WEIGHT)
+    return weight * (0.6 * recency + 0.4 * frequency)
+
+
+def enforce_budget(conn: sqlite3.Connection, user_id: str, budget: int = MEMORY_BUDGET,
+                   dry_run: bool = False) -> List[str]:
+    """用户记忆超出预算时，把得分最低的记忆移入冷表，返回被归档的 memory_id"""
+    rows = conn.execute(
+        "SELECT memory_id, access_count, last_used, updated_at FROM user_memories WHERE user_id = ?",
+        (user_id,)
+    ).fetchall()
+    if len(rows) <= budget:
+        return []
+
+    now = time.time()
+    scored = sorted(
+        ((importance_score(m, c, lu, u, now), m) for m, c, lu, u in rows
+         if canonical_key(m) not in PINNED_CATEGORIES),
+    )
+    archived = scored[:len(rows) - budget]
+    if dry_run or not archived:
+        return [m for _, m in archived]
+
+    conn.executemany("""
+        INSERT OR REPLACE INTO user_memories_archive
+            (user_id, memory_id, content, updated_at, access_count, last_used, importance)
+        SELECT user_id, memory_id, content, updated_at, access_count, last_used, ?
+        FROM user_memories WHERE user_id = ? AND memory_id = ?
+    """, [(score, user_id, m) for score, m in archived])
+    for _, memory_id in archived:
+        delete_memory(conn, user_id, memory_id, source="eviction", operation="archive")
+    conn.commit()
+    print(f"🗄️ 用户 {user_id} 记忆超出预算 {budget}，归档 {len(archived)} 条: {[m for _, m in archived]}")
+    return [m for _, m in archived]
+
+
+def prune_processed_tool_calls(conn: sqlite3.Connection,
+                               retention_days: float = PROCESSED_CALL_RETENTION_DAYS) -> int:
+    """删除超过保留期的已处理工具调用记录，返回删除条数（表不存在时返回 0）"""
+    try:
+        cursor = conn.execute("DELETE FROM processed_tool_calls WHERE processed_at < datetime('now', ?)",
+                              (f"-{retention_days} days",))
+    except sqlite3.OperationalError:
+        return 0
+    conn.commit()
+    if cursor.rowcount:
+        print(f"🧹 清理了 {cursor.rowcount} 条超过 {retention_days:g} 天的已处理工具调用记录")
+    return cursor.rowcount
+
+
+def _bigrams(text: str) -> set:
+    text = re.sub(r"\s+", "", text.lower())
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class AccessTracker:
+    """记忆使用记录：内存中累积，按批次写回数据库（线程安全）"""
+
+    def __init__(self, conn: sqlite3.Connection, flush_every: int = FLUSH_EVERY,
+                 flush_interval: float = FLUSH_INTERVAL, write_lock: Optional[threading.Lock] = None):
+        self.conn = conn
+        # 与其他写入方共用连接时传入同一把锁，避免写回语句混进别人的事务
+        self.write_lock = write_lock or threading.Lock()
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[str, str], int] = {}
+        self._last_used: Dict[Tuple[str, str], str] = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, user_id: str, memory_ids: Iterable[str]):
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            for memory_id in memory_ids:
+                key = (user_id, memory_id)
+                self._pending[key] = self._pending.get(key, 0) + 1
+                self._last_used[key] = now
+            due = (len(self._pending) >= self.flush_every
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def record_relevant(self, user_id: str, memories: Dict[str, Dict[str, str]], text: str,
+                        min_overlap: int = 2) -> List[str]:
+        """把与文本（用户输入/回答）有字符二元组重合的记忆记为一次使用"""
+        if not memories or not text:
+            return []
+        text_grams = _bigrams(text)
+        used = []
+        for memory_id, data in memories.items():
+            grams = _bigrams(data["data"])
+            # 很短的记忆（如两个字的姓名）只要求全部命中
+            if grams and len(grams & text_grams) >= min(min_overlap, len(grams)):
+                used.append(memory_id)
+        if used:
+            self.record(user_id, used)
+        return used
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                self._last_flush = time.monotonic()
+                return
+            batch = [(count, self._last_used[key], key[0], key[1]) for key, count in self._pending.items()]
+            self._pending.clear()
+            self._last_used.clear()
+            self._last_flush = time.monotonic()
+        try:
+            with self.write_lock:
+                self.conn.executemany(
+                    "UPDATE user_memories SET access_count = access_count + ?, last_used = ? "
+                    "WHERE user_id = ? AND memory_id = ?",
+                    batch
+                )
+                self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ 写回记忆使用记录失败: {e}")
+
+
+def run_eviction(db_path: str = DB_PATH, user_id: Optional[str] = None, budget: int = MEMORY_BUDGET,
+                 dry_run: bool = False) -> int:
+    conn = sqlite3.connect(db_path)
+    ensure_memory_schema(conn)
+    if user_id:
+        users = [user_id]
+    else:
+        users = [r[0] for r in conn.execute(
+            "SELECT user_id FROM user_memories GROUP BY user_id HAVING COUNT(*) > ?", (budget,)
+        )]
+    archived = 0
+    for uid in users:
+        ids = enforce_budget(conn, uid, budget, dry_run)
+        if dry_run and ids:
+            print(f"🧪 {uid}: 将归档 {ids}")
+        archived += len(ids)
+    if not dry_run:
+        prune_processed_tool_calls(conn)
+    conn.close()
+    print(f"✅ 记忆淘汰完成: 检查 {len(users)} 个用户，归档 {archived} 条"
+          f"{'（dry-run，未写入）' if dry_run else ''}")
+    return archived
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="按重要性把超出预算的记忆移入冷表")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite 数据库路径")
+    parser.add_argument("--user", default=None, help="只处理指定用户")
+    parser.add_argument("--budget", type=int, default=MEMORY_BUDGET, help="每个用户保留的记忆条数")
+    parser.add_argument("--dry-run", action="store_true", help="只打印将被归档的记忆")
+    args = parser.parse_args()
+    run_eviction(args.db, args.user, args.budget, args.dry_run)
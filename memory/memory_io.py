@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+user_memories 与会话 checkpoint 的批量导入/导出（JSONL）
+
+- 流式读写，内存占用与数据量无关；
+- 导出按主键顺序分块读取，导入用 executemany 分块写入、大事务提交；
+- 可按用户过滤（checkpoint 按 thread_{user_id} 过滤）；
+- 进度记录在 <文件>.export.progress / <文件>.import.progress 中（导入导出同一文件互不覆盖），
+  中断后用 --resume 从上次提交的位置继续。
+
+用法：
+    python memory_io.py export dump.jsonl [--user U1 --user U2] [--checkpoints] [--resume]
+    python memory_io.py import dump.jsonl [--user U1] [--resume]
+"""
+
+import argparse
+import base64
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional
+
+from cache_coherence import touch_user
+from memory_schema import SOURCE_CONFIDENCE, ensure_memory_schema, memory_category, refresh_memory_block
+
+DB_PATH = "ai_memory.db"
+
+# 每张表导出的列、主键以及需要 base64 编码的 BLOB 列；
+# optional 为结构化记忆的新增列，旧库导出时跳过，旧文件导入时按 _memory_defaults 补齐
+TABLES = {
+    "user_memories": {
+        "columns": ["user_id", "memory_id", "content", "updated_at"],
+        "optional": ["category", "value", "confidence", "source", "version"],
+        "key": ["user_id", "memory_id"],
+        "blobs": [],
+        "user_column": "user_id",
+    },
+    "checkpoints": {
+        "columns": ["thread_id", "checkpoint_ns", "checkpoint_id", "parent_checkpoint_id",
+                    "type", "checkpoint", "metadata"],
+        "key": ["thread_id", "checkpoint_ns", "checkpoint_id"],
+        "blobs": ["checkpoint", "metadata"],
+        "user_column": "thread_id",
+    },
+    "writes": {
+        "columns": ["thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "idx",
+                    "channel", "type", "value"],
+        "key": ["thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "idx"],
+        "blobs": ["value"],
+        "user_column": "thread_id",
+    },
+    # 压缩 checkpoint 的消息正文（按内容寻址、跨会话共享，不按用户过滤）
+    "checkpoint_blobs": {
+        "columns": ["hash", "codec", "data", "size"],
+        "key": ["hash"],
+        "blobs": ["data"],
+        "user_column": None,
+    },
+}
+
+CHUNK_SIZE = 5000          # 每次 fetchmany / executemany 的行数
+COMMIT_EVERY = 100000      # 导入时每个事务包含的行数
+
+# 复用同一个编码器，避免每行重新构造
+_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+
+def _progress_path(path: str, kind: str) -> str:
+    return f"{path}.{kind}.progress"
+
+
+def _load_progress(path: str, kind: str) -> Dict:
+    try:
+        with open(_progress_path(path, kind), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_progress(path: str, kind: str, progress: Dict):
+    tmp = _progress_path(path, kind) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(progress, f)
+    os.replace(tmp, _progress_path(path, kind))
+
+
+def _user_filter(table: str, user_ids: Optional[List[str]]):
+    """返回 (WHERE 子句片段, 参数)"""
+    spec = TABLES[table]
+    if not user_ids or spec["user_column"] is None:
+        return "", []
+    values = user_ids if spec["user_column"] == "user_id" else [f"thread_{u}" for u in user_ids]
+    return f"{spec['user_column']} IN ({','.join('?' * len(values))})", values
+
+
+def _table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+
+def _memory_defaults(record: Dict) -> Dict:
+    """旧格式的记忆记录缺少结构化列时的默认值"""
+    return {
+        "category": memory_category(record["memory_id"]),
+        "value": record["content"],
+        "confidence": SOURCE_CONFIDENCE["import"],
+        "source": "import",
+        "version": 1,
+    }
+
+
+def export_jsonl(out_path: str, db_path: str = DB_PATH, user_ids: Optional[List[str]] = None,
+                 include_checkpoints: bool = False, resume: bool = False,
+                 chunk_size: int = CHUNK_SIZE) -> int:
+    """把记忆（以及可选的 checkpoint）导出到 JSONL，返回本次写出的行数"""
+    tables = ["user_memories"] + (["checkpoints", "writes", "checkpoint_blobs"] if include_checkpoints else [])
+    progress = _load_progress(out_path, "export") if resume else {}
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+
+    # 续传时截断到上次记录的位置，丢弃未记录进度的半截输出
+    mode = "r+" if resume and progress and os.path.exists(out_path) else "w"
+    f = open(out_path, mode, encoding="utf-8", newline="\n")
+    if mode == "r+":
+        f.seek(progress.get("offset", 0))
+        f.truncate()
+    else:
+        progress = {}
+
+    start_time = time.time()
+    written = 0
+    try:
+        for table in tables:
+            if progress.get("done", {}).get(table) or not _table_exists(conn, table):
+                continue
+            spec = TABLES[table]
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            columns = spec["columns"] + [c for c in spec.get("optional", []) if c in existing]
+            conditions, params = [], []
+            user_sql, user_params = _user_filter(table, user_ids)
+            if user_sql:
+                conditions.append(user_sql)
+                params.extend(user_params)
+            last_key = progress.get("last_key", {}).get(table)
+            if last_key:
+                # 行值比较：从上次导出的主键之后继续
+                conditions.append(f"({', '.join(spec['key'])}) > ({', '.join('?' * len(last_key))})")
+                params.extend(last_key)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            cursor = conn.execute(
+                f"SELECT {', '.join(columns)} FROM {table} {where} ORDER BY {', '.join(spec['key'])}",
+                params
+            )
+            key_idx = [columns.index(k) for k in spec["key"]]
+            blob_idx = [columns.index(b) for b in spec["blobs"]]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                lines = []
+                for row in rows:
+                    record = dict(zip(columns, row))
+                    for i in blob_idx:
+                        value = row[i]
+                        record[columns[i]] = base64.b64encode(value).decode("ascii") if value is not None else None
+                    record["table"] = table
+                    lines.append(_ENCODER.encode(record))
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                written += len(rows)
+                progress.setdefault("last_key", {})[table] = [rows[-1][i] for i in key_idx]
+                progress["offset"] = f.tell()
+                _save_progress(out_path, "export", progress)
+            progress.setdefault("done", {})[table] = True
+            _save_progress(out_path, "export", progress)
+    finally:
+        f.close()
+        conn.close()
+
+    elapsed = time.time() - start_time
+    print(f"✅ 导出完成: {written} 行 -> {out_path}，耗时 {elapsed:.2f}s")
+    return written
+
+
+def _iter_records(f, user_ids: Optional[List[str]]) -> Iterable[Dict]:
+    threads = {f"thread_{u}" for u in user_ids} if user_ids else None
+    for line in iter(f.readline, ""):
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        column = TABLES[record["table"]]["user_column"]
+        if threads is not None and column is not None:
+            owner = record.get(column)
+            if owner not in (user_ids if column == "user_id" else threads):
+                continue
+        yield record
+
+
+def import_jsonl(in_path: str, db_path: str = DB_PATH, user_ids: Optional[List[str]] = None,
+                 resume: bool = False, batch_size: int = CHUNK_SIZE,
+                 commit_every: int = COMMIT_EVERY) -> int:
+    """从 JSONL 导入（同主键覆盖），返回本次导入的行数"""
+    progress = _load_progress(in_path, "import") if resume else {}
+    conn = sqlite3.connect(db_path)
+    ensure_memory_schema(conn)
+
+    # 批量导入直接覆盖，不逐条写入 user_memories_history
+    columns = {table: spec["columns"] + spec.get("optional", []) for table, spec in TABLES.items()}
+    statements = {
+        table: f"INSERT OR REPLACE INTO {table} ({', '.join(columns[table])}) "
+               f"VALUES ({', '.join('?' * len(columns[table]))})"
+        for table in TABLES
+    }
+    batches: Dict[str, List[tuple]] = {table: [] for table in TABLES}
+    touched_users = set()   # 通知运行中的进程失效这些用户的缓存
+    checkpoint_tables_ready = False
+    imported = uncommitted = 0
+    start_time = time.time()
+
+    def flush():
+        for table, rows in batches.items():
+            if rows:
+                conn.executemany(statements[table], rows)
+                rows.clear()
+        for user_id in touched_users:
+            refresh_memory_block(conn, user_id)
+            touch_user(conn, user_id)
+        touched_users.clear()
+
+    with open(in_path, "r", encoding="utf-8") as f:
+        f.seek(progress.get("offset", 0))
+        for record in _iter_records(f, user_ids):
+            table = record["table"]
+            spec = TABLES[table]
+            if table != "user_memories" and not checkpoint_tables_ready:
+                # 由 SqliteSaver 建表，保证与 langgraph 的表结构一致（含压缩正文表）
+                from checkpoint_store import CompressedSqliteSaver
+                CompressedSqliteSaver(conn).setup()
+                checkpoint_tables_ready = True
+            if table == "user_memories":
+                touched_users.add(record["user_id"])
+                if any(record.get(c) is None for c in spec["optional"]):
+                    record = {**_memory_defaults(record), **{k: v for k, v in record.items() if v is not None}}
+            row = []
+            for column in columns[table]:
+                value = record.get(column)
+                if column in spec["blobs"] and value is not None:
+                    value = base64.b64decode(value)
+                row.append(value)
+            batches[table].append(tuple(row))
+            imported += 1
+            uncommitted += 1
+            if len(batches[table]) >= batch_size:
+                flush()
+            if uncommitted >= commit_every:
+                flush()
+                conn.commit()
+                uncommitted = 0
+                _save_progress(in_path, "import", {"offset": f.tell()})
+        flush()
+        conn.commit()
+        _save_progress(in_path, "import", {"offset": f.tell(), "done": True})
+    conn.close()
+
+    elapsed = time.time() - start_time
+    print(f"✅ 导入完成: {imported} 行 <- {in_path}，耗时 {elapsed:.2f}s")
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="user_memories / checkpoint 的 JSONL 导入导出")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="JSONL 文件路径")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite 数据库路径")
+    parser.add_argument("--user", action="append", dest="users", help="只处理指定用户，可重复")
+    parser.add_argument("--checkpoints", action="store_true", help="导出时同时包含会话 checkpoint")
+    parser.add_argument("--resume", action="store_true", help="从上次中断的位置继续")
+    parser.add_argument("--batch-size", type=int, default=CHUNK_SIZE, help="每批读取/写入的行数")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_jsonl(args.path, args.db, args.users, args.checkpoints, args.resume, args.batch_size)
+    else:
+        import_jsonl(args.path, args.db, args.users, args.resume, args.batch_size)
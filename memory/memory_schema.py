@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+结构化的用户记忆表结构与统一的读写入口
+
+user_memories 在原有 (user_id, memory_id, content, updated_at) 之上增加：
+- category：记忆类别（name / job / location ...，由键名同义词表推断，无法推断为 other）；
+- value：结构化取值（工具传入 dict/list 时保存 JSON，否则与 content 相同）；
+- confidence：置信度，默认按来源给出；
+- source：写入来源（tool / extractor / manual / consolidation / import）；
+- version：每次内容变化加 1。
+并建立按类别、按时间的二级索引，以及只追加的历史表 user_memories_history，
+纠正记录可以直接按 (user_id, memory_id) 查询，不需要全表扫描。
+
+user_memory_blocks 按用户物化格式化好的记忆块：提示词中的 "- id: 内容" 列表与界面展示文本，
+带版本号，只在写入时重建；读取只需一次主键查询，且同一版本的提示词前缀完全一致（利于前缀缓存）。
+
+所有写入都应通过 upsert_memory / delete_memory，它们不提交事务，由调用方批量提交；
+每次写入同时重建该用户的记忆块，并通过 cache_coherence.touch_user 通知其他进程失效该用户的缓存。
+"""
+
+import json
+import re
+import sqlite3
+from typing import Any, Dict, List, Optional
+
+from cache_coherence import SCOPE_MEMORY, ensure_coherence_schema, touch_user
+
+# 同义键映射到规范键（与 update_memory_from_conversation 使用的类型保持一致）
+CANONICAL_KEYS = {
+    "user_name": ["name", "username", "user_name", "nickname", "姓名", "名字", "称呼"],
+    "user_identity": ["identity", "profession", "role", "身份", "职业"],
+    "user_location": ["location", "address", "city", "home", "residence", "居住地", "住址", "地址"],
+    "user_job": ["job", "work", "occupation", "career", "company", "employer", "workplace", "industry", "工作", "职位", "行业"],
+    "user_hobby": ["hobby", "hobbies", "interest", "interests", "like", "likes", "爱好", "兴趣"],
+    "user_study": ["study", "school", "education", "major", "university", "学习", "学校", "专业"],
+    "user_age": ["age", "birthday", "年龄", "生日"],
+    "user_family": ["family", "spouse", "children", "kids", "parents", "家庭", "家人"],
+    "user_personality": ["personality", "character", "性格"],
+    "user_diet": ["diet", "food", "饮食"],
+}
+_SYNONYM_TO_CANONICAL = {syn: key for key, syns in CANONICAL_KEYS.items() for syn in syns}
+
+# 各来源的默认置信度
+SOURCE_CONFIDENCE = {
+    "manual": 1.0,
+    "tool": 0.9,
+    "consolidation": 0.8,
+    "extractor": 0.7,
+    "import": 0.7,
+}
+
+MEMORY_COLUMNS = {
+    "category": "TEXT",
+    "value": "TEXT",
+    "confidence": "REAL",
+    "source": "TEXT",
+    "version": "INTEGER NOT NULL DEFAULT 1",
+}
+
+EMPTY_DISPLAY_BLOCK = "📭 目前数据库中无记录。"
+
+
+def key_tokens(memory_id: str) -> List[str]:
+    """拆分键名：去掉 user_ 前缀，按下划线/驼峰/空白切分"""
+    key = re.sub(r"([a-z])([A-Z])", r"\1_\2", memory_id).lower()
+    tokens = [t for t in re.split(r"[_\-\s.]+", key) if t]
+    if len(tokens) > 1 and tokens[0] == "user":
+        tokens = tokens[1:]
+    return tokens
+
+
+def canonical_key(memory_id: str) -> Optional[str]:
+    """根据同义词表推断规范键，无法推断时返回 None
+
+    只匹配整个键（去掉 user_ 前缀后）或中心词（最后一个词，如 favorite_hobby、current_city）；
+    修饰词本身是其他类别的同义词时（work_address 中的 work）视为无法推断，
+    避免 work_address / home_phone 被归入 job / location。
+    """
+    whole = _SYNONYM_TO_CANONICAL.get(memory_id.lower())
+    if whole:
+        return whole
+    tokens = key_tokens(memory_id)
+    if not tokens:
+        return None
+    whole = _SYNONYM_TO_CANONICAL.get("_".join(tokens))
+    if whole or len(tokens) == 1:
+        return whole
+    head = _SYNONYM_TO_CANONICAL.get(tokens[-1])
+    modifiers = {_SYNONYM_TO_CANONICAL.get(t) for t in tokens[:-1]} - {None}
+    if head and modifiers - {head}:
+        return None
+    return head
+
+
+def memory_category(memory_id: str) -> str:
+    canonical = canonical_key(memory_id)
+    return canonical[len("user_"):] if canonical else "other"
+
+
+def ensure_memory_schema(conn: sqlite3.Connection):
+    """建表 / 补列 / 回填类别 / 建索引与历史表（幂等）"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_memories (
+        user_id TEXT NOT NULL,
+        memory_id TEXT NOT NULL,
+        content TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, memory_id)
+    )
+    """)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(user_memories)")}
+    added = [name for name in MEMORY_COLUMNS if name not in columns]
+    for name in added:
+        conn.execute(f"ALTER TABLE user_memories ADD COLUMN {name} {MEMORY_COLUMNS[name]}")
+    if added:
+        # 旧数据回填：类别由键名推断，value 取 content，来源记为 import
+        conn.create_function("memory_category", 1, memory_category, deterministic=True)
+        conn.execute("UPDATE user_memories SET category = memory_category(memory_id) WHERE category IS NULL")
+        conn.execute("UPDATE user_memories SET value = content WHERE value IS NULL")
+        conn.execute("UPDATE user_memories SET source = 'import', confidence = ? WHERE source IS NULL",
+                     (SOURCE_CONFIDENCE["import"],))
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_memories_category "
+                 "ON user_memories (user_id, category, updated_at DESC)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_memories_recency "
+                 "ON user_memories (user_id, updated_at DESC)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_memories_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        memory_id TEXT NOT NULL,
+        operation TEXT NOT NULL,
+        category TEXT,
+        content TEXT,
+        value TEXT,
+        confidence REAL,
+        source TEXT,
+        version INTEGER,
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_memories_history_key "
+                 "ON user_memories_history (user_id, memory_id, id)")
+    blocks_exist = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_memory_blocks'"
+    ).fetchone()
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_memory_blocks (
+        user_id TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        prompt_block TEXT NOT NULL,
+        display_block TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    if not blocks_exist:
+        # 首次建表时为已有用户生成记忆块
+        for (user_id,) in conn.execute("SELECT DISTINCT user_id FROM user_memories").fetchall():
+            refresh_memory_block(conn, user_id)
+    conn.commit()
+
+    # 使用统计列与冷表（memory_importance 依赖本模块，这里延迟导入）
+    from memory_importance import ensure_importance_schema
+    ensure_importance_schema(conn)
+    # 跨进程缓存失效通知
+    ensure_coherence_schema(conn)
+
+
+def _record_history(conn: sqlite3.Connection, user_id: str, memory_id: str, operation: str,
+                    category: Optional[str], content: Optional[str], value: Optional[str],
+                    confidence: Optional[float], source: Optional[str], version: Optional[int]):
+    conn.execute("""
+        INSERT INTO user_memories_history
+            (user_id, memory_id, operation, category, content, value, confidence, source, version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, memory_id, operation, category, content, value, confidence, source, version))
+
+
+def upsert_memory(conn: sqlite3.Connection, user_id: str, memory_id: str, content: Any,
+                  source: str = "tool", confidence: Optional[float] = None,
+                  category: Optional[str] = None) -> Optional[int]:
+    """
+    写入一条记忆（不提交事务），返回新版本号；内容未变化时不写入并返回 None。
+    保留 access_count / last_used 等使用统计（不再用 INSERT OR REPLACE 删除旧行）。
+    """
+    if isinstance(content, (dict, list)):
+        value = json.dumps(content, ensure_ascii=False, sort_keys=True)
+        text = "；".join(f"{k}: {v}" for k, v in content.items()) if isinstance(content, dict) else "、".join(map(str, content))
+    else:
+        text = value = str(content)
+    category = category or memory_category(memory_id)
+    if confidence is None:
+        confidence = SOURCE_CONFIDENCE.get(source, 0.5)
+
+    row = conn.execute(
+        "SELECT content, version FROM user_memories WHERE user_id = ? AND memory_id = ?",
+        (user_id, memory_id)
+    ).fetchone()
+    if row is not None and row[0] == text:
+        return None
+
+    version = (row[1] or 1) + 1 if row is not None else 1
+    conn.execute("""
+        INSERT INTO user_memories (user_id, memory_id, content, category, value, confidence, source, version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, memory_id) DO UPDATE SET
+            content = excluded.content, category = excluded.category, value = excluded.value,
+            confidence = excluded.confidence, source = excluded.source, version = excluded.version,
+            updated_at = CURRENT_TIMESTAMP
+    """, (user_id, memory_id, text, category, value, confidence, source, version))
+    # 重新提到的事实从冷表中恢复为新内容
+    conn.execute("DELETE FROM user_memories_archive WHERE user_id = ? AND memory_id = ?", (user_id, memory_id))
+    _record_history(conn, user_id, memory_id, "upsert", category, text, value, confidence, source, version)
+    refresh_memory_block(conn, user_id)
+    touch_user(conn, user_id, SCOPE_MEMORY)
+    return version
+
+
+def delete_memory(conn: sqlite3.Connection, user_id: str, memory_id: str,
+                  source: str = "tool", operation: str = "delete") -> bool:
+    """删除一条记忆（不提交事务）并写入历史，返回是否确实删除了记录"""
+    row = conn.execute(
+        "SELECT category, content, value, confidence, version FROM user_memories WHERE user_id = ? AND memory_id = ?",
+        (user_id, memory_id)
+    ).fetchone()
+    if row is None:
+        return False
+    conn.execute("DELETE FROM user_memories WHERE user_id = ? AND memory_id = ?", (user_id, memory_id))
+    category, content, value, confidence, version = row
+    _record_history(conn, user_id, memory_id, operation, category, content, value, confidence, source, version)
+    refresh_memory_block(conn, user_id)
+    touch_user(conn, user_id, SCOPE_MEMORY)
+    return True
+
+
+def fetch_memories(conn: sqlite3.Connection, user_id: str, categories: Optional[List[str]] = None,
+                   limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """按类别/时间索引取出用户记忆（最新的在前）"""
+    sql = ("SELECT memory_id, content, category, value, confidence, source, version, updated_at "
+           "FROM user_memories WHERE user_id = ?")
+    params: List[Any] = [user_id]
+    if categories:
+        sql += f" AND category IN ({','.join('?' * len(categories))})"
+        params.extend(categories)
+    sql += " ORDER BY updated_at DESC"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    keys = ["memory_id", "content", "category", "value", "confidence", "source", "version", "updated_at"]
+    return [dict(zip(keys, row)) for row in conn.execute(sql, params)]
+
+
+def format_prompt_block(rows: List[Dict[str, Any]]) -> str:
+    """提示词中的记忆列表（无记忆时为空串，由调用方给出占位文字）"""
+    return "\n".join(f"- {r['memory_id']}: {r['content']}" for r in rows)
+
+
+def format_display_block(rows: List[Dict[str, Any]]) -> str:
+    """界面展示的记忆列表"""
+    if not rows:
+        return EMPTY_DISPLAY_BLOCK
+    return "\n\n".join(f"📌 [{r['category']}] {r['memory_id']} (v{r['version']})\n   └ {r['content']}" for r in rows)
+
+
+def refresh_memory_block(conn: sqlite3.Connection, user_id: str):
+    """按当前记忆重建用户的记忆块（不提交事务），版本号加 1"""
+    rows = fetch_memories(conn, user_id)
+    conn.execute("""
+        INSERT INTO user_memory_blocks (user_id, version, prompt_block, display_block)
+        VALUES (?, 1, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            version = version + 1, prompt_block = excluded.prompt_block,
+            display_block = excluded.display_block, updated_at = CURRENT_TIMESTAMP
+    """, (user_id, format_prompt_block(rows), format_display_block(rows)))
+
+
+def get_memory_block(conn: sqlite3.Connection, user_id: str) -> Dict[str, Any]:
+    """
+    读取用户的记忆块 {"version", "prompt", "display"}。
+    没有记录（无记忆的用户）时现场格式化，不写库，只读连接也可以调用。
+    """
+    row = conn.execute(
+        "SELECT version, prompt_block, display_block FROM user_memory_blocks WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    if row is None:
+        rows = fetch_memories(conn, user_id)
+        return {"version": 0, "prompt": format_prompt_block(rows), "display": format_display_block(rows)}
+    return {"version": row[0], "prompt": row[1], "display": row[2]}
+
+
+def fetch_history(conn: sqlite3.Connection, user_id: str, memory_id: Optional[str] = None,
+                  limit: int = 50) -> List[Dict[str, Any]]:
+    """查询记忆的修改历史（最新的在前）"""
+    sql = ("SELECT memory_id, operation, category, content, confidence, source, version, changed_at "
+           "FROM user_memories_history WHERE user_id = ?")
+    params: List[Any] = [user_id]
+    if memory_id:
+        sql += " AND memory_id = ?"
+        params.append(memory_id)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    keys = ["memory_id", "operation", "category", "content", "confidence", "source", "version", "changed_at"]
+    return [dict(zip(keys, row)) for row in conn.execute(sql, params)]
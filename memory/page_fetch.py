@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+搜索结果正文抓取：并发下载搜索结果页面并提取与问题相关的正文段落
+
+- 有界连接池 + 每个域名的并发上限 + 整体时间预算，超时的页面直接放弃；
+- 边下载边用 HTMLParser 增量解析正文，达到字节/字符上限即停止读取；
+- 提取的正文按 URL 缓存（TTL + LRU）；
+- 只把与查询最相关的几段文字加入工具输出，避免撑爆 Token。
+
+通过环境变量 SEARCH_FETCH_PAGES=1 开启。
+"""
+
+import codecs
+import concurrent.futures
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from html.parser import HTMLParser
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from deadline import current_deadline
+
+SEARCH_FETCH_PAGES = os.environ.get("SEARCH_FETCH_PAGES", "0") == "1"
+
+FETCH_TOP_N = 3              # 每次搜索抓取的页面数
+FETCH_TIME_BUDGET = 4.0      # 整个抓取阶段的时间预算（秒）
+FETCH_MAX_BYTES = 512 * 1024 # 单个页面最多读取的字节数
+FETCH_MAX_CHARS = 20000      # 单个页面最多保留的正文字符数
+
+# 不属于正文的标签
+_SKIP_TAGS = {"script", "style", "noscript", "nav", "header", "footer", "aside", "form",
+              "svg", "iframe", "button", "select", "template"}
+# 块级标签：遇到时切分段落
+_BLOCK_TAGS = {"p", "div", "li", "br", "h1", "h2", "h3", "h4", "h5", "h6", "article",
+               "section", "tr", "td", "blockquote", "pre", "dd", "dt", "main"}
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class MainTextParser(HTMLParser):
+    """增量正文提取器：feed() 可以在下载过程中多次调用"""
+
+    def __init__(self, max_chars: int = FETCH_MAX_CHARS):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.paragraphs: List[str] = []
+        self._current: List[str] = []
+        self._skip_depth = 0
+        self._chars = 0
+
+    @property
+    def full(self) -> bool:
+        return self._chars >= self.max_chars
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self._end_paragraph()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self._end_paragraph()
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in _BLOCK_TAGS:
+            self._end_paragraph()
+
+    def handle_data(self, data):
+        if self._skip_depth == 0 and not self.full:
+            self._current.append(data)
+
+    def _end_paragraph(self):
+        if not self._current:
+            return
+        text = _WHITESPACE_RE.sub(" ", "".join(self._current)).strip()
+        self._current = []
+        # 过短的片段多为菜单、按钮等噪声
+        if len(text) >= 20:
+            self.paragraphs.append(text)
+            self._chars += len(text)
+
+    def text(self) -> str:
+        self._end_paragraph()
+        return "\n".join(self.paragraphs)
+
+
+def _query_terms(query: str) -> set:
+    """查询词：英文按单词，中文按相邻二字切分"""
+    query = query.lower()
+    terms = set(re.findall(r"[a-z0-9]{2,}", query))
+    for run in re.findall(r"[\u4e00-\u9fff]+", query):
+        terms.update(run[i:i + 2] for i in range(max(1, len(run) - 1)))
+    return terms
+
+
+def relevant_passages(text: str, query: str, max_chars: int = 600, max_passages: int = 3) -> str:
+    """选出与查询重合度最高的几个段落，按原文顺序拼接"""
+    terms = _query_terms(query)
+    paragraphs = [p for p in text.split("\n") if p]
+    if not paragraphs or not terms:
+        return text[:max_chars]
+    scored = []
+    for idx, para in enumerate(paragraphs):
+        lower = para.lower()
+        hits = sum(1 for t in terms if t in lower)
+        if hits:
+            scored.append((hits / len(terms), idx))
+    chosen = sorted(idx for _, idx in sorted(scored, reverse=True)[:max_passages])
+    passages, total = [], 0
+    for idx in chosen:
+        para = paragraphs[idx][:max_chars - total]
+        if not para:
+            break
+        passages.append(para)
+        total += len(para)
+    return " … ".join(passages)
+
+
+class PageFetcher:
+    """并发页面抓取器（线程安全）"""
+
+    def __init__(self, max_connections: int = 8, per_host_limit: int = 2,
+                 max_bytes: int = FETCH_MAX_BYTES, cache_ttl: float = 3600,
+                 cache_size: int = 256, client: Optional[httpx.Client] = None):
+        self.per_host_limit = per_host_limit
+        self.max_bytes = max_bytes
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._client = client or httpx.Client(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            follow_redirects=True,
+            headers={"User-Agent": "Mozilla/5.0 (compatible; memory-chat/1.0)"},
+        )
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_connections,
+                                                               thread_name_prefix="page-fetch")
+        self._host_limits: Dict[str, threading.Semaphore] = {}
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _host_semaphore(self, url: str) -> threading.Semaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.Semaphore(self.per_host_limit)
+            return self._host_limits[host]
+
+    def _cache_get(self, url: str) -> Optional[str]:
+        with self._lock:
+            item = self._cache.get(url)
+            if item is None:
+                return None
+            fetched_at, text = item
+            if time.time() - fetched_at > self.cache_ttl:
+                del self._cache[url]
+                return None
+            self._cache.move_to_end(url)
+            return text
+
+    def _cache_put(self, url: str, text: str):
+        with self._lock:
+            self._cache[url] = (time.time(), text)
+            self._cache.move_to_end(url)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _fetch_one(self, url: str, stop_at: float) -> Optional[str]:
+        cached = self._cache_get(url)
+        if cached is not None:
+            return cached
+
+        semaphore = self._host_semaphore(url)
+        if not semaphore.acquire(timeout=max(0.0, stop_at - time.monotonic())):
+            return None
+        try:
+            remaining = stop_at - time.monotonic()
+            if remaining <= 0:
+                return None
+            with self._client.stream("GET", url, timeout=remaining) as response:
+                content_type = response.headers.get("content-type", "")
+                if response.status_code != 200 or ("html" not in content_type and "text" not in content_type):
+                    return None
+                decoder = codecs.getincrementaldecoder(response.charset_encoding or "utf-8")(errors="replace")
+                parser = MainTextParser()
+                received = 0
+                for chunk in response.iter_bytes():
+                    received += len(chunk)
+                    parser.feed(decoder.decode(chunk))
+                    # 正文已足够、超出字节上限或时间预算用完时停止读取
+                    if parser.full or received >= self.max_bytes or time.monotonic() >= stop_at:
+                        break
+                parser.feed(decoder.decode(b"", final=True))
+                text = parser.text()
+        except Exception as e:
+            # 单个页面的任何错误（网络、编码、HTML 解析）只让该页面缺席，不影响 fetch_many 的其他结果
+            print(f"⚠️ 抓取页面失败 {url}: {e}")
+            return None
+        finally:
+            semaphore.release()
+
+        self._cache_put(url, text)
+        return text
+
+    def fetch_many(self, urls: Iterable[str], time_budget: float = FETCH_TIME_BUDGET) -> Dict[str, str]:
+        """在时间预算内并发抓取页面，返回 {url: 正文}，未完成或失败的页面不出现在结果中"""
+        deadline = current_deadline()
+        if deadline is not None:
+            time_budget = min(time_budget, deadline.remaining())
+        stop_at = time.monotonic() + time_budget
+
+        urls = list(dict.fromkeys(u for u in urls if u and u.startswith(("http://", "https://"))))
+        futures = {self._executor.submit(self._fetch_one, url, stop_at): url for url in urls}
+        done, _ = concurrent.futures.wait(futures, timeout=max(0.0, time_budget))
+
+        texts = {}
+        for future in done:
+            text = future.result()
+            if text:
+                texts[futures[future]] = text
+        print(f"📄 页面抓取完成: {len(texts)}/{len(urls)} 个页面 (预算 {time_budget:.1f}s)")
+        return texts
+
+
+_page_fetcher: Optional[PageFetcher] = None
+_fetcher_lock = threading.Lock()
+
+
+def get_page_fetcher() -> PageFetcher:
+    global _page_fetcher
+    if _page_fetcher is None:
+        with _fetcher_lock:
+            if _page_fetcher is None:
+                _page_fetcher = PageFetcher()
+    return _page_fetcher
+
+
+def fetch_relevant_passages(urls: List[str], query: str, top_n: int = FETCH_TOP_N,
+                            max_chars: int = 600) -> Dict[str, str]:
+    """抓取前 top_n 个页面并返回 {url: 相关段落}"""
+    texts = get_page_fetcher().fetch_many(urls[:top_n])
+    passages = {}
+    for url, text in texts.items():
+        passage = relevant_passages(text, query, max_chars=max_chars)
+        if passage:
+            passages[url] = passage
+    return passages
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+按需的单请求性能分析：只对指定用户（或按比例抽样）的一个轮次开启分析器
+
+- PROFILE_USERS=u1,u2 指定用户，PROFILE_SAMPLE_RATE=0.01 按比例抽样，也可运行时调用 configure()；
+- 默认采样分析器：后台线程每 PROFILE_INTERVAL 秒抓取本轮涉及线程的调用栈，
+  同时读取该线程的 CPU 时钟，把样本区分为 [cpu] 与 [wait]（等待网络/锁/IO），
+  输出 flamegraph.pl / speedscope 可直接读取的 collapsed-stack 文件；
+- PROFILE_MODE=cprofile 时改用确定性分析器：每个加入的线程各用一个 cProfile.Profile
+  （同一个 Profile 跨线程启停会混淆调用栈，且先结束的线程会截断其他线程的记录），
+  结束时用 pstats 合并后输出 .pstats；
+- 每个轮次另输出一份 JSON 摘要：墙钟时间、CPU 时间、等待时间、最热函数；
+- 开关关闭时被包装的生成器直接返回原对象，不启动任何分析器。
+
+轮次在多个线程中执行时（Gradio 在不同线程中推进生成器、stream_with_timeout 的工作线程），
+在这些线程中用 attach(session) 把它们加入同一个分析会话。
+"""
+
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+PROFILE_MODE = os.environ.get("PROFILE_MODE", "sample")   # sample | cprofile
+
+
+class _ProfileConfig:
+    def __init__(self):
+        self.users = {u.strip() for u in os.environ.get("PROFILE_USERS", "").split(",") if u.strip()}
+        self.sample_rate = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+
+    @property
+    def active(self) -> bool:
+        return bool(self.users) or self.sample_rate > 0
+
+
+_config = _ProfileConfig()
+_current_session: contextvars.ContextVar[Optional["ProfileSession"]] = contextvars.ContextVar(
+    "profile_session", default=None
+)
+
+
+def configure(users: Optional[Iterable[str]] = None, sample_rate: Optional[float] = None):
+    """运行时修改分析开关（例如用户反馈慢时临时打开）"""
+    if users is not None:
+        _config.users = set(users)
+    if sample_rate is not None:
+        _config.sample_rate = sample_rate
+
+
+def should_profile(user_id: str) -> bool:
+    if not _config.active:
+        return False
+    return user_id in _config.users or (_config.sample_rate > 0 and random.random() < _config.sample_rate)
+
+
+def current_session() -> Optional["ProfileSession"]:
+    return _current_session.get()
+
+
+def _thread_cpu_clock(ident: int) -> Optional[int]:
+    try:
+        return time.pthread_getcpuclockid(ident)
+    except (AttributeError, OSError):
+        return None   # 非 Unix 平台无法读取其他线程的 CPU 时钟
+
+
+class ProfileSession:
+    """一个轮次的分析会话"""
+
+    def __init__(self, user_id: str, label: str, mode: str = PROFILE_MODE, interval: float = PROFILE_INTERVAL):
+        self.user_id = user_id
+        self.label = label
+        self.mode = mode
+        self.interval = interval
+        self.request_id = uuid.uuid4().hex[:8]
+        self.stacks: Counter = Counter()
+        self.cpu_seconds = 0.0
+        self._threads: Dict[int, Optional[int]] = {}   # 线程 ident -> CPU 时钟 id
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._profiles: List[cProfile.Profile] = []   # cprofile 模式：每次 attach 一个，结束时合并
+        self._started_at = 0.0
+        self.wall_seconds = 0.0
+
+    # --- 生命周期 ---
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        if self.mode != "cprofile":
+            self._sampler = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+            self._sampler.start()
+
+    def stop(self) -> str:
+        self.wall_seconds = time.perf_counter() - self._started_at
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        return self._dump()
+
+    @contextmanager
+    def attach(self):
+        """把当前线程加入会话，期间的调用栈与 CPU 时间计入本轮"""
+        ident = threading.get_ident()
+        cpu_start = time.thread_time()
+        with self._lock:
+            self._threads[ident] = _thread_cpu_clock(ident)
+        profile = None
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                # 同一线程中已有其他分析器在运行
+                print(f"⚠️ 线程 {ident} 无法启动 cProfile: {e}")
+                profile = None
+        token = _current_session.set(self)
+        try:
+            yield self
+        finally:
+            _current_session.reset(token)
+            if profile is not None:
+                profile.disable()
+            with self._lock:
+                self._threads.pop(ident, None)
+                self.cpu_seconds += time.thread_time() - cpu_start
+                if profile is not None:
+                    self._profiles.append(profile)
+
+    # --- 采样 ---
+
+    def _sample_loop(self):
+        last_cpu: Dict[int, int] = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = dict(self._threads)
+            for ident, clock in threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                state = "[sample]"
+                if clock is not None:
+                    try:
+                        now_cpu = time.clock_gettime_ns(clock)
+                    except OSError:
+                        now_cpu = None
+                    if now_cpu is not None:
+                        # 两次采样之间 CPU 时钟推进超过间隔的一半，视为在 CPU 上
+                        prev = last_cpu.get(ident, now_cpu)
+                        state = "[cpu]" if now_cpu - prev >= self.interval * 1e9 / 2 else "[wait]"
+                        last_cpu[ident] = now_cpu
+                self.stacks[self._collapse(frame, state)] += 1
+
+    @staticmethod
+    def _collapse(frame, state: str) -> str:
+        # 只有栈顶帧带行号，上层帧按函数合并，火焰图更易读
+        code = frame.f_code
+        parts = [f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"]
+        frame = frame.f_back
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+            frame = frame.f_back
+        parts.append(state)
+        return ";".join(reversed(parts))
+
+    # --- 输出 ---
+
+    def _dump(self) -> str:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{self.user_id}_{self.request_id}")
+        summary = {
+            "user_id": self.user_id,
+            "label": self.label,
+            "mode": self.mode,
+            "wall_ms": round(self.wall_seconds * 1000, 1),
+            "cpu_ms": round(self.cpu_seconds * 1000, 1),
+            "wait_ms": round(max(0.0, self.wall_seconds - self.cpu_seconds) * 1000, 1),
+        }
+        if self.mode == "cprofile":
+            path = f"{base}.pstats"
+            self._merged_stats().dump_stats(path)
+        else:
+            path = f"{base}.collapsed"
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            total = sum(self.stacks.values()) or 1
+            by_state = Counter()
+            leaf = Counter()
+            for stack, count in self.stacks.items():
+                frames = stack.split(";")
+                by_state[frames[0]] += count
+                leaf[frames[-1]] += count
+            summary["samples"] = sum(self.stacks.values())
+            summary["sample_states"] = {k: f"{v / total:.1%}" for k, v in by_state.items()}
+            summary["top_frames"] = [{"frame": f, "share": f"{c / total:.1%}"} for f, c in leaf.most_common(10)]
+        with open(f"{base}.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"🔬 性能分析完成 [{self.label}] 用户 {self.user_id}: 墙钟 {summary['wall_ms']}ms，"
+              f"CPU {summary['cpu_ms']}ms，等待 {summary['wait_ms']}ms -> {path}")
+        return path
+
+
+    def _merged_stats(self) -> pstats.Stats:
+        """合并各线程的 cProfile 结果；没有记录到调用的 Profile 被跳过"""
+        merged = pstats.Stats()
+        with self._lock:
+            profiles = list(self._profiles)
+        for profile in profiles:
+            profile.create_stats()
+            if profile.stats:
+                merged.add(profile)
+        return merged
+
+
+@contextmanager
+def attach(session: Optional[ProfileSession]):
+    """在其他线程中加入会话；session 为 None 时什么也不做"""
+    if session is None:
+        yield None
+    else:
+        with session.attach():
+            yield session
+
+
+def _profile_generator(session: ProfileSession, generator):
+    session.start()
+    try:
+        while True:
+            # 每次推进生成器时把当前线程加入会话（Gradio 可能在不同线程中推进）
+            with session.attach():
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        generator.close()
+        session.stop()
+
+
+def profile_generator(user_id: str, generator, label: str = "turn"):
+    """对一个轮次的生成器开启分析；开关关闭或用户未被选中时原样返回"""
+    if not should_profile(user_id):
+        return generator
+    return _profile_generator(ProfileSession(user_id, label), generator)
+
+
+def profiled_turn(get_user_id):
+    """生成器函数装饰器：get_user_id(*args, **kwargs) 取出本轮的用户 ID"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            generator = fn(*args, **kwargs)
+            if not _config.active:
+                return generator
+            return profile_generator(get_user_id(*args, **kwargs), generator, label=fn.__name__)
+        return wrapper
+    return decorator
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+按用户划分的响应缓存：用户重复提问时直接返回上一次的回答
+
+缓存键 = 用户 + 归一化后的问题（或字符 n-gram 相似的问题）+ 用户记忆版本 + 作用域。
+用户记忆一旦变化（版本号变化），旧答案即失效；条目另有 TTL。
+“那它呢？”这类追问的答案取决于前文：is_follow_up() 判断为追问时，调用方用 context_digest()
+把前几轮对话的摘要并入作用域，前文不同的同一追问不会命中彼此的答案。
+独立的问题不带前文摘要，否则每轮新增的问答都会改变摘要，同一会话里重复提问永远无法命中。
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Optional
+
+# 默认关闭，设置环境变量 RESPONSE_CACHE_ENABLED=1 开启
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "0") == "1"
+
+CONTEXT_TURNS = 6   # context_digest() 计入的最近消息条数
+
+# 去掉中英文标点，用于问题归一化
+_PUNCT_RE = re.compile(r"[\s\.,!?;:'\"`~()\[\]{}<>，。！？；：、“”‘’（）【】《》…·\-]+")
+
+
+def normalize_query(query: str) -> str:
+    """归一化问题文本：小写、去标点和空白"""
+    return _PUNCT_RE.sub("", query.lower())
+
+
+# 指代前文的词语；命中其一或问题极短时视为追问
+_FOLLOW_UP_RE = re.compile(
+    r"[它他她呢]|那个|这个|那些|这些|那里|这里|刚才|刚刚|上面|上述|前面|之前|继续|还有|另一个|同样"
+    r"|\b(?:it|its|that|this|they|them|those|these|he|she|him|her|what about|how about|and|also)\b"
+)
+FOLLOW_UP_MAX_LEN = 4   # 归一化后不超过该长度的问题（如“为什么？”）也视为追问
+
+
+def is_follow_up(query: str) -> bool:
+    """问题是否依赖前文（指代前文或过短），依赖前文的问题缓存时需要带上 context_digest()"""
+    return bool(_FOLLOW_UP_RE.search(query.lower())) or len(normalize_query(query)) <= FOLLOW_UP_MAX_LEN
+
+
+def context_digest(turns) -> str:
+    """前文（最近 CONTEXT_TURNS 条消息的文本）的短摘要，用作缓存作用域的一部分"""
+    recent = list(turns)[-CONTEXT_TURNS:]
+    return hashlib.sha1("\x1f".join(recent).encode("utf-8")).hexdigest()[:16]
+
+
+def _char_ngrams(text: str, n: int = 2) -> FrozenSet[str]:
+    if len(text) <= n:
+        return frozenset([text]) if text else frozenset()
+    return frozenset(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+@dataclass
+class CacheEntry:
+    answer: str
+    memory_version: int
+    scope: str
+    created_at: float
+    ngrams: FrozenSet[str]
+
+
+class ResponseCache:
+    """线程安全的按用户响应缓存"""
+
+    def __init__(self, ttl_seconds: float = 300, max_entries_per_user: int = 64,
+                 similarity_threshold: float = 0.85):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_user = max_entries_per_user
+        self.similarity_threshold = similarity_threshold
+        self._entries: Dict[str, "OrderedDict[str, CacheEntry]"] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str, query: str, memory_version: int, scope: str = "") -> Optional[str]:
+        """查找缓存的回答；先精确匹配归一化问题，再按 n-gram 相似度匹配"""
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            user_entries = self._entries.get(user_id)
+            entry = None
+            if user_entries and key:
+                entry = self._valid(user_entries.get(f"{scope}|{key}"), memory_version, scope, now)
+                if entry is None:
+                    entry = self._most_similar(user_entries, key, memory_version, scope, now)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry.answer
+
+    def put(self, user_id: str, query: str, memory_version: int, answer: str, scope: str = ""):
+        key = normalize_query(query)
+        if not key or not answer:
+            return
+        with self._lock:
+            user_entries = self._entries.setdefault(user_id, OrderedDict())
+            cache_key = f"{scope}|{key}"
+            user_entries.pop(cache_key, None)
+            user_entries[cache_key] = CacheEntry(answer, memory_version, scope, time.time(), _char_ngrams(key))
+            while len(user_entries) > self.max_entries_per_user:
+                user_entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: str):
+        """用户记忆变化时清除该用户的全部缓存"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": sum(len(v) for v in self._entries.values()),
+            }
+
+    def _valid(self, entry: Optional[CacheEntry], memory_version: int, scope: str, now: float):
+        if entry is None or entry.scope != scope or entry.memory_version != memory_version:
+            return None
+        if now - entry.created_at > self.ttl_seconds:
+            return None
+        return entry
+
+    def _most_similar(self, user_entries, key: str, memory_version: int, scope: str, now: float):
+        grams = _char_ngrams(key)
+        best, best_score = None, 0.0
+        for entry in user_entries.values():
+            if self._valid(entry, memory_version, scope, now) is None:
+                continue
+            union = len(grams | entry.ngrams)
+            score = len(grams & entry.ngrams) / union if union else 0.0
+            if score > best_score:
+                best, best_score = entry, score
+        return best if best_score >= self.similarity_threshold else None
+
+
+# 进程内共享的缓存实例
+response_cache = ResponseCache()
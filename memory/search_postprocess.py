@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+搜索结果后处理：跨查询近似去重 + BM25 相关性排序 + 按 Token 预算截取
+
+同一新闻的转载稿往往标题、摘要几乎一样，只是 URL 不同，按 href 精确去重无法识别。
+这里对所有查询的结果统一处理：
+1. 字符 3-gram shingle + MinHash 估算 Jaccard 相似度，近似重复只保留得分最高的一条；
+2. 以 BM25 对标题+摘要打分（查询为用户问题或搜索词）；
+3. 按得分从高到低选取，直到达到条数上限或 Token 预算。
+"""
+
+import hashlib
+import math
+import re
+from collections import Counter
+from typing import Dict, List
+
+NUM_PERMUTATIONS = 64
+DUPLICATE_THRESHOLD = 0.6   # MinHash 估计的 Jaccard 相似度超过该值视为重复
+SHINGLE_SIZE = 3
+
+_MERSENNE_PRIME = (1 << 61) - 1
+# 固定种子生成的置换参数，保证不同进程结果一致
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME or 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME)
+    for i in range(NUM_PERMUTATIONS)
+]
+_NORMALIZE_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def _shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    text = _NORMALIZE_RE.sub("", text.lower())
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def minhash_signature(text: str) -> List[int]:
+    shingle_hashes = [
+        int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+        for s in _shingles(text)
+    ]
+    if not shingle_hashes:
+        return [0] * NUM_PERMUTATIONS
+    return [min((a * h + b) % _MERSENNE_PRIME for h in shingle_hashes) for a, b in _PERMUTATIONS]
+
+
+def estimated_similarity(sig_a: List[int], sig_b: List[int]) -> float:
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+def tokenize(text: str) -> List[str]:
+    """英文/数字按单词，中文按相邻二字切分"""
+    text = text.lower()
+    tokens = re.findall(r"[a-z0-9]+", text)
+    for run in re.findall(r"[\u4e00-\u9fff]+", text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 Token 数：每个汉字约 1 个，英文单词约 1.3 个"""
+    cjk = len(re.findall(r"[\u4e00-\u9fff]", text))
+    words = len(re.findall(r"[A-Za-z0-9]+", text))
+    return cjk + int(words * 1.3) + 1
+
+
+def bm25_scores(documents: List[List[str]], query: List[str], k1: float = 1.5, b: float = 0.75) -> List[float]:
+    n = len(documents)
+    if n == 0:
+        return []
+    avg_len = sum(len(d) for d in documents) / n or 1.0
+    doc_freq = Counter(t for d in documents for t in set(d))
+    query_terms = set(query)
+    scores = []
+    for doc in documents:
+        tf = Counter(doc)
+        score = 0.0
+        for term in query_terms:
+            if term not in tf:
+                continue
+            idf = math.log(1 + (n - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            freq = tf[term]
+            score += idf * freq * (k1 + 1) / (freq + k1 * (1 - b + b * len(doc) / avg_len))
+        scores.append(score)
+    return scores
+
+
+def rank_and_dedupe(results: List[Dict], question: str, max_results: int = 8,
+                    token_budget: int = 1200, snippet_chars: int = 250) -> List[Dict]:
+    """
+    对所有查询的原始结果做近似去重、相关性排序和 Token 预算截取。
+    results 中每项至少包含 title/body/href，可带 query 字段；返回的每项附带 score。
+    """
+    # 精确 URL 去重
+    unique: Dict[str, Dict] = {}
+    for res in results:
+        key = res.get("href") or f"{res.get('title', '')}|{res.get('body', '')}"
+        if key not in unique:
+            unique[key] = res
+    candidates = list(unique.values())
+    if not candidates:
+        return []
+
+    texts = [f"{r.get('title', '')} {r.get('body', '')}" for r in candidates]
+    scores = bm25_scores([tokenize(t) for t in texts], tokenize(question))
+    signatures = [minhash_signature(t) for t in texts]
+
+    # 按得分从高到低，近似重复的低分结果被丢弃
+    order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)
+    selected: List[int] = []
+    used_tokens = 0
+    dropped_duplicates = 0
+    has_relevant = scores[order[0]] > 0
+    for i in order:
+        # 有相关结果时，完全不含查询词的结果不再占用预算
+        if has_relevant and scores[i] <= 0:
+            break
+        if any(estimated_similarity(signatures[i], signatures[j]) >= DUPLICATE_THRESHOLD for j in selected):
+            dropped_duplicates += 1
+            continue
+        snippet = (candidates[i].get("body") or "").replace("\n", " ").strip()[:snippet_chars]
+        cost = estimate_tokens(f"{candidates[i].get('title', '')} {snippet} {candidates[i].get('href', '')}")
+        if selected and used_tokens + cost > token_budget:
+            break
+        selected.append(i)
+        used_tokens += cost
+        if len(selected) >= max_results:
+            break
+
+    print(f"🧹 搜索结果后处理: {len(results)} 条原始结果 -> {len(selected)} 条 "
+          f"(近似重复 {dropped_duplicates} 条，约 {used_tokens} tokens)")
+    return [{**candidates[i], "score": scores[i]} for i in selected]
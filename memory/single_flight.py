@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+单飞（single-flight）：相同键的并发调用只执行一次，其余调用等待并共享结果
+
+多个用户同时问同一条新闻时，各自的 web_search 会用相同的搜索词分别请求 DDGS；
+相同的记忆分类提示词（check_if_needs_memory_update）也会被重复发给模型。
+SingleFlight.do(key, fn) 在同一时刻只让第一个调用方（leader）执行 fn，
+之后到达的相同键调用（follower）等待 leader 完成，直接拿到同一个结果或异常。
+只合并进行中的调用，完成后即移除，不做结果缓存。
+
+截止时间：
+- follower 按自己的截止时间等待，取消或超时抛出 DeadlineExceeded；
+- leader 的截止时间在完成前已过期时，其结果（或异常）可能只是被取消的产物，
+  follower 不采用，重新发起（其中一个成为新的 leader）。
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from deadline import Deadline, DeadlineExceeded, current_deadline
+from response_cache import normalize_query
+
+
+class _Flight:
+    """一次进行中的调用"""
+
+    __slots__ = ("deadline", "done", "cancelled", "result", "error", "listeners")
+
+    def __init__(self, deadline: Optional[Deadline]):
+        self.deadline = deadline
+        self.done = False
+        self.cancelled = False     # 完成时 leader 的截止时间是否已过期
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.listeners: List[threading.Event] = []
+
+
+class SingleFlight:
+    """按键合并并发调用，附带被合并（省掉）的调用数统计（线程安全）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._stats = {"calls": 0, "executed": 0, "suppressed": 0, "retried": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._stats["calls"] += 1
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight(current_deadline())
+                    self._stats["executed"] += 1
+
+            if leader:
+                return self._run(key, flight, fn)
+
+            self._wait(flight)
+            if flight.cancelled:
+                # leader 被取消，结果不可信，重新发起
+                with self._lock:
+                    self._stats["retried"] += 1
+                continue
+            with self._lock:
+                self._stats["suppressed"] += 1
+            print(f"🔗 合并重复的 {self.name} 调用")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+    def _run(self, key: Hashable, flight: _Flight, fn: Callable[[], Any]) -> Any:
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                flight.done = True
+                flight.cancelled = flight.deadline is not None and flight.deadline.expired
+                listeners, flight.listeners = flight.listeners, []
+            for listener in listeners:
+                listener.set()
+
+    def _wait(self, flight: _Flight):
+        """等待 leader 完成；自己的截止时间到了则抛出 DeadlineExceeded"""
+        wakeup = threading.Event()
+        with self._lock:
+            if flight.done:
+                return
+            flight.listeners.append(wakeup)
+
+        deadline = current_deadline()
+        if deadline is None:
+            wakeup.wait()
+            return
+        unregister = deadline.on_cancel(wakeup.set)
+        try:
+            wakeup.wait(deadline.remaining())
+        finally:
+            unregister()
+        with self._lock:
+            if flight.done:
+                return
+            if wakeup in flight.listeners:
+                flight.listeners.remove(wakeup)
+        deadline.check(f"等待进行中的 {self.name}")
+        raise DeadlineExceeded(f"等待进行中的 {self.name} 已超时")
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["suppressed_ratio"] = stats["suppressed"] / stats["calls"] if stats["calls"] else 0.0
+        return stats
+
+
+def search_key(query: str, max_results: int) -> Hashable:
+    """搜索的合并键：归一化后的搜索词 + 结果数"""
+    return normalize_query(query), max_results
+
+
+# 全局实例：web_search 的 DDGS 查询、记忆分类提示词
+search_flight = SingleFlight("web_search")
+classify_flight = SingleFlight("记忆分类")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证无界面 API 的非聊天接口与请求校验
+健康检查、记忆的增删查与历史、/chat 的参数校验（不发起模型调用）、未知路由
+在临时目录中运行，不修改仓库中的数据库，不依赖 LLM 服务
+"""
+
+import sys
+import os
+import socket
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    # langgraph_memorey 在当前目录打开 ai_memory.db，切换到临时目录避免写入仓库中的数据库
+    os.chdir(tempfile.mkdtemp())
+    import httpx
+    from api_server import ApiHandler
+
+    print("✅ 成功导入模块")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ApiHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = httpx.Client(base_url=f"http://127.0.0.1:{server.server_address[1]}", timeout=10)
+
+    # --- 1. 健康检查与请求 ID ---
+    print("\n=== 测试健康检查 ===")
+    response = client.get("/health", headers={"X-Request-Id": "req-1"})
+    assert response.status_code == 200 and response.json() == {"status": "ok"}
+    assert response.headers["X-Request-Id"] == "req-1" and "Server-Timing" in response.headers
+
+    # --- 2. 记忆增删查与历史 ---
+    print("\n=== 测试记忆接口 ===")
+    assert client.put("/memories/api_u1/user_name", json={"content": "小明"}).status_code == 200
+    assert client.put("/memories/api_u1/user_job", json={"content": "医生"}).status_code == 200
+    assert client.put("/memories/api_u1/user_job", json={"content": "  "}).status_code == 400
+    memories = client.get("/memories/api_u1").json()["memories"]
+    print(f"记忆: {[(m['memory_id'], m['content']) for m in memories]}")
+    assert {m["memory_id"]: m["content"] for m in memories} == {"user_name": "小明", "user_job": "医生"}
+    assert [m["memory_id"] for m in client.get("/memories/api_u1?category=job").json()["memories"]] == ["user_job"]
+    assert len(client.get("/memories/api_u1?limit=1").json()["memories"]) == 1
+    assert client.get("/memories/api_u1?limit=abc").status_code == 400
+    history = client.get("/memories/api_u1/user_job/history").json()["history"]
+    assert len(history) == 1
+
+    assert client.delete("/memories/api_u1/user_job").json() == {"deleted": True}
+    assert client.delete("/memories/api_u1/user_job").status_code == 404
+    assert [m["memory_id"] for m in client.get("/memories/api_u1").json()["memories"]] == ["user_name"]
+
+    # --- 3. /chat 参数校验：校验失败时不占用聊天名额、不调用模型 ---
+    print("\n=== 测试聊天参数校验 ===")
+    bad_bodies = [
+        {"message": "你好"},
+        {"user_id": "api_u1", "message": "  "},
+        {"user_id": "api_u1", "message": "你好", "timeout": "abc"},
+        {"user_id": "api_u1", "message": "你好", "timeout": -1},
+        {"user_id": "api_u1", "message": "你好", "timeout": 0},
+        {"user_id": "api_u1", "message": "你好", "timeout": 1e9},
+        {"user_id": "api_u1", "message": "你好", "timeout": None},
+    ]
+    for body in bad_bodies:
+        response = client.post("/chat", json=body)
+        print(f"{body} -> {response.status_code} {response.json()['error']}")
+        assert response.status_code == 400, body
+    assert client.post("/chat", content=b"{not json").status_code == 400
+    assert client.post("/chat", content=b"x" * (70 * 1024)).status_code == 400
+    # 非法的 Content-Length：立即返回 400 并关闭连接，不阻塞在读取请求体上
+    for length in (b"-1", b"abc"):
+        with socket.create_connection(server.server_address, timeout=5) as sock:
+            sock.sendall(b"POST /chat HTTP/1.1\r\nHost: x\r\nContent-Length: " + length + b"\r\n\r\n")
+            reply = b""
+            while chunk := sock.recv(4096):
+                reply += chunk
+        status_line = reply.split(b"\r\n", 1)[0].decode()
+        print(f"Content-Length {length.decode()} -> {status_line}")
+        assert status_line.split()[1] == "400"
+        assert "Content-Length 必须是非负整数" in reply.decode("utf-8")
+
+    # --- 4. 未知路由 ---
+    assert client.get("/unknown").status_code == 404
+    assert client.put("/memories/api_u1", json={"content": "x"}).status_code == 404
+
+    server.shutdown()
+    print("\n🎉 API 接口测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证离线批量推理调度
+同一会话按文件顺序执行、不同会话并发、输出带输入行号、出错轮次记录 error、
+--resume 跳过已完成的行并容忍中断时写出的半行
+用假的 run_turn 代替工作流，不依赖 LLM 服务
+"""
+
+import sys
+import os
+import json
+import tempfile
+import threading
+import time
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import batch_runner
+
+    print("✅ 成功导入模块")
+
+    lock = threading.Lock()
+    executed = []
+    active = {"now": 0, "max": 0}
+
+    def fake_run_turn(turn, timeout):
+        with lock:
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+        time.sleep(0.05)
+        with lock:
+            active["now"] -= 1
+            executed.append((turn["thread_id"], turn["message"]))
+        record = {"line": turn["line"], "id": turn.get("id"), "user_id": turn["user_id"],
+                  "thread_id": turn["thread_id"]}
+        if turn["message"] == "坏输入":
+            record["error"] = "ValueError: 坏输入"
+        else:
+            record["reply"] = f"回答: {turn['message']}"
+        return record
+
+    batch_runner.run_turn = fake_run_turn
+
+    tmp = tempfile.mkdtemp()
+    in_path, out_path = os.path.join(tmp, "turns.jsonl"), os.path.join(tmp, "results.jsonl")
+    turns = [{"user_id": f"u{i % 4}", "message": f"第{i // 4}句"} for i in range(16)]
+    turns[5]["message"] = "坏输入"
+    with open(in_path, "w", encoding="utf-8") as f:
+        for turn in turns:
+            f.write(json.dumps(turn, ensure_ascii=False) + "\n")
+        f.write("\n")   # 空行被忽略
+
+    # --- 1. 会话内按序、会话间并发 ---
+    print("\n=== 测试批量执行 ===")
+    stats = batch_runner.run_batch(in_path, out_path, concurrency=4)
+    with open(out_path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    print(f"统计: {stats}，最大并发 {active['max']}")
+    assert stats["done"] == 16 and stats["errors"] == 1 and len(records) == 16
+    assert sorted(r["line"] for r in records) == list(range(1, 17))
+    assert all(r["thread_id"] == f"thread_{r['user_id']}" for r in records)
+    for user in ("u0", "u2", "u3"):
+        order = [m for t, m in executed if t == f"thread_{user}"]
+        assert order == [f"第{i}句" for i in range(4)], (user, order)
+    assert 1 < active["max"] <= 4
+
+    # --- 2. 续传：跳过已完成的行，中断时写出的半行不影响 ---
+    print("\n=== 测试续传 ===")
+    with open(out_path, "w", encoding="utf-8") as f:
+        for record in records[:10]:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.write('{"line": 99, "repl')
+    done_lines = {r["line"] for r in records[:10]}
+    executed.clear()
+    stats = batch_runner.run_batch(in_path, out_path, concurrency=4, resume=True)
+    print(f"统计: {stats}")
+    assert stats["skipped"] == 10 and stats["done"] == 6
+    rerun_lines = {i + 1 for i, turn in enumerate(turns) if (f"thread_{turn['user_id']}", turn["message"]) in executed}
+    assert rerun_lines.isdisjoint(done_lines)
+    with open(out_path, encoding="utf-8") as f:
+        lines = [json.loads(line)["line"] for line in f]
+    assert sorted(lines) == list(range(1, 17))
+
+    print("\n🎉 批量推理测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证多进程缓存一致性
+两个连接模拟两个工作进程：一方提交写入后另一方只失效对应用户与范围，
+本连接自己的写入、未提交或已回滚的写入都不触发失效
+使用临时数据库，不依赖 LLM 服务
+"""
+
+import sys
+import os
+import sqlite3
+import tempfile
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from cache_coherence import SCOPE_HISTORY, SCOPE_MEMORY, CacheCoherence, touch_user
+    from memory_schema import ensure_memory_schema, upsert_memory
+
+    print("✅ 成功导入模块")
+    db_path = os.path.join(tempfile.mkdtemp(), "coherence.db")
+    writer = sqlite3.connect(db_path, check_same_thread=False)   # 另一个进程
+    reader = sqlite3.connect(db_path, check_same_thread=False)   # 本进程
+    ensure_memory_schema(writer)
+    ensure_memory_schema(reader)
+
+    invalidated = []
+    coherence = CacheCoherence(reader, lambda user_id, scope: invalidated.append((user_id, scope)))
+
+    # --- 1. 没有其他连接提交时不失效任何缓存 ---
+    print("\n=== 测试无变化 ===")
+    assert coherence.check() == [] and invalidated == []
+
+    # --- 2. 其他连接提交的写入：只失效对应的用户与范围 ---
+    print("\n=== 测试跨连接失效 ===")
+    upsert_memory(writer, "u1", "user_name", "小明")
+    touch_user(writer, "u2", SCOPE_HISTORY)
+    writer.commit()
+    changed = coherence.check()
+    print(f"失效: {changed}，统计: {coherence.stats}")
+    assert changed == [("u1", SCOPE_MEMORY), ("u2", SCOPE_HISTORY)] and invalidated == changed
+    assert coherence.check() == []   # 同一批变化只通知一次
+
+    # 同一用户多次写入只通知一次
+    upsert_memory(writer, "u1", "user_job", "医生")
+    upsert_memory(writer, "u1", "user_hobby", "跑步")
+    writer.commit()
+    assert coherence.check() == [("u1", SCOPE_MEMORY)]
+
+    # --- 3. 未提交与已回滚的写入不可见 ---
+    print("\n=== 测试未提交与回滚 ===")
+    upsert_memory(writer, "u3", "user_name", "小红")
+    assert coherence.check() == []
+    writer.rollback()
+    assert coherence.check() == []
+
+    # --- 4. 本连接自己的提交不会让 data_version 变化，由写入方自行失效缓存 ---
+    print("\n=== 测试本连接写入 ===")
+    upsert_memory(reader, "u4", "user_name", "小刚")
+    reader.commit()
+    assert coherence.check() == []
+
+    # 之后其他连接的写入仍能检测到；本连接之前的写入随之一并通知（多一次失效，不影响正确性）
+    touch_user(writer, "u5", SCOPE_MEMORY)
+    writer.commit()
+    changed = coherence.check()
+    print(f"失效: {changed}")
+    assert changed == [("u4", SCOPE_MEMORY), ("u5", SCOPE_MEMORY)] and coherence.stats["changes"] == 3
+
+    writer.close()
+    reader.close()
+    print("\n🎉 缓存一致性测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证 LLM / 搜索磁带
+录制流式回答与工具调用、服务关闭后回放（原始延迟 / 无延迟）、搜索结果与异常的回放、未匹配请求
+"""
+
+import sys
+import os
+import json
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeToolCallHandler(BaseHTTPRequestHandler):
+    """流式返回一段中文回答和一个工具调用，数据块在多字节字符中间切开"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.hits += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        deltas = [
+            {"role": "assistant", "content": "你好，"},
+            {"content": "我来搜索"},
+            {"tool_calls": [{"index": 0, "id": "call_1", "type": "function",
+                             "function": {"name": "web_search", "arguments": "{\"queries\": [\"新闻\"]}"}}]},
+        ]
+        for i, delta in enumerate(deltas):
+            time.sleep(0.1)
+            chunk = {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "fake",
+                     "choices": [{"index": 0, "delta": delta,
+                                  "finish_reason": "tool_calls" if i == len(deltas) - 1 else None}]}
+            data = f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+            split = data.index("你".encode("utf-8")) + 1 if i == 0 else len(data)
+            for part in (data[:split], data[split:]):
+                if part:
+                    self.wfile.write(part)
+                    self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+class FakeDDGS:
+    calls = 0
+
+    def __init__(self, **kwargs):
+        pass
+
+    def text(self, query, max_results=3):
+        FakeDDGS.calls += 1
+        time.sleep(0.2)
+        if query == "限流":
+            raise RuntimeError("Ratelimit")
+        return iter([{"title": f"{query} 标题", "body": "摘要", "href": "https://example.com"}])
+
+
+try:
+    import httpx
+    from langchain_openai import ChatOpenAI
+    from cassette import Cassette, CassetteMiss, CassetteSearch, CassetteTransport, cassette_info
+
+    print("✅ 成功导入模块")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeToolCallHandler)
+    server.daemon_threads = True
+    server.hits = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    path = os.path.join(tempfile.mkdtemp(), "cassette.jsonl.gz")
+
+    def make_llm(cassette):
+        client = httpx.Client(transport=CassetteTransport(httpx.HTTPTransport(), cassette))
+        return ChatOpenAI(model="fake", openai_api_key="EMPTY", openai_api_base=base_url,
+                          streaming=True, http_client=client)
+
+    # --- 1. 录制 ---
+    print("\n=== 测试录制 ===")
+    cassette = Cassette(path, "record")
+    llm = make_llm(cassette)
+    start = time.perf_counter()
+    recorded = [llm.invoke("今天有什么新闻？"), llm.invoke("再说一遍")]
+    live_seconds = time.perf_counter() - start
+    search = CassetteSearch(cassette, FakeDDGS)
+    recorded_results = search.text("人工智能", max_results=3)
+    try:
+        search.text("限流", max_results=3)
+    except RuntimeError:
+        pass
+    cassette.close()
+    info = cassette_info(path)
+    print(f"回答: {recorded[0].content!r}，工具调用: {recorded[0].tool_calls}，磁带: {info}")
+    assert recorded[0].content == "你好，我来搜索" and recorded[0].tool_calls[0]["name"] == "web_search"
+    assert info["http"] == 2 and info["search"] == 2 and server.hits == 2
+
+    # --- 2. 服务关闭后回放，结果一致 ---
+    print("\n=== 测试无延迟回放 ===")
+    server.shutdown()
+    server.server_close()
+    FakeDDGS.calls = 0
+    cassette = Cassette(path, "replay", latency="zero")
+    llm = make_llm(cassette)
+    start = time.perf_counter()
+    replayed = [llm.invoke("今天有什么新闻？"), llm.invoke("再说一遍")]
+    replay_seconds = time.perf_counter() - start
+    print(f"录制耗时 {live_seconds:.2f}s，回放耗时 {replay_seconds:.3f}s")
+    for a, b in zip(recorded, replayed):
+        assert a.content == b.content and a.tool_calls == b.tool_calls
+    assert replay_seconds < live_seconds / 3
+
+    search = CassetteSearch(cassette, None)
+    assert search.text("人工智能", max_results=3) == recorded_results
+    try:
+        search.text("限流", max_results=3)
+        raise AssertionError("应回放出录制时的异常")
+    except RuntimeError as e:
+        assert "Ratelimit" in str(e)
+    assert FakeDDGS.calls == 0
+
+    # 同一请求重复回放最后一条；未录制的请求报错
+    assert llm.invoke("再说一遍").content == recorded[1].content
+    try:
+        llm.invoke("没有录制过的问题")
+        raise AssertionError("未录制的请求应报错")
+    except CassetteMiss as e:
+        print(f"未匹配: {e}")
+    print(f"统计: {cassette.stats}")
+    assert cassette.stats["misses"] == 1
+
+    # --- 3. 按原始延迟回放 ---
+    print("\n=== 测试原始延迟回放 ===")
+    cassette = Cassette(path, "replay", latency="original")
+    start = time.perf_counter()
+    make_llm(cassette).invoke("今天有什么新闻？")
+    elapsed = time.perf_counter() - start
+    print(f"耗时 {elapsed:.2f}s")
+    assert 0.25 < elapsed < 1.0
+
+    # --- 4. 在多字节字符中间切开的数据块原样录制与回放 ---
+    print("\n=== 测试切开的多字节字符 ===")
+    payload = "data: 你好，世界\n\ndata: [DONE]\n\n".encode("utf-8")
+    pieces = [payload[:7], payload[7:12], payload[12:]]   # 前两块都在汉字中间结束
+
+    class SplitStream(httpx.SyncByteStream):
+        def __iter__(self):
+            yield from pieces
+
+    split_path = os.path.join(tempfile.mkdtemp(), "split.jsonl.gz")
+    mock = httpx.MockTransport(lambda request: httpx.Response(200, stream=SplitStream()))
+    cassette = Cassette(split_path, "record")
+    with httpx.Client(transport=CassetteTransport(mock, cassette)) as client:
+        with client.stream("POST", "http://llm/v1/chat/completions", json={"q": 1}) as response:
+            assert b"".join(response.iter_raw()) == payload
+    cassette.close()
+    cassette = Cassette(split_path, "replay")
+    with httpx.Client(transport=CassetteTransport(mock, cassette)) as client:
+        with client.stream("POST", "http://llm/v1/chat/completions", json={"q": 1}) as response:
+            replayed = list(response.iter_raw())
+    print(f"回放的数据块: {replayed}")
+    assert replayed == pieces
+
+    print("\n🎉 磁带测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证压缩的 checkpoint 存储
+大消息正文按内容只存一份、恢复的会话状态与原始一致、整体压缩与解压、
+未压缩的旧 checkpoint 照常读取、提交失败回滚后正文会被重新写入
+使用临时数据库，不依赖 LLM 服务
+"""
+
+import sys
+import os
+import sqlite3
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from typing import Annotated, TypedDict
+    from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    from langgraph.graph import StateGraph, START, END
+    from langgraph.graph.message import add_messages
+    from checkpoint_store import CompressedSerializer, CompressedSqliteSaver, checkpoint_storage_stats
+
+    print("✅ 成功导入模块")
+
+    SEARCH_RESULT = "\n".join(f"{i}. 北京天气相关的搜索结果，包含较长的摘要文本。" for i in range(200))
+
+    class State(TypedDict):
+        messages: Annotated[list, add_messages]
+
+    def build_app(checkpointer):
+        def search(state):
+            return {"messages": [ToolMessage(content=SEARCH_RESULT, tool_call_id="call_1")]}
+
+        def reply(state):
+            return {"messages": [AIMessage(content=f"第 {len(state['messages'])} 条回复")]}
+
+        graph = StateGraph(State)
+        graph.add_node("search", search)
+        graph.add_node("reply", reply)
+        graph.add_edge(START, "search")
+        graph.add_edge("search", "reply")
+        graph.add_edge("reply", END)
+        return graph.compile(checkpointer=checkpointer)
+
+    def run_turns(app, thread_id, turns=3):
+        config = {"configurable": {"thread_id": thread_id}}
+        for i in range(turns):
+            app.invoke({"messages": [HumanMessage(content=f"问题 {i}")]}, config)
+        return app.get_state(config).values["messages"]
+
+    # --- 1. 同一正文在多个 checkpoint 与多个会话中只存一份，状态完整恢复 ---
+    print("\n=== 测试正文去重与状态恢复 ===")
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    saver = CompressedSqliteSaver(conn)
+    app = build_app(saver)
+    messages = run_turns(app, "thread_a") + run_turns(app, "thread_b")
+    stats = checkpoint_storage_stats(conn)
+    print(f"存储统计: {stats}，序列化统计: {saver.blob_serde.stats}")
+    assert stats["checkpoint_blobs_rows"] == 1
+    assert [m.content for m in messages if isinstance(m, ToolMessage)] == [SEARCH_RESULT] * 6
+
+    # 新的保存器（没有进程内缓存）从库中读出同样的状态
+    fresh = build_app(CompressedSqliteSaver(conn)).get_state({"configurable": {"thread_id": "thread_a"}})
+    assert [m.content for m in fresh.values["messages"]] == [m.content for m in messages[:9]]
+
+    # --- 2. 与原生 SqliteSaver 对比：体积更小 ---
+    print("\n=== 测试存储体积 ===")
+    plain_conn = sqlite3.connect(":memory:", check_same_thread=False)
+    plain_messages = run_turns(build_app(SqliteSaver(plain_conn)), "thread_a")
+    plain = checkpoint_storage_stats(plain_conn)
+    compressed_conn = sqlite3.connect(":memory:", check_same_thread=False)
+    run_turns(build_app(CompressedSqliteSaver(compressed_conn)), "thread_a")
+    compressed = checkpoint_storage_stats(compressed_conn)
+    plain_bytes = plain["checkpoints_bytes"] + plain["writes_bytes"]
+    compressed_bytes = sum(compressed[f"{t}_bytes"] for t in ("checkpoints", "writes", "checkpoint_blobs"))
+    print(f"原生 {plain_bytes} 字节，压缩后 {compressed_bytes} 字节")
+    assert compressed_bytes * 3 < plain_bytes
+
+    # --- 3. 未压缩的旧 checkpoint 照常读取 ---
+    print("\n=== 测试读取旧 checkpoint ===")
+    legacy = build_app(CompressedSqliteSaver(plain_conn)).get_state({"configurable": {"thread_id": "thread_a"}})
+    assert [m.content for m in legacy.values["messages"]] == [m.content for m in plain_messages]
+
+    serde = CompressedSerializer()
+    small = serde.dumps_typed({"text": "短内容"})
+    large = serde.dumps_typed({"text": "长内容" * 500})
+    print(f"类型: {small[0]} / {large[0]}")
+    assert "+" not in small[0] and "+" in large[0]
+    assert serde.loads_typed(large) == {"text": "长内容" * 500}
+
+    # --- 4. 提交失败回滚：正文不能被记为已入库 ---
+    print("\n=== 测试提交失败后的正文 ===")
+
+    class FlakyConnection(sqlite3.Connection):
+        """第一次提交含正文的事务时回滚并报错，模拟 SQLITE_BUSY / 磁盘已满"""
+        fail_blob_commit = False
+
+        def commit(self):
+            if self.fail_blob_commit and self.execute("SELECT COUNT(*) FROM checkpoint_blobs").fetchone()[0]:
+                self.fail_blob_commit = False
+                self.rollback()
+                raise sqlite3.OperationalError("database is locked")
+            super().commit()
+
+    flaky_conn = sqlite3.connect(":memory:", check_same_thread=False, factory=FlakyConnection)
+    flaky_saver = CompressedSqliteSaver(flaky_conn)
+    flaky_saver.setup()
+    flaky_app = build_app(flaky_saver)
+    flaky_conn.fail_blob_commit = True
+    try:
+        run_turns(flaky_app, "thread_failed", turns=1)
+        raise AssertionError("提交失败应向调用方抛出")
+    except sqlite3.OperationalError:
+        pass
+    run_turns(flaky_app, "thread_retry", turns=1)
+    retried = build_app(CompressedSqliteSaver(flaky_conn)).get_state({"configurable": {"thread_id": "thread_retry"}})
+    print(f"重试后正文行数: {checkpoint_storage_stats(flaky_conn)['checkpoint_blobs_rows']}")
+    assert [m.content for m in retried.values["messages"] if isinstance(m, ToolMessage)] == [SEARCH_RESULT]
+
+    print("\n🎉 checkpoint 存储测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
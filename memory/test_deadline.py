@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证可取消的截止时间
+到期自动取消、可打断的等待、取消回调、节点边界检查，
+以及 DeadlineTransport 收紧超时并在取消时中止正在读取的响应流
+使用本地 HTTP 服务模拟慢速流式响应，不依赖 LLM 服务
+"""
+
+import sys
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SlowStreamHandler(BaseHTTPRequestHandler):
+    """每 0.2 秒写出一行，共 20 行"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.end_headers()
+        try:
+            for i in range(20):
+                self.wfile.write(f"line {i}\n".encode())
+                self.wfile.flush()
+                time.sleep(0.2)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+try:
+    import httpx
+    from deadline import Deadline, DeadlineExceeded, DeadlineTransport, activate, current_deadline, deadline_node
+
+    print("✅ 成功导入模块")
+
+    # --- 1. 到期自动取消、可打断的等待与取消回调 ---
+    print("\n=== 测试截止时间与取消 ===")
+    deadline = Deadline(0.2)
+    fired = []
+    deadline.on_cancel(lambda: fired.append("a"))
+    unregister = deadline.on_cancel(lambda: fired.append("b"))
+    unregister()
+    start = time.perf_counter()
+    assert deadline.wait(5) is False
+    elapsed = time.perf_counter() - start
+    time.sleep(0.05)   # 等待计时器线程执行取消回调
+    print(f"等待 {elapsed:.2f}s 后到期，原因: {deadline.reason}，回调: {fired}")
+    assert elapsed < 0.5 and deadline.reason == "timeout" and fired == ["a"]
+    deadline.on_cancel(lambda: fired.append("late"))   # 已取消时立即执行
+    assert fired == ["a", "late"] and deadline.remaining() == 0.0
+
+    finished = Deadline(5)
+    assert finished.wait(0.01) is True
+    finished.release()
+    finished.cancel(reason="client_gone")
+    assert finished.expired and finished.reason == "client_gone"
+
+    # --- 2. 节点边界检查与上下文激活 ---
+    print("\n=== 测试节点包装 ===")
+    seen = []
+
+    @deadline_node
+    def node(state, config):
+        seen.append(current_deadline())
+        return state
+
+    live = Deadline(5)
+    node({}, {"configurable": {"deadline": live}})
+    assert seen == [live] and current_deadline() is None
+    try:
+        node({}, {"configurable": {"deadline": deadline}})
+        raise AssertionError("已过期的截止时间应阻止节点执行")
+    except DeadlineExceeded:
+        assert len(seen) == 1
+    live.release()
+
+    # --- 3. DeadlineTransport：取消时中止正在读取的流 ---
+    print("\n=== 测试取消进行中的 HTTP 流 ===")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowStreamHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = httpx.Client(transport=DeadlineTransport(httpx.HTTPTransport()))
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    turn = Deadline(10)
+    threading.Timer(0.5, turn.cancel).start()
+    lines = []
+    start = time.perf_counter()
+    try:
+        with activate(turn), client.stream("GET", url) as response:
+            for line in response.iter_lines():
+                lines.append(line)
+    except httpx.HTTPError:
+        pass
+    elapsed = time.perf_counter() - start
+    print(f"取消后 {elapsed:.2f}s 结束，读到 {len(lines)} 行")
+    assert elapsed < 1.5 and 0 < len(lines) < 20
+
+    # 已过期时不再发出请求；没有截止时间时照常透传
+    try:
+        with activate(deadline):
+            client.get(url)
+        raise AssertionError("已过期的截止时间应阻止请求")
+    except DeadlineExceeded:
+        pass
+    with client.stream("GET", url) as response:
+        assert response.status_code == 200
+
+    server.shutdown()
+    print("\n🎉 截止时间测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证多副本 LLM 端点池
+用本地假的 OpenAI 兼容服务验证：最少在途路由、故障摘除与重试、对冲请求、ChatOpenAI 接入、优先级调度与后台请求降级
+"""
+
+import sys
+import os
+import json
+import threading
+import time
+import concurrent.futures
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeVLLMHandler(BaseHTTPRequestHandler):
+    """最小的 OpenAI 兼容接口：/v1/models 与流式 /v1/chat/completions"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = json.dumps({"data": [{"id": "fake"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.lock:
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            server.hits += 1
+            server.headers_seen.append(dict(self.headers))
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            time.sleep(server.first_chunk_delay)
+            for text in (server.name, "!"):
+                chunk = {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "fake",
+                         "choices": [{"index": 0, "delta": {"role": "assistant", "content": text}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+        finally:
+            with server.lock:
+                server.active -= 1
+
+
+def start_fake_server(name: str, first_chunk_delay: float = 0.0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeVLLMHandler)
+    server.daemon_threads = True
+    server.name = name
+    server.first_chunk_delay = first_chunk_delay
+    server.lock = threading.Lock()
+    server.active = server.peak = server.hits = 0
+    server.headers_seen = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def base_url(server) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def chat(client, url: str, headers=None) -> str:
+    """发送一个流式请求，返回拼接的内容"""
+    with client.stream("POST", f"{url}/chat/completions", json={"model": "fake", "stream": True,
+                       "messages": [{"role": "user", "content": "hi"}]}, headers=headers or {}) as response:
+        parts = []
+        for line in response.iter_lines():
+            if line.startswith("data: {"):
+                parts.append(json.loads(line[6:])["choices"][0]["delta"]["content"])
+        return "".join(parts)
+
+
+try:
+    import httpx
+    from llm_pool import (EndpointPool, HEDGE_HEADER, LLMScheduler, PRIORITY_BACKGROUND, PRIORITY_HEADER,
+                          hedged, prioritized)
+
+    print("✅ 成功导入模块")
+
+    # --- 1. 最少在途请求路由 ---
+    print("\n=== 测试最少在途路由 ===")
+    servers = [start_fake_server(f"s{i}", first_chunk_delay=0.3) for i in range(3)]
+    pool = EndpointPool([base_url(s) for s in servers], health_interval=0)
+    client = httpx.Client(transport=pool)
+    with concurrent.futures.ThreadPoolExecutor(6) as executor:
+        replies = list(executor.map(lambda _: chat(client, pool.base_url), range(6)))
+    print(f"回复: {replies}，各副本峰值并发: {[s.peak for s in servers]}")
+    assert all(s.hits == 2 and s.peak == 2 for s in servers)
+    assert all(e["outstanding"] == 0 for e in pool.snapshot())
+
+    # --- 2. 故障副本：连接失败时换副本重试，连续失败后摘除 ---
+    print("\n=== 测试故障摘除 ===")
+    servers[0].shutdown()
+    servers[0].server_close()
+    for s in servers:
+        s.first_chunk_delay = 0.0
+    pool = EndpointPool([base_url(s) for s in servers], health_interval=0, max_failures=2, eject_seconds=60)
+    client = httpx.Client(transport=pool)
+    replies = [chat(client, pool.base_url) for _ in range(4)]
+    snapshot = pool.snapshot()
+    print(f"回复: {replies}，状态: {[(e['healthy'], e['errors']) for e in snapshot]}，统计: {pool.stats}")
+    assert "s0!" not in replies and not snapshot[0]["healthy"]
+    assert pool.stats["ejections"] == 1
+    assert not pool.probe(pool.endpoints[0]) and pool.probe(pool.endpoints[1])
+
+    # --- 3. 对冲请求：主副本首块慢时由另一个副本返回 ---
+    print("\n=== 测试对冲请求 ===")
+    slow, fast = start_fake_server("slow", first_chunk_delay=2.0), start_fake_server("fast")
+    pool = EndpointPool([base_url(slow), base_url(fast)], health_interval=0, hedge_delay=0.2)
+    client = httpx.Client(transport=pool)
+    start = time.perf_counter()
+    reply = chat(client, pool.base_url, headers={HEDGE_HEADER: "1"})
+    elapsed = time.perf_counter() - start
+    print(f"回复: {reply}，耗时 {elapsed:.2f}s，统计: {pool.stats}")
+    assert reply == "fast!" and elapsed < 1.5 and pool.stats["hedged"] == 1
+    assert all(HEDGE_HEADER.lower() not in {k.lower() for k in h} for h in fast.headers_seen)
+    time.sleep(2.2)  # 等慢副本返回后被关闭
+    assert all(e["outstanding"] == 0 for e in pool.snapshot())
+
+    # 读取首块失败的副本：响应被关闭，在途计数归零，错误抛给调用方
+    class BrokenStream(httpx.SyncByteStream):
+        def __iter__(self):
+            raise httpx.ReadError("连接被重置")
+            yield b""
+
+    broken = EndpointPool(["http://a.invalid/v1", "http://b.invalid/v1"], health_interval=0, hedge_delay=0.05,
+                          transport=httpx.MockTransport(lambda request: httpx.Response(200, stream=BrokenStream())))
+    try:
+        chat(httpx.Client(transport=broken), broken.base_url, headers={HEDGE_HEADER: "1"})
+        raise AssertionError("首块读取失败应抛出异常")
+    except httpx.ReadError:
+        pass
+    print(f"首块失败后在途数: {[e['outstanding'] for e in broken.snapshot()]}")
+    assert all(e["outstanding"] == 0 for e in broken.snapshot())
+
+    # --- 4. ChatOpenAI 经端点池调用 ---
+    print("\n=== 测试 ChatOpenAI 接入 ===")
+    from langchain_openai import ChatOpenAI
+    fast.headers_seen.clear()
+    pool = EndpointPool([base_url(fast), base_url(servers[1])], health_interval=0)
+    llm = ChatOpenAI(model="fake", openai_api_key="EMPTY", openai_api_base=pool.base_url, streaming=True,
+                     http_client=httpx.Client(transport=pool))
+    replies = {llm.invoke("hi").content, hedged(llm).invoke("hi").content}
+    print(f"回复: {replies}")
+    assert replies <= {"fast!", "s1!"}
+
+    # --- 5. 优先级调度：交互式请求先于排队的后台请求，排队过深时拒绝后台请求 ---
+    print("\n=== 测试优先级调度 ===")
+    slow = start_fake_server("q", first_chunk_delay=0.3)
+    scheduler = LLMScheduler(EndpointPool([base_url(slow)], health_interval=0), max_concurrency=1,
+                             class_limits={PRIORITY_BACKGROUND: 1}, shed_queue_depth=2, queue_timeout=5)
+    client = httpx.Client(transport=scheduler)
+    background = {PRIORITY_HEADER: PRIORITY_BACKGROUND}
+    finished = []
+
+    def timed_chat(label, headers=None):
+        try:
+            chat(client, base_url(slow), headers=headers)
+            finished.append(label)
+        except httpx.HTTPStatusError:
+            finished.append(f"{label}:503")
+
+    threads = []
+    for label, headers in (("bg1", background), ("bg2", background), ("ui1", None)):
+        threads.append(threading.Thread(target=timed_chat, args=(label, headers)))
+        threads[-1].start()
+        time.sleep(0.05)
+    for t in threads:
+        t.join()
+    snapshot = scheduler.snapshot()
+    print(f"完成顺序: {finished}，峰值并发: {slow.peak}，指标: {snapshot['classes']}")
+    assert finished == ["bg1", "ui1", "bg2"] and slow.peak == 1
+    assert snapshot["running"] == 0 and snapshot["classes"]["interactive"]["max_wait_ms"] > 0
+
+    # 交互式排队达到 2 个时，排队中的和新到的后台请求都被拒绝（503，不占用模型）
+    finished.clear()
+    client = httpx.Client(transport=scheduler, event_hooks={"response": [lambda r: r.raise_for_status()]})
+    hits_before = slow.hits
+    threads = []
+    for label, headers in (("ui1", None), ("bg1", background), ("ui2", None), ("ui3", None), ("bg2", background)):
+        threads.append(threading.Thread(target=timed_chat, args=(label, headers)))
+        threads[-1].start()
+        time.sleep(0.05)
+    for t in threads:
+        t.join()
+    snapshot = scheduler.snapshot()
+    print(f"完成顺序: {finished}，后台指标: {snapshot['classes']['background']}")
+    assert sorted(finished) == ["bg1:503", "bg2:503", "ui1", "ui2", "ui3"]
+    assert slow.hits - hits_before == 3 and snapshot["classes"]["background"]["shed"] == 2
+
+    # ChatOpenAI 收到拒绝后不重试
+    from openai import InternalServerError
+    llm = ChatOpenAI(model="fake", openai_api_key="EMPTY", openai_api_base=base_url(slow), streaming=True,
+                     http_client=httpx.Client(transport=scheduler))
+    holders = [threading.Thread(target=llm.invoke, args=("hi",)) for _ in range(3)]
+    for t in holders:
+        t.start()
+        time.sleep(0.05)
+    hits_before = slow.hits
+    try:
+        prioritized(llm, PRIORITY_BACKGROUND).invoke("hi")
+        raise AssertionError("后台请求应被拒绝")
+    except InternalServerError as e:
+        print(f"后台请求被拒绝: {e}")
+    for t in holders:
+        t.join()
+    assert slow.hits - hits_before == 2
+
+    print("\n🎉 LLM 端点池测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
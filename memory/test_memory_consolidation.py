@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证离线记忆整理
+近似重复的条目合并为规范键；内容冲突的疑难簇只有 LLM 给出合并结果时才合并，
+LLM 不可用或失败时原样保留；只有一条的簇不改名；修饰词不会把键归错类
+使用临时数据库，不依赖 LLM 服务
+"""
+
+import sys
+import os
+import sqlite3
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from memory_schema import canonical_key, ensure_memory_schema, upsert_memory
+    from memory_consolidation import _ensure_state_table, consolidate_user
+
+    print("✅ 成功导入模块")
+
+    def make_db(rows):
+        conn = sqlite3.connect(":memory:")
+        ensure_memory_schema(conn)
+        _ensure_state_table(conn)
+        for memory_id, content, updated_at in rows:
+            upsert_memory(conn, "u1", memory_id, content, source="tool")
+            conn.execute("UPDATE user_memories SET updated_at = ? WHERE user_id = 'u1' AND memory_id = ?",
+                         (updated_at, memory_id))
+        conn.commit()
+        return conn
+
+    def memories(conn):
+        return dict(conn.execute("SELECT memory_id, content FROM user_memories WHERE user_id = 'u1'").fetchall())
+
+    class FakeLLM:
+        def __init__(self, reply=None, error=None):
+            self.reply, self.error, self.calls = reply, error, 0
+
+        def invoke(self, messages):
+            self.calls += 1
+            if self.error:
+                raise self.error
+            return type("Reply", (), {"content": self.reply})()
+
+    # --- 1. 规范键：整键或中心词匹配，修饰词属于其他类别时不推断 ---
+    print("\n=== 测试规范键推断 ===")
+    cases = {
+        "user_job": "user_job", "occupation": "user_job", "favorite_hobby": "user_hobby",
+        "current_city": "user_location", "work_address": None, "home_phone": None, "hobby_music": None,
+    }
+    actual = {k: canonical_key(k) for k in cases}
+    print(f"推断结果: {actual}")
+    assert actual == cases
+
+    # --- 2. 近似重复合并为规范键，保留最新内容 ---
+    print("\n=== 测试重复条目合并 ===")
+    conn = make_db([("job", "软件工程师", "2024-01-01 00:00:00"),
+                    ("occupation", "软件工程师。", "2024-02-01 00:00:00"),
+                    ("user_name", "小明", "2024-01-01 00:00:00")])
+    stats = consolidate_user(conn, "u1")
+    print(f"统计: {stats}，结果: {memories(conn)}")
+    assert memories(conn) == {"user_job": "软件工程师。", "user_name": "小明"}
+    assert stats["clusters"] == 1 and stats["removed"] == 2
+
+    # --- 3. 内容冲突的条目在没有 LLM 时不丢失、不改名 ---
+    print("\n=== 测试冲突条目保持不变 ===")
+    original = [("user_job", "程序员", "2024-01-01 00:00:00"),
+                ("work_address", "北京海淀区中关村大厦", "2024-02-01 00:00:00"),
+                ("hobby_music", "喜欢听音乐", "2024-01-01 00:00:00"),
+                ("hobby_sport", "打篮球", "2024-02-01 00:00:00"),
+                ("home_phone", "13800000000", "2024-01-01 00:00:00")]
+    conn = make_db(original)
+    before = memories(conn)
+    stats = consolidate_user(conn, "u1")
+    print(f"统计: {stats}，结果: {memories(conn)}")
+    assert memories(conn) == before and stats["removed"] == 0
+
+    # 同一类别但内容冲突的疑难簇：没有 LLM、LLM 调用失败或返回无法解析的内容时都保持不变
+    hobbies = [("favorite_hobby", "喜欢听音乐", "2024-01-01 00:00:00"),
+               ("hobby", "打篮球", "2024-02-01 00:00:00")]
+    for llm in (None, FakeLLM(error=RuntimeError("服务不可用")), FakeLLM(reply="无法判断")):
+        conn = make_db(hobbies)
+        stats = consolidate_user(conn, "u1", llm=llm)
+        assert memories(conn) == {"favorite_hobby": "喜欢听音乐", "hobby": "打篮球"}
+        assert stats["skipped_hard"] == 1 and stats["llm_resolved"] == 0
+
+    # --- 4. LLM 给出合并结果时才合并疑难簇 ---
+    print("\n=== 测试 LLM 合并疑难簇 ===")
+    conn = make_db(hobbies)
+    llm = FakeLLM(reply='{"0": "喜欢听音乐和打篮球"}')
+    stats = consolidate_user(conn, "u1", llm=llm)
+    print(f"统计: {stats}，结果: {memories(conn)}")
+    assert llm.calls == 1 and stats["llm_resolved"] == 1
+    assert memories(conn) == {"user_hobby": "喜欢听音乐和打篮球"}
+
+    print("\n🎉 记忆整理测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
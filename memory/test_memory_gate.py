@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证记忆提取的本地门控
+不依赖 LLM 服务：规则、n-gram 模型训练、节省统计与探索采样
+"""
+
+import sys
+import os
+import json
+import tempfile
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+POSITIVE_TEXTS = [
+    "我叫李四", "我今年30岁了", "我在医院工作", "我住在北京海淀区", "我喜欢打篮球",
+    "我老婆是老师", "叫我小王就行", "我的生日是五月一号", "My name is Tom", "I work at a bank",
+]
+NEGATIVE_TEXTS = [
+    "今天天气怎么样", "帮我写一首诗", "Python 怎么读取文件", "北京有什么好玩的地方",
+    "解释一下量子计算", "谢谢", "明天会下雨吗", "推荐几本科幻小说", "What is LangGraph?", "1+1等于几",
+]
+
+try:
+    from memory_gate import MemoryGate, NgramLogisticModel, rule_match, evaluate, load_samples
+
+    print("✅ 成功导入模块")
+
+    # --- 1. 规则：自述个人信息必须放行 ---
+    print("\n=== 测试规则召回 ===")
+    missed = [t for t in POSITIVE_TEXTS if not rule_match(t)]
+    print(f"规则未命中: {missed}")
+    assert not missed
+    false_hits = [t for t in NEGATIVE_TEXTS if rule_match(t)]
+    print(f"规则误命中: {false_hits}")
+    assert not false_hits
+
+    # --- 2. 从日志训练 n-gram 模型 ---
+    print("\n=== 测试模型训练 ===")
+    log_path = os.path.join(tempfile.mkdtemp(), "gate_log.jsonl")
+    gate = MemoryGate(log_path=log_path)
+    extra_positive = ["本人是一名程序员", "家里有两只猫", "平时周末去爬山", "毕业于清华大学"]
+    for text in POSITIVE_TEXTS + extra_positive:
+        gate.log_decision(text, True)
+    for text in NEGATIVE_TEXTS:
+        gate.log_decision(text, False)
+    samples = load_samples(log_path)
+    assert len(samples) == len(POSITIVE_TEXTS) + len(extra_positive) + len(NEGATIVE_TEXTS)
+
+    model = NgramLogisticModel().fit(samples, epochs=30)
+    model_path = os.path.join(os.path.dirname(log_path), "gate_model.json")
+    model.save(model_path)
+    model = NgramLogisticModel.load(model_path)
+    trained_gate = MemoryGate(model, threshold=0.5, log_path=None)
+    metrics = evaluate(trained_gate, samples)
+    print(f"训练集指标: {metrics}")
+    assert metrics["recall"] == 1.0
+    print(f"'本人是一名设计师' 得分: {model.predict_proba('本人是一名设计师'):.2f}")
+
+    # --- 3. 节省统计 ---
+    print("\n=== 测试节省统计 ===")
+    for text in ["我叫张三", "今天天气怎么样", "帮我写一首诗"]:
+        trained_gate.should_extract(text)
+    stats = trained_gate.stats()
+    print(f"门控统计: {stats}")
+    assert stats["checked"] == 3 and stats["rule_hits"] == 1
+    # peek 不计入统计
+    assert trained_gate.peek("我叫张三") and not trained_gate.peek("帮我写一首诗")
+    assert trained_gate.stats() == stats
+
+    # --- 4. 探索：被跳过的轮次也能得到 LLM 标签 ---
+    print("\n=== 测试探索采样 ===")
+    observing = MemoryGate(log_path=None)
+    assert all(observing.should_extract(t) for t in NEGATIVE_TEXTS)  # 未加载模型时每轮都调用 LLM
+    assert observing.stats()["explored"] == len(NEGATIVE_TEXTS) and observing.stats()["skipped"] == 0
+    assert observing.stats()["bootstrap"] and not trained_gate.stats()["bootstrap"]
+
+    explore_log = os.path.join(os.path.dirname(log_path), "explore_log.jsonl")
+    exploring = MemoryGate(model, threshold=0.5, log_path=explore_log, explore_rate=1.0)
+    never = MemoryGate(model, threshold=0.5, log_path=None, explore_rate=0.0)
+    for text in NEGATIVE_TEXTS:
+        assert not never.should_extract(text)
+        if exploring.should_extract(text):
+            exploring.log_decision(text, False)
+    assert never.stats()["skipped"] == len(NEGATIVE_TEXTS)
+    with open(explore_log, "r", encoding="utf-8") as f:
+        logged = [json.loads(line) for line in f]
+    print(f"探索统计: {exploring.stats()}，记录 {len(logged)} 条")
+    assert len(logged) == len(NEGATIVE_TEXTS) and not any(r["gate"] for r in logged)
+
+    print("\n🎉 记忆门控测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证记忆重要性评分与淘汰
+使用记录按批次写回、近因与频率评分、超出预算时归档最低分记忆（姓名不淘汰）、
+重新写入时从冷表恢复、过期的已处理工具调用记录被清理
+使用临时数据库，不依赖 LLM 服务
+"""
+
+import sys
+import os
+import sqlite3
+import time
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from memory_importance import AccessTracker, enforce_budget, importance_score, prune_processed_tool_calls
+    from memory_schema import ensure_memory_schema, fetch_memories, upsert_memory
+
+    print("✅ 成功导入模块")
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    ensure_memory_schema(conn)
+
+    # --- 1. 评分：近期、常用的记忆得分更高 ---
+    print("\n=== 测试重要性评分 ===")
+    now = time.time()
+    recent = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - 3600))
+    old = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - 120 * 86400))
+    scores = {
+        "常用且近期": importance_score("user_hobby", 20, recent, old, now),
+        "近期未使用": importance_score("user_hobby", 0, None, recent, now),
+        "很久未使用": importance_score("user_hobby", 0, None, old, now),
+    }
+    print(f"得分: {scores}")
+    assert scores["常用且近期"] > scores["近期未使用"] > scores["很久未使用"]
+
+    # --- 2. 使用记录按批次写回 ---
+    print("\n=== 测试使用记录批量写回 ===")
+    for memory_id, content in (("user_name", "小明"), ("user_hobby", "打篮球"), ("user_food", "喜欢吃火锅"),
+                               ("note_1", "周末去了公园"), ("note_2", "买了一本书")):
+        upsert_memory(conn, "u1", memory_id, content)
+    conn.commit()
+    tracker = AccessTracker(conn, flush_every=100, flush_interval=3600)
+    memories = {r["memory_id"]: {"data": r["content"]} for r in fetch_memories(conn, "u1")}
+    used = tracker.record_relevant("u1", memories, "今天想吃火锅，然后去打篮球")
+    assert sorted(used) == ["user_food", "user_hobby"]
+    counts = dict(conn.execute("SELECT memory_id, access_count FROM user_memories WHERE user_id = 'u1'"))
+    assert counts["user_hobby"] == 0   # 尚未写回
+    tracker.flush()
+    counts = dict(conn.execute("SELECT memory_id, access_count FROM user_memories WHERE user_id = 'u1'"))
+    print(f"使用次数: {counts}")
+    assert counts["user_hobby"] == 1 and counts["user_food"] == 1 and counts["note_1"] == 0
+
+    # --- 3. 超出预算：归档最低分的记忆，姓名从不淘汰 ---
+    print("\n=== 测试预算淘汰 ===")
+    conn.execute("UPDATE user_memories SET updated_at = ? WHERE user_id = 'u1'", (old,))
+    conn.commit()
+    archived = enforce_budget(conn, "u1", budget=3)
+    remaining = {r["memory_id"] for r in fetch_memories(conn, "u1")}
+    print(f"归档: {archived}，保留: {remaining}")
+    assert sorted(archived) == ["note_1", "note_2"] and "user_name" in remaining
+    assert conn.execute("SELECT COUNT(*) FROM user_memories_archive WHERE user_id = 'u1'").fetchone()[0] == 2
+    assert enforce_budget(conn, "u1", budget=3) == []
+
+    # 再次提到的事实从冷表恢复为新内容
+    upsert_memory(conn, "u1", "note_1", "周末又去了公园")
+    conn.commit()
+    assert conn.execute("SELECT COUNT(*) FROM user_memories_archive WHERE memory_id = 'note_1'").fetchone()[0] == 0
+
+    # --- 4. 过期的已处理工具调用记录被清理 ---
+    print("\n=== 测试已处理工具调用记录清理 ===")
+    assert prune_processed_tool_calls(conn) == 0   # 表不存在时什么都不做
+    conn.execute("""
+    CREATE TABLE processed_tool_calls (
+        thread_id TEXT NOT NULL,
+        tool_call_id TEXT NOT NULL,
+        processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (thread_id, tool_call_id)
+    )
+    """)
+    conn.execute("INSERT INTO processed_tool_calls VALUES ('thread_u1', 'old_call', datetime('now', '-8 days'))")
+    conn.execute("INSERT INTO processed_tool_calls (thread_id, tool_call_id) VALUES ('thread_u1', 'new_call')")
+    assert prune_processed_tool_calls(conn, retention_days=7) == 1
+    assert [r[0] for r in conn.execute("SELECT tool_call_id FROM processed_tool_calls")] == ["new_call"]
+
+    print("\n🎉 记忆重要性测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证记忆与会话 checkpoint 的 JSONL 导入导出
+导出再导入到新库后记忆、历史可见性与会话状态一致；按用户过滤；续传；旧格式补齐结构化列
+使用临时目录中的数据库，不依赖 LLM 服务
+"""
+
+import sys
+import os
+import json
+import sqlite3
+import tempfile
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from typing import Annotated, TypedDict
+    from langchain_core.messages import AIMessage, HumanMessage
+    from langgraph.graph import StateGraph, START, END
+    from langgraph.graph.message import add_messages
+    from checkpoint_store import CompressedSqliteSaver
+    from memory_io import export_jsonl, import_jsonl
+    from memory_schema import ensure_memory_schema, fetch_memories, get_memory_block, upsert_memory
+
+    print("✅ 成功导入模块")
+
+    def memories_of(conn, user_id):
+        # 同一秒写入的记忆 updated_at 相同，按 memory_id 比较
+        return {row["memory_id"]: row for row in fetch_memories(conn, user_id)}
+    tmp = tempfile.mkdtemp()
+    src_db, dst_db = os.path.join(tmp, "src.db"), os.path.join(tmp, "dst.db")
+    dump = os.path.join(tmp, "dump.jsonl")
+
+    class State(TypedDict):
+        messages: Annotated[list, add_messages]
+
+    def build_app(conn):
+        graph = StateGraph(State)
+        graph.add_node("reply", lambda state: {"messages": [AIMessage(content="你好，" + "很长的回答" * 100)]})
+        graph.add_edge(START, "reply")
+        graph.add_edge("reply", END)
+        return graph.compile(checkpointer=CompressedSqliteSaver(conn))
+
+    # 源库：两个用户的记忆与会话
+    conn = sqlite3.connect(src_db, check_same_thread=False)
+    ensure_memory_schema(conn)
+    upsert_memory(conn, "u1", "user_name", "小明")
+    upsert_memory(conn, "u1", "user_location", {"city": "北京", "district": "海淀"})
+    upsert_memory(conn, "u2", "user_job", "医生")
+    conn.commit()
+    app = build_app(conn)
+    for user_id in ("u1", "u2"):
+        app.invoke({"messages": [HumanMessage(content=f"我是 {user_id}")]},
+                   {"configurable": {"thread_id": f"thread_{user_id}"}})
+    source_memories = {u: memories_of(conn, u) for u in ("u1", "u2")}
+    source_messages = [m.content for m in app.get_state({"configurable": {"thread_id": "thread_u1"}}).values["messages"]]
+    conn.close()
+
+    # --- 1. 完整往返：记忆（含结构化列）与 checkpoint ---
+    print("\n=== 测试导出再导入 ===")
+    exported = export_jsonl(dump, src_db, include_checkpoints=True, chunk_size=2)
+    imported = import_jsonl(dump, dst_db, batch_size=2)
+    assert exported == imported and exported > 3
+
+    conn = sqlite3.connect(dst_db, check_same_thread=False)
+    for user_id in ("u1", "u2"):
+        assert memories_of(conn, user_id) == source_memories[user_id], user_id
+    assert "user_name: 小明" in get_memory_block(conn, "u1")["prompt"]
+    restored = build_app(conn).get_state({"configurable": {"thread_id": "thread_u1"}}).values["messages"]
+    print(f"恢复的会话消息: {[m.content[:10] for m in restored]}")
+    assert [m.content for m in restored] == source_messages
+    conn.close()
+
+    # --- 2. 续传：已完成的导出/导入不重复执行，同一文件的导入与导出进度互不覆盖 ---
+    print("\n=== 测试续传 ===")
+    assert export_jsonl(dump, src_db, include_checkpoints=True, resume=True) == 0
+    assert import_jsonl(dump, dst_db, resume=True) == 0
+    with open(dump, encoding="utf-8") as f:
+        assert sum(1 for _ in f) == exported
+
+    # --- 3. 按用户过滤 ---
+    print("\n=== 测试按用户导入 ===")
+    only_u2 = os.path.join(tmp, "u2.db")
+    import_jsonl(dump, only_u2, user_ids=["u2"])
+    conn = sqlite3.connect(only_u2)
+    threads = {row[0] for row in conn.execute("SELECT DISTINCT thread_id FROM checkpoints")}
+    print(f"导入的会话: {threads}")
+    assert memories_of(conn, "u1") == {} and memories_of(conn, "u2") == source_memories["u2"]
+    assert threads == {"thread_u2"}
+    conn.close()
+
+    # --- 4. 旧格式（只有 content）导入时补齐类别、来源与版本 ---
+    print("\n=== 测试旧格式导入 ===")
+    legacy = os.path.join(tmp, "legacy.jsonl")
+    with open(legacy, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"table": "user_memories", "user_id": "u3", "memory_id": "occupation",
+                            "content": "老师", "updated_at": "2024-01-01 00:00:00"}, ensure_ascii=False) + "\n")
+    import_jsonl(legacy, dst_db)
+    conn = sqlite3.connect(dst_db)
+    row = fetch_memories(conn, "u3")[0]
+    print(f"旧格式记忆: {row}")
+    assert row["category"] == "job" and row["source"] == "import" and row["version"] == 1
+    conn.close()
+
+    print("\n🎉 记忆导入导出测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
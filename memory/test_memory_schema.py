@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证结构化记忆表、历史表、索引查询与物化记忆块
+使用临时数据库，不依赖 LLM 服务
+"""
+
+import sys
+import os
+import sqlite3
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from memory_schema import (ensure_memory_schema, upsert_memory, delete_memory, fetch_memories, fetch_history,
+                               get_memory_block, EMPTY_DISPLAY_BLOCK)
+
+    print("✅ 成功导入模块")
+    conn = sqlite3.connect(":memory:")
+
+    # --- 1. 旧表结构迁移：补列并回填类别 ---
+    print("\n=== 测试旧表迁移 ===")
+    conn.execute("""
+    CREATE TABLE user_memories (
+        user_id TEXT NOT NULL,
+        memory_id TEXT NOT NULL,
+        content TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, memory_id)
+    )
+    """)
+    conn.execute("INSERT INTO user_memories (user_id, memory_id, content) VALUES ('u1', 'occupation', '老师')")
+    ensure_memory_schema(conn)
+    ensure_memory_schema(conn)  # 幂等
+    rows = fetch_memories(conn, "u1")
+    print(f"迁移后: {rows}")
+    assert rows[0]["category"] == "job" and rows[0]["source"] == "import" and rows[0]["version"] == 1
+
+    # --- 2. 写入：版本递增、内容不变时不写、结构化取值 ---
+    print("\n=== 测试写入与版本 ===")
+    assert upsert_memory(conn, "u1", "occupation", "工程师", source="tool") == 2
+    assert upsert_memory(conn, "u1", "occupation", "工程师", source="tool") is None
+    assert upsert_memory(conn, "u1", "user_location", {"city": "北京"}, source="extractor") == 1
+    conn.commit()
+    location = fetch_memories(conn, "u1", categories=["location"])
+    print(f"按类别查询: {location}")
+    assert len(location) == 1 and location[0]["value"] == '{"city": "北京"}' and location[0]["confidence"] == 0.7
+
+    # --- 3. 删除与历史 ---
+    print("\n=== 测试历史记录 ===")
+    assert delete_memory(conn, "u1", "occupation", source="manual")
+    assert not delete_memory(conn, "u1", "occupation", source="manual")
+    conn.commit()
+    history = fetch_history(conn, "u1", "occupation")
+    print(f"occupation 历史: {[(h['operation'], h['content'], h['version']) for h in history]}")
+    assert [h["operation"] for h in history] == ["delete", "upsert"]
+    assert history[1]["content"] == "工程师"
+
+    # --- 4. 查询走索引 ---
+    print("\n=== 测试查询计划 ===")
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM user_memories WHERE user_id = ? AND category = ? ORDER BY updated_at DESC",
+        ("u1", "job")
+    ).fetchall()
+    print(f"查询计划: {plan}")
+    assert "idx_user_memories_category" in str(plan)
+
+    # --- 5. 物化记忆块：迁移时生成，写入时重建，读取一次查询 ---
+    print("\n=== 测试物化记忆块 ===")
+    block = get_memory_block(conn, "u1")
+    print(f"记忆块: {block}")
+    assert block["prompt"] == '- user_location: city: 北京'
+    assert block["display"] == "📌 [location] user_location (v1)\n   └ city: 北京"
+    version = block["version"]
+    upsert_memory(conn, "u1", "user_location", "上海", source="tool")
+    conn.commit()
+    block = get_memory_block(conn, "u1")
+    assert block["version"] == version + 1 and block["prompt"] == "- user_location: 上海"
+    upsert_memory(conn, "u1", "user_location", "上海", source="tool")  # 内容未变化，不重建
+    assert get_memory_block(conn, "u1")["version"] == version + 1
+    delete_memory(conn, "u1", "user_location")
+    conn.commit()
+    block = get_memory_block(conn, "u1")
+    assert block["prompt"] == "" and block["display"] == EMPTY_DISPLAY_BLOCK
+    assert get_memory_block(conn, "nobody") == {"version": 0, "prompt": "", "display": EMPTY_DISPLAY_BLOCK}
+
+    print("\n🎉 结构化记忆测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
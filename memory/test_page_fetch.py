@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证搜索结果正文抓取阶段
+使用本地 HTTP 服务模拟网页，不依赖外网
+"""
+
+import sys
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+ARTICLE = """<html><head><title>测试</title><script>var x = "不应出现的脚本内容";</script></head>
+<body><nav>首页 | 新闻 | 关于我们 | 联系方式 | 更多栏目</nav>
+<article>
+<p>LangGraph 是一个用于构建有状态、多参与者应用的框架，支持循环和持久化。</p>
+<p>这一段与天气有关：今天北京晴，最高气温二十五度，适合户外活动。</p>
+<p>SQLite 是一个嵌入式数据库，LangGraph 可以使用 SqliteSaver 保存检查点。</p>
+</article>
+<footer>版权所有 © 2026 示例网站 保留所有权利</footer></body></html>"""
+
+request_count = {"article": 0}
+
+
+class FakeSiteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/slow":
+            time.sleep(3)
+        if self.path == "/article":
+            request_count["article"] += 1
+        body = ARTICLE.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        # 分两段发送，验证增量解析
+        self.wfile.write(body[:len(body) // 2])
+        self.wfile.flush()
+        self.wfile.write(body[len(body) // 2:])
+
+
+try:
+    from page_fetch import PageFetcher, MainTextParser, relevant_passages
+
+    print("✅ 成功导入模块")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSiteHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    # --- 1. 增量解析：标签被切断在两个 chunk 之间 ---
+    print("\n=== 测试增量正文提取 ===")
+    parser = MainTextParser()
+    for i in range(0, len(ARTICLE), 7):
+        parser.feed(ARTICLE[i:i + 7])
+    text = parser.text()
+    print(text)
+    assert "SqliteSaver" in text
+    assert "脚本内容" not in text and "版权所有" not in text
+
+    # --- 2. 相关段落选择 ---
+    print("\n=== 测试相关段落选择 ===")
+    passage = relevant_passages(text, "北京 天气", max_passages=1)
+    print(f"相关段落: {passage}")
+    assert "气温" in passage
+
+    # --- 3. 并发抓取 + 时间预算 ---
+    print("\n=== 测试并发抓取与时间预算 ===")
+    fetcher = PageFetcher(max_connections=4, per_host_limit=2)
+    start = time.time()
+    texts = fetcher.fetch_many([f"{base}/article", f"{base}/slow"], time_budget=1.0)
+    elapsed = time.time() - start
+    print(f"抓取结果: {list(texts.keys())}，耗时 {elapsed:.2f}s")
+    assert f"{base}/article" in texts
+    assert f"{base}/slow" not in texts
+    assert elapsed < 2.0
+
+    # --- 4. 按 URL 缓存 ---
+    print("\n=== 测试正文缓存 ===")
+    fetcher.fetch_many([f"{base}/article"], time_budget=1.0)
+    print(f"article 页面请求次数: {request_count['article']}")
+    assert request_count["article"] == 1
+
+    # --- 5. 单个页面的意外错误只让该页面缺席 ---
+    print("\n=== 测试单页错误隔离 ===")
+    import httpx
+
+    def handler(request):
+        if request.url.path == "/broken":
+            raise RuntimeError("解析器崩溃")
+        return httpx.Response(200, headers={"Content-Type": "text/html; charset=utf-8"}, content=ARTICLE.encode("utf-8"))
+
+    isolated = PageFetcher(client=httpx.Client(transport=httpx.MockTransport(handler)))
+    texts = isolated.fetch_many(["http://example.com/broken", "http://example.com/ok"], time_budget=1.0)
+    print(f"抓取结果: {list(texts.keys())}")
+    assert list(texts.keys()) == ["http://example.com/ok"]
+
+    server.shutdown()
+    print("\n🎉 正文抓取测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证按需的单请求性能分析
+开关关闭时原样返回生成器、选中用户的轮次输出 .collapsed 与 .json、
+加入会话的工作线程的样本区分 [cpu] / [wait]、cprofile 模式合并各线程的结果
+输出写到临时目录，不依赖 LLM 服务
+"""
+
+import sys
+import os
+import glob
+import json
+import pstats
+import tempfile
+import threading
+import time
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def spin(seconds):
+    """占用 CPU 的忙循环"""
+    end = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < end:
+        total += 1
+    return total
+
+
+def blocked(seconds):
+    """模拟等待网络/锁"""
+    time.sleep(seconds)
+
+
+try:
+    import request_profiler
+    from request_profiler import ProfileSession, attach, configure, current_session, profile_generator, profiled_turn
+
+    print("✅ 成功导入模块")
+    request_profiler.PROFILE_DIR = tempfile.mkdtemp()
+
+    def turn(user_id):
+        # 工作线程加入本轮的分析会话，与 stream_with_timeout 的用法相同
+        session = current_session()
+
+        def worker():
+            with attach(session):
+                blocked(0.3)
+
+        thread = threading.Thread(target=worker, name="turn-worker")
+        thread.start()
+        spin(0.3)
+        thread.join()
+        yield "完成"
+
+    profiled = profiled_turn(lambda user_id: user_id)(turn)
+
+    # --- 1. 开关关闭：不包装、不启动分析器 ---
+    print("\n=== 测试关闭时零开销 ===")
+    configure(users=[], sample_rate=0)
+    generator = profiled("prof_u1")
+    assert generator.gi_code is turn.__code__, "关闭时应直接返回原生成器"
+    assert list(generator) == ["完成"]
+    plain = (x for x in range(3))
+    configure(users=["someone_else"])
+    assert profile_generator("prof_u1", plain) is plain
+    assert not os.listdir(request_profiler.PROFILE_DIR)
+
+    # --- 2. 选中用户：输出 collapsed-stack 与 JSON 摘要，区分 CPU 与等待 ---
+    print("\n=== 测试采样分析输出 ===")
+    configure(users=["prof_u1"])
+    threads_before = threading.active_count()
+    assert list(profiled("prof_u1")) == ["完成"]
+    assert threading.active_count() == threads_before, "采样线程应在轮次结束后退出"
+    collapsed = glob.glob(os.path.join(request_profiler.PROFILE_DIR, "*_prof_u1_*.collapsed"))
+    summaries = glob.glob(os.path.join(request_profiler.PROFILE_DIR, "*_prof_u1_*.json"))
+    assert len(collapsed) == 1 and len(summaries) == 1
+    with open(summaries[0], encoding="utf-8") as f:
+        summary = json.load(f)
+    print(f"摘要: {summary}")
+    assert summary["user_id"] == "prof_u1" and summary["label"] == "turn" and summary["mode"] == "sample"
+    assert summary["samples"] > 0 and summary["wall_ms"] >= 300 and summary["cpu_ms"] >= 150
+
+    with open(collapsed[0], encoding="utf-8") as f:
+        stacks = {line.rsplit(" ", 1)[0]: int(line.rsplit(" ", 1)[1]) for line in f}
+    cpu_spin = sum(c for s, c in stacks.items() if s.startswith("[cpu]") and ";spin (" in s)
+    wait_worker = sum(c for s, c in stacks.items() if s.startswith("[wait]") and ";blocked (" in s)
+    cpu_worker = sum(c for s, c in stacks.items() if s.startswith("[cpu]") and ";blocked (" in s)
+    print(f"spin [cpu] 样本 {cpu_spin}，工作线程 [wait] 样本 {wait_worker}，[cpu] 样本 {cpu_worker}")
+    assert cpu_spin > 0 and wait_worker > 0 and cpu_worker < wait_worker
+
+    # --- 3. cprofile 模式：每个线程一个 Profile，结束时合并 ---
+    print("\n=== 测试 cprofile 模式 ===")
+    session = ProfileSession("prof_u2", "cprofile_turn", mode="cprofile")
+    session.start()
+
+    def profiled_worker():
+        with session.attach():
+            blocked(0.05)
+
+    with session.attach():
+        worker = threading.Thread(target=profiled_worker)
+        worker.start()
+        spin(0.1)
+        worker.join()
+    path = session.stop()
+    assert path.endswith(".pstats") and os.path.exists(path.replace(".pstats", ".json"))
+    functions = {name for _, _, name in pstats.Stats(path).stats}
+    print(f"合并后的函数: {sorted(f for f in functions if not f.startswith('<'))}")
+    assert {"spin", "blocked"} <= functions
+
+    configure(users=[])
+    print("\n🎉 单请求性能分析测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证响应缓存
+重复提问命中、相似问题命中、记忆版本变化失效，以及前文不同的同一追问互不命中；
+端到端验证同一会话里重复提问时流式接口和 agent 节点都命中缓存
+用假模型代替 LLM，在临时目录中运行，不修改仓库中的数据库
+"""
+
+import sys
+import os
+import tempfile
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from response_cache import ResponseCache, context_digest, is_follow_up
+
+    print("✅ 成功导入模块")
+    cache = ResponseCache(ttl_seconds=60)
+
+    # --- 1. 重复提问与相似问题命中，记忆版本变化后失效 ---
+    print("\n=== 测试基本命中与失效 ===")
+    cache.put("u1", "今天北京天气怎么样？", 1, "晴", scope="agent")
+    assert cache.get("u1", "今天北京天气怎么样", 1, scope="agent") == "晴"
+    assert cache.get("u1", "今天北京天气怎么样呀？", 1, scope="agent") == "晴"
+    assert cache.get("u1", "今天北京天气怎么样？", 2, scope="agent") is None
+    assert cache.get("u2", "今天北京天气怎么样？", 1, scope="agent") is None
+    print(f"统计: {cache.stats()}")
+
+    # --- 2. 同一追问在不同前文下互不命中 ---
+    print("\n=== 测试前文不同的追问 ===")
+    about_paris = context_digest(["法国的首都是哪里？", "巴黎。"])
+    about_japan = context_digest(["日本的首都是哪里？", "东京。"])
+    assert about_paris != about_japan
+    assert about_paris == context_digest(iter(["法国的首都是哪里？", "巴黎。"]))
+    cache.put("u1", "那里人口多少？", 1, "巴黎约 210 万人", scope=f"agent|ctx={about_paris}")
+    assert cache.get("u1", "那里人口多少？", 1, scope=f"agent|ctx={about_paris}") == "巴黎约 210 万人"
+    assert cache.get("u1", "那里人口多少？", 1, scope=f"agent|ctx={about_japan}") is None
+    assert cache.get("u1", "那里人口多少", 1, scope=f"agent|ctx={context_digest([])}") is None
+
+    # 只计入最近几条消息：更早的对话不影响摘要
+    recent = ["问题一", "回答一", "问题二", "回答二", "问题三", "回答三"]
+    assert context_digest(["很久以前的对话"] + recent) == context_digest(recent)
+    assert context_digest(recent[:-1] + ["不同的回答"]) != context_digest(recent)
+
+    # --- 3. 追问判断 ---
+    print("\n=== 测试追问判断 ===")
+    for query in ["那里人口多少？", "那它呢？", "为什么？", "What about it?", "继续"]:
+        assert is_follow_up(query), query
+    for query in ["法国的首都是哪里？", "今天北京天气怎么样？", "What is the capital of France?"]:
+        assert not is_follow_up(query), query
+
+    # --- 4. 端到端：同一会话里重复提问命中缓存 ---
+    print("\n=== 测试同一会话重复提问 ===")
+    # langgraph_memorey 在当前目录打开 ai_memory.db，切换到临时目录避免写入仓库中的数据库
+    os.chdir(tempfile.mkdtemp())
+    from langchain_core.messages import AIMessage, HumanMessage
+    import langgraph_memorey
+
+    class FakeLLM:
+        """按调用次数编号回答的假模型"""
+
+        def __init__(self):
+            self.calls = 0
+
+        def bind(self, **kwargs):
+            return self
+
+        def invoke(self, messages):
+            self.calls += 1
+            return AIMessage(content=f"第 {self.calls} 次回答")
+
+    class FakeRegistry:
+        def __init__(self, model):
+            self.model = model
+
+        def get(self, *names):
+            return self.model
+
+    fake = FakeLLM()
+    langgraph_memorey.tool_registry = FakeRegistry(fake)
+    langgraph_memorey.update_memory_from_conversation = lambda *args: None
+
+    def ask(user_id, text):
+        return "".join(langgraph_memorey.get_streaming_response(user_id, text, use_cache=True, typing_delay=0))
+
+    first = ask("cache_u1", "法国的首都是哪里？")
+    ask("cache_u1", "日本的首都是哪里？")
+    again = ask("cache_u1", "法国的首都是哪里？")
+    print(f"流式接口: 第一次 {first!r}，重复提问 {again!r}，模型调用 {fake.calls} 次")
+    assert again == first and fake.calls == 2
+    # 追问的前文已变化，不命中
+    ask("cache_u1", "那里人口多少？")
+    ask("cache_u1", "那里人口多少？")
+    assert fake.calls == 4
+
+    fake.calls = 0
+    config = {"configurable": {"user_id": "cache_u2", "use_response_cache": True}}
+    messages = [HumanMessage(content="法国的首都是哪里？")]
+    messages += langgraph_memorey.call_model_stream({"messages": messages}, config)["messages"]
+    messages += [HumanMessage(content="日本的首都是哪里？")]
+    messages += langgraph_memorey.call_model_stream({"messages": messages}, config)["messages"]
+    messages += [HumanMessage(content="法国的首都是哪里？")]
+    again = langgraph_memorey.call_model_stream({"messages": messages}, config)["messages"][0].content
+    print(f"agent 节点: 重复提问 {again!r}，模型调用 {fake.calls} 次")
+    assert again == messages[1].content and fake.calls == 2
+
+    print(f"统计: {cache.stats()}")
+    print("\n🎉 响应缓存测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证搜索结果后处理
+跨查询的转载稿近似去重、BM25 相关性排序、不相关结果不占预算、条数与 Token 预算截取
+不依赖外网
+"""
+
+import sys
+import os
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from search_postprocess import estimated_similarity, minhash_signature, rank_and_dedupe
+
+    print("✅ 成功导入模块")
+
+    article = "北京今日晴转多云，最高气温25度，最低气温14度，空气质量良，适合户外活动。"
+    results = [
+        {"title": "北京天气预报", "body": article, "href": "https://a.example.com/1", "query": "北京 天气"},
+        {"title": "北京天气预报", "body": article + "（转载）", "href": "https://b.example.com/2", "query": "今天 北京 气温"},
+        {"title": "北京天气预报", "body": article, "href": "https://a.example.com/1", "query": "今天 北京 气温"},
+        {"title": "上海天气", "body": "上海今日小雨，气温18到22度。", "href": "https://c.example.com/3"},
+        {"title": "股票行情", "body": "沪指收涨0.5%，成交额放大。", "href": "https://d.example.com/4"},
+    ]
+
+    # --- 1. MinHash 相似度估计 ---
+    print("\n=== 测试 MinHash 相似度 ===")
+    same = estimated_similarity(minhash_signature(article), minhash_signature(article + "（转载）"))
+    different = estimated_similarity(minhash_signature(article), minhash_signature("沪指收涨0.5%，成交额放大。"))
+    print(f"转载稿相似度 {same:.2f}，无关文本相似度 {different:.2f}")
+    assert same > 0.6 > different
+
+    # --- 2. 去重与排序：转载稿只保留一条，不相关结果被丢弃 ---
+    print("\n=== 测试去重与排序 ===")
+    ranked = rank_and_dedupe(results, "今天北京天气怎么样")
+    print(f"结果: {[(r['href'], round(r['score'], 2)) for r in ranked]}")
+    hrefs = [r["href"] for r in ranked]
+    assert len([h for h in hrefs if h in ("https://a.example.com/1", "https://b.example.com/2")]) == 1
+    assert hrefs[0] in ("https://a.example.com/1", "https://b.example.com/2")
+    assert "https://d.example.com/4" not in hrefs
+    assert all(ranked[i]["score"] >= ranked[i + 1]["score"] for i in range(len(ranked) - 1))
+
+    # --- 3. 条数与 Token 预算：至少保留一条，预算用完即停止 ---
+    print("\n=== 测试预算截取 ===")
+    districts = ["海淀区午后有雷阵雨", "朝阳区傍晚风力较大", "通州区全天晴朗少云", "丰台区夜间有轻雾",
+                 "昌平区山区气温偏低", "顺义区机场能见度良好"]
+    many = [{"title": f"北京天气 {d[:3]}", "body": f"北京天气：{d}，出行请注意。", "href": f"https://e.example.com/{i}"}
+            for i, d in enumerate(districts)]
+    assert len(rank_and_dedupe(many, "北京天气", max_results=3)) == 3
+    assert len(rank_and_dedupe(many, "北京天气", token_budget=1)) == 1
+    assert rank_and_dedupe([], "北京天气") == []
+
+    print("\n🎉 搜索结果后处理测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证单飞合并
+相同键的并发调用只执行一次、异常共享、follower 按自己的截止时间退出、leader 被取消时重新发起
+"""
+
+import sys
+import os
+import threading
+import time
+import concurrent.futures
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from deadline import Deadline, DeadlineExceeded, activate
+    from single_flight import SingleFlight, search_key
+
+    print("✅ 成功导入模块")
+
+    # --- 1. 相同键的并发调用只执行一次 ---
+    print("\n=== 测试并发合并 ===")
+    flight = SingleFlight("测试")
+    executed = []
+
+    def slow_search(query):
+        executed.append(query)
+        time.sleep(0.3)
+        return [f"{query} 的结果"]
+
+    queries = ["AI 最新新闻", "ai最新新闻", "AI  最新新闻！", "AI 最新新闻"]
+    with concurrent.futures.ThreadPoolExecutor(len(queries)) as executor:
+        results = list(executor.map(lambda q: flight.do(search_key(q, 3), lambda: slow_search(q)), queries))
+    stats = flight.stats()
+    print(f"执行: {executed}，统计: {stats}")
+    assert len(executed) == 1 and all(r == results[0] for r in results)
+    assert stats["calls"] == 4 and stats["executed"] == 1 and stats["suppressed"] == 3
+    assert flight.in_flight() == 0
+    assert search_key("AI 最新新闻", 3) != search_key("AI 最新新闻", 5)
+
+    # 完成后不缓存：再次调用会重新执行
+    flight.do(search_key(queries[0], 3), lambda: slow_search(queries[0]))
+    assert len(executed) == 2
+
+    # --- 2. 异常共享给所有等待者 ---
+    print("\n=== 测试异常共享 ===")
+    flight = SingleFlight("测试")
+    calls = []
+
+    def failing():
+        calls.append(1)
+        time.sleep(0.2)
+        raise RuntimeError("DDGS 限流")
+
+    def call_failing(_):
+        try:
+            flight.do("key", failing)
+        except RuntimeError as e:
+            return str(e)
+
+    with concurrent.futures.ThreadPoolExecutor(3) as executor:
+        errors = list(executor.map(call_failing, range(3)))
+    print(f"异常: {errors}")
+    assert len(calls) == 1 and errors == ["DDGS 限流"] * 3
+
+    # --- 3. follower 的截止时间先到：抛出 DeadlineExceeded，不影响 leader ---
+    print("\n=== 测试 follower 截止时间 ===")
+    flight = SingleFlight("测试")
+    leader_result = {}
+
+    def run_leader():
+        leader_result["value"] = flight.do("key", lambda: time.sleep(0.6) or "完成")
+
+    leader = threading.Thread(target=run_leader)
+    leader.start()
+    time.sleep(0.05)
+    start = time.perf_counter()
+    try:
+        with activate(Deadline(0.2)):
+            flight.do("key", lambda: "不应执行")
+        raise AssertionError("follower 应该超时")
+    except DeadlineExceeded as e:
+        waited = time.perf_counter() - start
+        print(f"follower 在 {waited:.2f}s 后退出: {e}")
+        assert waited < 0.5
+    leader.join()
+    assert leader_result["value"] == "完成" and flight.in_flight() == 0
+
+    # --- 4. leader 被取消：follower 不采用其结果，重新发起 ---
+    print("\n=== 测试 leader 取消后重新发起 ===")
+    flight = SingleFlight("测试")
+    leader_deadline = Deadline(10)
+    runs = []
+
+    def cancellable_search():
+        runs.append(1)
+        deadline_hit = not leader_deadline.wait(0.5) if len(runs) == 1 else False
+        return "cancelled" if deadline_hit else "真实结果"
+
+    def run_cancelled_leader():
+        with activate(leader_deadline):
+            leader_result["cancelled"] = flight.do("key", cancellable_search)
+
+    leader = threading.Thread(target=run_cancelled_leader)
+    leader.start()
+    time.sleep(0.05)
+    threading.Timer(0.1, leader_deadline.cancel).start()
+    follower_result = flight.do("key", cancellable_search)
+    leader.join()
+    print(f"leader: {leader_result['cancelled']}，follower: {follower_result}，统计: {flight.stats()}")
+    assert leader_result["cancelled"] == "cancelled" and follower_result == "真实结果"
+    assert len(runs) == 2 and flight.stats()["retried"] == 1
+
+    print("\n🎉 单飞合并测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证思考标签的增量解析
+标签被切断在任意 chunk 边界时，结果应与一次性解析一致
+"""
+
+import sys
+import os
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLES = [
+    ("<thinking>用户问的是天气，需要先确认城市。</thinking>北京今天晴。",
+     "用户问的是天气，需要先确认城市。", "北京今天晴。"),
+    ("<思考>先回忆用户信息</思考>你好，张三！", "先回忆用户信息", "你好，张三！"),
+    ("<recollection>用户住在上海</recollection>上海明天有雨，记得带伞。", "用户住在上海", "上海明天有雨，记得带伞。"),
+    ("没有思考标签的回答，其中 a < b 且 <b>加粗</b>", "", "没有思考标签的回答，其中 a < b 且 <b>加粗</b>"),
+]
+
+try:
+    from thinking_parser import ThinkingStreamParser, split_thinking, THINKING, ANSWER
+
+    print("✅ 成功导入模块")
+
+    # --- 1. 一次性解析 ---
+    print("\n=== 测试完整文本解析 ===")
+    for content, thinking, answer in SAMPLES:
+        result = split_thinking(content)
+        print(f"{content[:20]}... -> {result}")
+        assert result == (thinking, answer), result
+
+    # --- 2. 所有 chunk 大小下的增量解析 ---
+    print("\n=== 测试任意 chunk 边界 ===")
+    for content, thinking, answer in SAMPLES:
+        for size in range(1, len(content) + 1):
+            parser = ThinkingStreamParser()
+            streamed = {THINKING: "", ANSWER: ""}
+            for i in range(0, len(content), size):
+                for kind, text in parser.feed(content[i:i + size]):
+                    streamed[kind] += text
+            for kind, text in parser.finish():
+                streamed[kind] += text
+            assert (streamed[THINKING].strip(), streamed[ANSWER].strip()) == (thinking, answer), (size, streamed)
+    print("✅ 所有切分方式结果一致")
+
+    # --- 3. 生成过程中实时区分思考与回答 ---
+    print("\n=== 测试实时状态 ===")
+    parser = ThinkingStreamParser()
+    events = parser.feed("<thin")
+    assert events == [] and not parser.in_thinking
+    events = parser.feed("king>正在分析")
+    print(f"思考中片段: {events}")
+    assert events == [(THINKING, "正在分析")] and parser.in_thinking
+    events = parser.feed("问题</thinking>答")
+    print(f"结束思考片段: {events}")
+    assert events == [(THINKING, "问题"), (ANSWER, "答")] and not parser.in_thinking
+
+    print("\n🎉 思考标签解析测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证后台会话压缩
+轮次不再等待摘要生成、下一轮开始时应用摘要、下一轮提前到达时安全跳过
+"""
+
+import sys
+import os
+import threading
+import time
+from typing import Annotated, TypedDict
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+    from langgraph.checkpoint.memory import InMemorySaver
+    from langgraph.graph import END, START, StateGraph
+    from langgraph.graph.message import add_messages
+    from thread_compaction import ThreadCompactor
+
+    print("✅ 成功导入模块")
+
+    class State(TypedDict):
+        messages: Annotated[list[BaseMessage], add_messages]
+        summary: str
+
+    release_summary = threading.Event()
+
+    def slow_summarize(messages):
+        release_summary.wait(5)  # 模拟慢速的摘要模型调用
+        return f"前 {len(messages)} 条消息的摘要"
+
+    compactor = ThreadCompactor(slow_summarize, threshold=10, keep_last=3)
+
+    def compact(state, config):
+        return compactor.take(config["configurable"]["thread_id"], state["messages"]) or {"messages": []}
+
+    def agent(state):
+        return {"messages": [AIMessage(content=f"回答 {len(state['messages'])}")]}
+
+    def cleanup(state, config):
+        compactor.schedule(config["configurable"]["thread_id"], state["messages"])
+        return {"messages": []}
+
+    graph = StateGraph(State)
+    graph.add_node("compact", compact)
+    graph.add_node("agent", agent)
+    graph.add_node("cleanup", cleanup)
+    graph.add_edge(START, "compact")
+    graph.add_edge("compact", "agent")
+    graph.add_edge("agent", "cleanup")
+    graph.add_edge("cleanup", END)
+    app = graph.compile(checkpointer=InMemorySaver())
+    config = {"configurable": {"thread_id": "t1"}}
+
+    def turn(text):
+        start = time.perf_counter()
+        result = app.invoke({"messages": [HumanMessage(content=text)]}, config)
+        return result, time.perf_counter() - start
+
+    # --- 1. 超过阈值后，轮次不等待摘要 ---
+    print("\n=== 测试轮次不等待摘要 ===")
+    for i in range(6):
+        result, elapsed = turn(f"问题 {i}")
+    print(f"消息数: {len(result['messages'])}，最后一轮耗时 {elapsed * 1000:.1f}ms，统计: {compactor.stats()}")
+    assert len(result["messages"]) == 12 and elapsed < 1.0
+    assert compactor.stats()["scheduled"] == 1 and compactor.stats()["running"] == 1
+
+    # --- 2. 下一轮提前到达：摘要未完成，本轮照常进行，不重复安排 ---
+    print("\n=== 测试下一轮提前到达 ===")
+    result, elapsed = turn("提前到达的问题")
+    stats = compactor.stats()
+    print(f"消息数: {len(result['messages'])}，耗时 {elapsed * 1000:.1f}ms，统计: {stats}")
+    assert len(result["messages"]) == 14 and not result.get("summary")
+    assert stats["skipped_running"] == 1 and stats["applied"] == 0
+
+    # --- 3. 摘要完成后，下一轮开始时应用，快照之后的消息保留 ---
+    print("\n=== 测试下一轮应用摘要 ===")
+    release_summary.set()
+    assert compactor.wait("t1", timeout=5)
+    result, _ = turn("摘要完成后的问题")
+    contents = [m.content for m in result["messages"]]
+    print(f"摘要: {result['summary']}，剩余消息: {contents}")
+    assert result["summary"] == "前 12 条消息的摘要"
+    # 快照 12 条中删除前 9 条：剩余 3 条 + 提前到达轮次的 2 条 + 本轮 2 条（agent 已看到压缩后的 6 条）
+    assert len(contents) == 7 and contents[-2:] == ["摘要完成后的问题", "回答 6"]
+    assert compactor.stats()["applied"] == 1 and compactor.take("t1", result["messages"]) is None
+
+    # --- 4. 摘要失败不影响会话 ---
+    print("\n=== 测试摘要失败 ===")
+    failing = ThreadCompactor(lambda messages: 1 / 0, threshold=1)
+    assert failing.schedule("t2", [HumanMessage(content="a", id="1"), AIMessage(content="b", id="2")])
+    assert failing.wait("t2", timeout=5)
+    print(f"统计: {failing.stats()}")
+    assert failing.stats()["failed"] == 1 and failing.take("t2", []) is None
+
+    compactor.shutdown()
+    failing.shutdown()
+    print("\n🎉 后台会话压缩测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证会话邮箱执行器
+同一会话严格按序、不同会话并行且受线程池上限约束、排队深度、排队消息合并、流式执行与提前放弃，
+放弃时经 on_abandon 立即中止执行中的轮次并空出邮箱
+"""
+
+import sys
+import os
+import threading
+import time
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from thread_mailbox import COALESCED, MailboxExecutor, merge_user_inputs
+
+    print("✅ 成功导入模块")
+
+    # --- 1. 同一会话按序执行，不同会话并行 ---
+    print("\n=== 测试按会话串行、跨会话并行 ===")
+    mailbox = MailboxExecutor(max_workers=3)
+    lock = threading.Lock()
+    order = {}
+    active = {"total": 0, "max_total": 0}
+    active_per_key = {}
+
+    def make_turn(key):
+        def turn(n):
+            with lock:
+                active_per_key[key] = active_per_key.get(key, 0) + 1
+                assert active_per_key[key] == 1, f"会话 {key} 出现并发轮次"
+                active["total"] += 1
+                active["max_total"] = max(active["max_total"], active["total"])
+            time.sleep(0.1)
+            with lock:
+                order.setdefault(key, []).append(n)
+                active_per_key[key] -= 1
+                active["total"] -= 1
+            return f"{key}-{n}"
+        return turn
+
+    start = time.perf_counter()
+    futures = [mailbox.submit(key, make_turn(key), n) for n in range(3) for key in ("t1", "t2", "t3", "t4")]
+    time.sleep(0.05)
+    depth = mailbox.depth("t1")
+    snapshot = mailbox.snapshot()
+    results = [f.result(timeout=5) for f in futures]
+    elapsed = time.perf_counter() - start
+    print(f"耗时 {elapsed:.2f}s，最大并发 {active['max_total']}，执行顺序: {order}，排队快照: {snapshot}")
+    assert all(order[key] == [0, 1, 2] for key in ("t1", "t2", "t3", "t4"))
+    assert results[0] == "t1-0" and results[-1] == "t4-2"
+    assert active["max_total"] == 3 and elapsed < 1.0  # 串行执行需要 1.2s
+    assert depth == 3 and snapshot["running"] == 3 and snapshot["threads"]["t1"] == 3
+    assert mailbox.depth("t1") == 0 and mailbox.snapshot()["threads"] == {}
+
+    # 异常只影响该轮次，后续轮次照常执行
+    failed = mailbox.submit("t1", lambda _: 1 / 0)
+    after = mailbox.submit("t1", lambda n: n + 1, 1)
+    assert after.result(timeout=5) == 2 and isinstance(failed.exception(), ZeroDivisionError)
+
+    # --- 2. 合并排队消息 ---
+    print("\n=== 测试合并排队消息 ===")
+    release = threading.Event()
+    seen = []
+
+    def answer(text):
+        release.wait(5)
+        seen.append(text)
+        return f"回答: {text}"
+
+    first = mailbox.submit("u1", answer, "你好", merge=merge_user_inputs)
+    time.sleep(0.05)  # 第一轮已开始，不会被合并
+    second = mailbox.submit("u1", answer, "我叫小明", merge=merge_user_inputs)
+    third = mailbox.submit("u1", answer, "我叫小明", merge=merge_user_inputs)   # 连按回车的重复输入
+    fourth = mailbox.submit("u1", answer, "住在北京", merge=merge_user_inputs)
+    assert mailbox.depth("u1") == 2
+    release.set()
+    print(f"执行的输入: {seen if fourth.result(timeout=5) else None}，统计: {mailbox.stats()}")
+    assert first.result() == "回答: 你好" and second.result() is COALESCED and third.result() is COALESCED
+    assert seen == ["你好", "我叫小明\n住在北京"] and mailbox.stats()["coalesced"] == 2
+
+    # 不传 merge 的轮次不合并
+    a = mailbox.submit("u2", lambda t: time.sleep(0.1) or t, "a")
+    b = mailbox.submit("u2", lambda t: t, "b")
+    c = mailbox.submit("u2", lambda t: t, "c")
+    assert (a.result(timeout=5), b.result(timeout=5), c.result(timeout=5)) == ("a", "b", "c")
+
+    # --- 3. 流式执行：按序、合并、异常与提前放弃 ---
+    print("\n=== 测试流式执行 ===")
+    release = threading.Event()
+    closed = []
+
+    def tokens(text):
+        try:
+            release.wait(5)
+            for ch in text:
+                yield ch
+        finally:
+            closed.append(text)
+
+    results = {}
+
+    def consume(name, text):
+        results[name] = list(mailbox.stream("s1", tokens, text, merge=merge_user_inputs))
+
+    threads = [threading.Thread(target=consume, args=(name, text))
+               for name, text in (("first", "ab"), ("second", "cd"), ("third", "ef"))]
+    for t in threads:
+        t.start()
+        time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join(5)
+    print(f"流式结果: {results}")
+    assert results["first"] == ["a", "b"] and results["second"] == [COALESCED]
+    assert "".join(results["third"]) == "cd\nef"
+
+    def broken(_):
+        yield "x"
+        raise RuntimeError("模型服务断开")
+
+    try:
+        list(mailbox.stream("s2", broken))
+        raise AssertionError("应在调用方重新抛出异常")
+    except RuntimeError as e:
+        assert "模型服务断开" in str(e)
+
+    # 调用方放弃：排队中的轮次取消后不执行；执行中的流在下一次产出时停止并关闭原生成器
+    release = threading.Event()
+    closed.clear()
+    blocker = mailbox.submit("s3", lambda _: release.wait(5))
+    skipped = mailbox.submit("s3", lambda _: closed.append("不应执行"))
+    assert mailbox.depth("s3") == 2 and skipped.cancel()
+    release.set()
+    stream = mailbox.stream("s3", lambda text: (ch for ch in text), "abcdef", buffer=1)
+    assert next(stream) == "a"
+    stream.close()
+    time.sleep(0.1)
+    print(f"统计: {mailbox.stats()}")
+    assert blocker.result(timeout=5) and "不应执行" not in closed
+    assert mailbox.stats()["cancelled"] == 1 and mailbox.depth("s3") == 0
+
+    # --- 4. 放弃时中止执行中的轮次：不等下一次产出，邮箱立即空出 ---
+    print("\n=== 测试放弃时中止进行中的调用 ===")
+    cancelled = threading.Event()
+    waited = {}
+
+    def slow_model(text):
+        yield "思"
+        start = time.perf_counter()
+        cancelled.wait(3)   # 模拟进行中的 LLM 调用，取消时立即返回
+        waited["seconds"] = time.perf_counter() - start
+        yield "考"
+
+    stream = mailbox.stream("s4", slow_model, "x", on_abandon=cancelled.set)
+    assert next(stream) == "思"
+    time.sleep(0.05)
+    stream.close()
+    assert cancelled.is_set()
+    start = time.perf_counter()
+    assert list(mailbox.stream("s4", lambda text: iter(text), "下一轮")) == list("下一轮")
+    print(f"进行中的调用等待 {waited['seconds']:.2f}s，下一轮排队 {time.perf_counter() - start:.2f}s")
+    assert waited["seconds"] < 0.5 and time.perf_counter() - start < 0.5
+
+    # 正常结束、合并或出错时不调用 on_abandon
+    abandoned = []
+    assert list(mailbox.stream("s4", lambda text: iter(text), "ab", on_abandon=lambda: abandoned.append(1))) == ["a", "b"]
+    try:
+        list(mailbox.stream("s4", broken, on_abandon=lambda: abandoned.append(1)))
+    except RuntimeError:
+        pass
+    assert abandoned == []
+
+    mailbox.shutdown()
+    print("\n🎉 会话邮箱测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证并发工具执行器
+同一消息的工具调用并发执行且按原顺序返回、单个工具超时、并发上限、批量处理、错误隔离、随本轮取消
+"""
+
+import sys
+import os
+import threading
+import time
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from langchain_core.tools import tool
+    from deadline import Deadline, activate, current_deadline
+    from tool_executor import ToolExecutor
+
+    print("✅ 成功导入模块")
+
+    running = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    @tool
+    def search(query: str, seconds: float = 0.3):
+        """模拟搜索：按截止时间可提前返回"""
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        try:
+            finished = current_deadline().wait(seconds)
+            return f"{query} 的结果" if finished else f"{query} 的部分结果"
+        finally:
+            with lock:
+                running["now"] -= 1
+
+    @tool
+    def stuck(seconds: float):
+        """模拟不响应取消的工具"""
+        time.sleep(seconds)
+        return "太晚了"
+
+    def call(call_id, name, **args):
+        return {"id": call_id, "name": name, "args": args, "type": "tool_call"}
+
+    # --- 1. 并发执行，按原顺序返回 ---
+    print("\n=== 测试并发执行与顺序 ===")
+    executor = ToolExecutor([search, stuck], timeouts={"search": 5, "stuck": 0.3}, limits={})
+    calls = [call(f"c{i}", "search", query=f"q{i}", seconds=0.3 - i * 0.1) for i in range(3)]
+    start = time.perf_counter()
+    messages = executor.run(calls)
+    elapsed = time.perf_counter() - start
+    print(f"耗时 {elapsed:.2f}s: {[(m.tool_call_id, m.content) for m in messages]}")
+    assert [m.tool_call_id for m in messages] == ["c0", "c1", "c2"]
+    assert [m.content for m in messages] == ["q0 的结果", "q1 的结果", "q2 的结果"]
+    assert elapsed < 0.5 and running["max"] == 3
+
+    # --- 2. 单个工具超时：响应截止时间的返回部分结果，不响应的返回超时错误，其他调用不受影响 ---
+    print("\n=== 测试单个工具超时 ===")
+    executor.timeouts["search"] = 0.3
+    start = time.perf_counter()
+    messages = executor.run([call("a", "search", query="慢", seconds=3), call("b", "stuck", seconds=3),
+                             call("c", "search", query="快", seconds=0.05)])
+    elapsed = time.perf_counter() - start
+    print(f"耗时 {elapsed:.2f}s: {[(m.content, m.status) for m in messages]}，统计: {executor.stats()}")
+    assert messages[0].content == "慢 的部分结果" and messages[0].status == "success"
+    assert messages[1].status == "error" and "超时" in messages[1].content
+    assert messages[2].content == "快 的结果"
+    assert elapsed < 2.0 and executor.stats()["timeouts"] == 1
+
+    # --- 3. 每种工具的并发上限 ---
+    print("\n=== 测试并发上限 ===")
+    limited = ToolExecutor([search], timeouts={"search": 5}, limits={"search": 2})
+    running["max"] = 0
+    start = time.perf_counter()
+    messages = limited.run([call(f"l{i}", "search", query=f"q{i}", seconds=0.2) for i in range(4)])
+    elapsed = time.perf_counter() - start
+    print(f"耗时 {elapsed:.2f}s，最大并发 {running['max']}")
+    assert running["max"] == 2 and 0.35 < elapsed < 1.0 and all(m.status == "success" for m in messages)
+
+    # --- 4. 批量处理：同名调用合并为一次，结果回到各自位置 ---
+    print("\n=== 测试批量处理 ===")
+    batches = []
+
+    def write_memories(tool_calls):
+        batches.append([tc["id"] for tc in tool_calls])
+        return [f"已写入 {tc['args']['memory_id']}" for tc in tool_calls]
+
+    messages = executor.run(
+        [call("m1", "manage_memory", memory_id="name"), call("s1", "search", query="天气", seconds=0),
+         call("m2", "manage_memory", memory_id="city")],
+        batch_handlers={"manage_memory": write_memories},
+    )
+    print(f"批次: {batches}，结果: {[m.content for m in messages]}")
+    assert batches == [["m1", "m2"]]
+    assert [m.content for m in messages] == ["已写入 name", "天气 的结果", "已写入 city"]
+
+    # 批量处理失败时该批所有调用返回错误
+    messages = executor.run([call("m3", "manage_memory", memory_id="x")],
+                            batch_handlers={"manage_memory": lambda tool_calls: 1 / 0})
+    assert messages[0].status == "error" and "失败" in messages[0].content
+
+    # --- 5. 未知工具与参数错误只影响自身 ---
+    print("\n=== 测试错误隔离 ===")
+    messages = executor.run([call("u", "unknown_tool"), call("bad", "search"),
+                             call("ok", "search", query="正常", seconds=0)])
+    print(f"结果: {[(m.content[:30], m.status) for m in messages]}")
+    assert [m.status for m in messages] == ["error", "error", "success"]
+    assert messages[0].content == "未知工具: unknown_tool"
+
+    # --- 6. 本轮取消时工具随之取消 ---
+    print("\n=== 测试随本轮取消 ===")
+    parent = Deadline(10)
+    threading.Timer(0.1, parent.cancel).start()
+    start = time.perf_counter()
+    with activate(parent):
+        messages = executor.run([call("p", "search", query="长任务", seconds=3)])
+    elapsed = time.perf_counter() - start
+    print(f"耗时 {elapsed:.2f}s: {messages[0].content}")
+    assert messages[0].content == "长任务 的部分结果" and elapsed < 0.5
+
+    executor.shutdown()
+    limited.shutdown()
+    print("\n🎉 并发工具执行器测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试脚本：验证工具绑定注册表与共享 HTTP 客户端
+同一工具集合只绑定一次且与参数顺序无关、schema 按注册顺序生成、未注册工具报错、
+并发首次获取只绑定一次、共享客户端进程内唯一
+不发出任何 LLM 请求
+"""
+
+import sys
+import os
+import threading
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from langchain_core.tools import tool
+    from tool_registry import ToolRegistry, get_llm_pool, get_llm_scheduler, get_shared_http_client
+
+    print("✅ 成功导入模块")
+
+    @tool
+    def manage_memory(memory_id: str, content: str):
+        """保存用户记忆"""
+        return "ok"
+
+    @tool
+    def web_search(queries: list):
+        """搜索网络"""
+        return "ok"
+
+    class CountingLLM:
+        """记录 bind_tools 调用次数的假模型"""
+
+        def __init__(self):
+            self.calls = []
+            self.lock = threading.Lock()
+
+        def bind_tools(self, tools):
+            with self.lock:
+                self.calls.append([t.name for t in tools])
+            return object()
+
+    # --- 1. 按工具集合缓存，参数顺序不影响 ---
+    print("\n=== 测试绑定缓存 ===")
+    llm = CountingLLM()
+    registry = ToolRegistry(llm, [manage_memory, web_search])
+    both = registry.get("web_search", "manage_memory")
+    assert registry.get("manage_memory", "web_search") is both
+    only_memory = registry.get("manage_memory")
+    assert only_memory is not both and registry.get("manage_memory") is only_memory
+    print(f"bind_tools 调用: {llm.calls}")
+    assert llm.calls == [["manage_memory", "web_search"], ["manage_memory"]]
+
+    try:
+        registry.get("manage_memory", "unknown_tool")
+        raise AssertionError("未注册的工具应报错")
+    except KeyError as e:
+        assert "unknown_tool" in str(e)
+
+    # --- 2. 并发首次获取只绑定一次 ---
+    print("\n=== 测试并发获取 ===")
+    llm = CountingLLM()
+    registry = ToolRegistry(llm, [manage_memory, web_search])
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("web_search"))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(llm.calls) == 1 and len({id(r) for r in results}) == 1
+
+    registry.warmup(["manage_memory"], ["manage_memory", "web_search"])
+    assert len(llm.calls) == 3
+
+    # --- 3. 共享 HTTP 客户端、端点池与调度器进程内唯一 ---
+    print("\n=== 测试共享客户端 ===")
+    client = get_shared_http_client()
+    assert get_shared_http_client() is client
+    assert get_llm_pool() is get_llm_pool() and get_llm_scheduler() is get_llm_scheduler()
+    print(f"端点池地址: {get_llm_pool().base_url}")
+
+    print("\n🎉 工具注册表测试完成！")
+
+except Exception as e:
+    print(f"❌ 测试过程中发生错误: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+思考标签的增量解析器
+
+模型的流式输出中可能包含 <thinking>...</thinking>、<思考>...</思考>、<recollection>...</recollection>。
+ThinkingStreamParser 是一个状态机，逐 chunk 消费输出：
+- 标签被切断在两个 chunk 之间时，只暂存可能是标签前缀的尾部，其余文本立即输出；
+- 思考内容与回答内容分别累积到 thinking / answer，界面可以在生成过程中实时渲染折叠的思考区；
+- 每个字符只扫描一次，不再在流结束后对全文反复 find/split。
+"""
+
+from typing import List, Optional, Tuple
+
+THINKING_TAGS = [
+    ("<thinking>", "</thinking>"),
+    ("<思考>", "</思考>"),
+    ("<recollection>", "</recollection>"),
+]
+
+THINKING = "thinking"
+ANSWER = "answer"
+
+
+class ThinkingStreamParser:
+    """把流式文本拆成 (类型, 文本) 片段，类型为 THINKING 或 ANSWER"""
+
+    def __init__(self, tags: List[Tuple[str, str]] = THINKING_TAGS):
+        self._open_tags = {start: end for start, end in tags}
+        self._end_tag: Optional[str] = None   # 当前所在思考块的结束标签，None 表示在回答中
+        self._pending = ""                     # 可能是标签前缀、需要等待下一个 chunk 的尾部
+        self.thinking = ""
+        self.answer = ""
+
+    @property
+    def in_thinking(self) -> bool:
+        return self._end_tag is not None
+
+    def _candidates(self) -> List[str]:
+        return [self._end_tag] if self._end_tag else list(self._open_tags)
+
+    def _emit(self, kind: str, text: str, events: List[Tuple[str, str]]):
+        if not text:
+            return
+        if kind == THINKING:
+            self.thinking += text
+        else:
+            self.answer += text
+        if events and events[-1][0] == kind:
+            events[-1] = (kind, events[-1][1] + text)
+        else:
+            events.append((kind, text))
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        """消费一个 chunk，返回本次可以确定归属的片段"""
+        events: List[Tuple[str, str]] = []
+        text = self._pending + (chunk or "")
+        self._pending = ""
+        pos = 0
+        while pos < len(text):
+            lt = text.find("<", pos)
+            kind = THINKING if self.in_thinking else ANSWER
+            if lt == -1:
+                self._emit(kind, text[pos:], events)
+                break
+            self._emit(kind, text[pos:lt], events)
+
+            rest = text[lt:]
+            matched = next((tag for tag in self._candidates() if rest.startswith(tag)), None)
+            if matched:
+                self._end_tag = None if self.in_thinking else self._open_tags[matched]
+                pos = lt + len(matched)
+            elif any(tag.startswith(rest) for tag in self._candidates()):
+                # 标签被 chunk 边界切断，等待更多输入
+                self._pending = rest
+                break
+            else:
+                self._emit(kind, "<", events)
+                pos = lt + 1
+        return events
+
+    def finish(self) -> List[Tuple[str, str]]:
+        """流结束：把暂存的尾部按当前状态输出"""
+        events: List[Tuple[str, str]] = []
+        self._emit(THINKING if self.in_thinking else ANSWER, self._pending, events)
+        self._pending = ""
+        return events
+
+
+def split_thinking(content: str, tags: List[Tuple[str, str]] = THINKING_TAGS) -> Tuple[str, str]:
+    """一次性解析完整文本，返回 (思考内容, 回答内容)"""
+    parser = ThinkingStreamParser(tags)
+    parser.feed(content)
+    parser.finish()
+    return parser.thinking.strip(), parser.answer.strip()
+
+
+def render_thinking_markdown(thinking: str, answer: str, generating: bool = False) -> str:
+    """把思考内容渲染成可折叠区块，generating 为 True（仍在思考）时思考区保持展开"""
+    if not thinking.strip():
+        return answer
+    open_attr = " open" if generating else ""
+    summary = "🤔 思考中..." if generating else "🤔 思考过程 (点击展开/折叠)"
+    return f"""<details{open_attr}>
+<summary>{summary}</summary>
+
+{thinking.strip()}
+
+</details>
+
+**💡 最终回答：**
+
+{answer.strip()}"""
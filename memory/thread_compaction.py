@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+会话压缩移出响应关键路径：后台生成摘要，下一轮开始时应用
+
+原先 summarize_cleanup 在 agent / reply_after_tool 之后同步调用 llm.invoke 生成摘要，
+会话超过 10 条消息后每轮都要多等一次模型调用才能结束。现在：
+1. 轮次末尾的 cleanup 节点只调用 ThreadCompactor.schedule()，把当前消息快照交给
+   后台线程生成摘要，本轮立即结束；每个会话同一时间最多一个压缩任务；
+2. 摘要完成后作为待应用结果挂在该会话上，记下它覆盖、可以删除的消息 id；
+3. 下一轮开始时 compact 节点调用 take()，返回 {"summary", RemoveMessage...} 作为
+   普通的状态更新写入，由 checkpointer 与本轮其他写入一样保存。
+
+下一轮提前到达时摘要若尚未完成，本轮照常进行（消息暂不删除），在之后的轮次应用；
+应用时只删除当前状态中仍存在的消息，快照之后新增的消息不受影响。
+"""
+
+import concurrent.futures
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage, RemoveMessage
+
+COMPACT_THRESHOLD = 10   # 消息数超过该值时压缩
+COMPACT_KEEP_LAST = 3    # 压缩后保留的最近消息数
+
+
+class ThreadCompactor:
+    """按会话（thread_id）在后台生成摘要，并在下一轮开始时交给工作流应用（线程安全）"""
+
+    def __init__(self, summarize: Callable[[List[BaseMessage]], str], threshold: int = COMPACT_THRESHOLD,
+                 keep_last: int = COMPACT_KEEP_LAST, max_workers: int = 2):
+        self.summarize = summarize
+        self.threshold = threshold
+        self.keep_last = keep_last
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix="compaction")
+        self._lock = threading.Lock()
+        self._running: Dict[str, concurrent.futures.Future] = {}
+        self._pending: Dict[str, Tuple[str, List[str]]] = {}
+        self._stats = {"scheduled": 0, "completed": 0, "applied": 0, "failed": 0, "skipped_running": 0}
+
+    def schedule(self, thread_id: Optional[str], messages: Sequence[BaseMessage]) -> bool:
+        """消息过长时安排后台压缩；已有进行中的任务时跳过"""
+        if not thread_id or len(messages) <= self.threshold:
+            return False
+        snapshot = list(messages)
+        with self._lock:
+            if thread_id in self._running:
+                self._stats["skipped_running"] += 1
+                return False
+            self._stats["scheduled"] += 1
+            self._running[thread_id] = self._executor.submit(self._compact, thread_id, snapshot)
+        print(f"🗜️ 会话 {thread_id} 共 {len(snapshot)} 条消息，已安排后台压缩")
+        return True
+
+    def _compact(self, thread_id: str, snapshot: List[BaseMessage]):
+        try:
+            summary = self.summarize(snapshot)
+            removable = [m.id for m in snapshot[:-self.keep_last] if m.id]
+            with self._lock:
+                # 较新的快照覆盖较旧的待应用结果
+                self._pending[thread_id] = (summary, removable)
+                self._stats["completed"] += 1
+            print(f"🗜️ 会话 {thread_id} 摘要已生成，下一轮开始时删除 {len(removable)} 条旧消息")
+        except Exception as e:
+            with self._lock:
+                self._stats["failed"] += 1
+            print(f"❌ 会话 {thread_id} 后台压缩失败: {e}")
+        finally:
+            with self._lock:
+                self._running.pop(thread_id, None)
+
+    def take(self, thread_id: Optional[str], messages: Sequence[BaseMessage]) -> Optional[Dict]:
+        """取出该会话已完成的压缩结果，转换为状态更新；没有时返回 None"""
+        if not thread_id:
+            return None
+        with self._lock:
+            pending = self._pending.pop(thread_id, None)
+            if pending is None:
+                return None
+            self._stats["applied"] += 1
+        summary, removable = pending
+        present = {m.id for m in messages}
+        removes = [RemoveMessage(id=message_id) for message_id in removable if message_id in present]
+        print(f"🗜️ 应用会话 {thread_id} 的压缩结果，删除 {len(removes)} 条旧消息")
+        return {"summary": summary, "messages": removes}
+
+    def wait(self, thread_id: str, timeout: Optional[float] = None) -> bool:
+        """等待该会话进行中的压缩任务完成（测试与退出时使用）"""
+        with self._lock:
+            future = self._running.get(thread_id)
+        if future is None:
+            return True
+        try:
+            future.result(timeout=timeout)
+            return True
+        except concurrent.futures.TimeoutError:
+            return False
+
+    def shutdown(self):
+        """退出时丢弃尚未开始的任务，不等待进行中的模型调用"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["running"] = len(self._running)
+            stats["pending"] = len(self._pending)
+        return stats
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+按会话串行、跨会话并行的轮次执行器（actor 邮箱）
+
+同一用户快速提交两次（例如 Gradio 中连按两次回车），两个轮次会并发读写同一个
+thread_{user_id} 的 checkpoint 和对话历史，导致 checkpoint 写入相互覆盖、记忆重复写入；
+全局锁又会让不同用户互相等待。MailboxExecutor 为每个键（thread_id）维护一个邮箱：
+1. submit() 把轮次放进该键的邮箱；邮箱空闲时把它交给有界线程池，
+   每次只执行队首一个轮次，完成后把邮箱重新排到线程池队尾，不同会话轮流推进；
+2. 同一键的轮次严格按提交顺序执行，同一时间最多一个；
+3. 传入 merge 时可合并排队消息：邮箱末尾尚未开始、同样可合并的轮次被取出，
+   与新轮次的输入合并成一轮，被合并的轮次以 COALESCED 结束；
+4. stream() 在邮箱中执行生成器函数，产出经有界队列交给调用方，
+   调用方读得慢时工作线程随之暂停，关闭生成器时调用 on_abandon 中止进行中的工作，
+   工作线程随后关闭原生成器；
+5. depth() / snapshot() 给出每个会话的排队深度。
+"""
+
+import concurrent.futures
+import os
+import queue
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Iterator, Optional
+
+# 被合并进后续轮次的轮次，其 Future 以该值结束；stream() 产出一次该值后结束
+COALESCED = object()
+
+STREAM_BUFFER = 64   # stream() 中工作线程最多领先调用方的产出数
+TURN_MAX_WORKERS = int(os.getenv("TURN_MAX_WORKERS", "16"))   # 同时执行轮次的会话数上限
+
+
+class _Turn:
+    __slots__ = ("fn", "payload", "merge", "future")
+
+    def __init__(self, fn: Callable[[Any], Any], payload: Any, merge: Optional[Callable[[Any, Any], Any]]):
+        self.fn = fn
+        self.payload = payload
+        self.merge = merge
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+
+
+class MailboxExecutor:
+    """每个键一个邮箱：键内按序执行，键间在有界线程池上并行（线程安全）"""
+
+    def __init__(self, max_workers: int = 8, name: str = "mailbox"):
+        self.name = name
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._mailboxes: Dict[Hashable, Deque[_Turn]] = {}
+        self._scheduled: set = set()   # 邮箱已交给线程池（排在线程池队列中或执行中）的键
+        self._busy: set = set()        # 正在执行轮次的键
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "coalesced": 0}
+
+    def submit(self, key: Hashable, fn: Callable[[Any], Any], payload: Any = None,
+               merge: Optional[Callable[[Any, Any], Any]] = None) -> concurrent.futures.Future:
+        """把 fn(payload) 放进 key 的邮箱，返回其 Future
+
+        merge 不为 None 时，若邮箱末尾是尚未开始、使用同一 merge 的轮次，
+        则取出它并以 merge(旧输入, 新输入) 作为新轮次的输入。
+        """
+        turn = _Turn(fn, payload, merge)
+        merged = None
+        with self._lock:
+            self._stats["submitted"] += 1
+            box = self._mailboxes.setdefault(key, deque())
+            if merge is not None and box and box[-1].merge is merge and not box[-1].future.done():
+                merged = box.pop()
+                turn.payload = merge(merged.payload, payload)
+                self._stats["coalesced"] += 1
+            box.append(turn)
+            if key not in self._scheduled:
+                try:
+                    self._pool.submit(self._drain, key)
+                except RuntimeError:
+                    del self._mailboxes[key]
+                    raise
+                self._scheduled.add(key)
+        if merged is not None:
+            print(f"📬 会话 {key} 合并了一条排队消息")
+            merged.future.set_result(COALESCED)
+        return turn.future
+
+    def _drain(self, key: Hashable):
+        """执行该键邮箱的队首轮次；还有排队时重新排到线程池队尾"""
+        with self._lock:
+            turn = self._mailboxes[key].popleft()
+            self._busy.add(key)
+        # 排队期间被调用方取消的轮次直接跳过
+        if turn.future.set_running_or_notify_cancel():
+            try:
+                result = turn.fn(turn.payload)
+            except BaseException as e:
+                with self._lock:
+                    self._stats["failed"] += 1
+                turn.future.set_exception(e)
+            else:
+                with self._lock:
+                    self._stats["completed"] += 1
+                turn.future.set_result(result)
+        else:
+            with self._lock:
+                self._stats["cancelled"] += 1
+        with self._lock:
+            self._busy.discard(key)
+            box = self._mailboxes[key]
+            if box:
+                try:
+                    self._pool.submit(self._drain, key)
+                    return
+                except RuntimeError:
+                    # 线程池已关闭：剩余轮次不再执行
+                    for remaining in box:
+                        remaining.future.cancel()
+                    self._stats["cancelled"] += len(box)
+            del self._mailboxes[key]
+            self._scheduled.discard(key)
+
+    def stream(self, key: Hashable, gen_fn: Callable[[Any], Iterator], payload: Any = None,
+               merge: Optional[Callable[[Any, Any], Any]] = None, buffer: int = STREAM_BUFFER,
+               on_abandon: Optional[Callable[[], None]] = None) -> Iterator:
+        """在 key 的邮箱中执行生成器 gen_fn(payload)，逐个产出其结果
+
+        轮次被合并进后续轮次时只产出一次 COALESCED；gen_fn 抛出的异常在调用方重新抛出。
+        调用方在结束前关闭生成器时调用 on_abandon（例如取消截止时间），
+        否则执行中的轮次要等 gen_fn 下一次产出才会停止，期间一直占着该会话的邮箱。
+        """
+        items: queue.Queue = queue.Queue(maxsize=buffer)
+        stopped = threading.Event()
+
+        def run(current_payload):
+            if stopped.is_set():
+                return
+            generator = gen_fn(current_payload)
+            try:
+                for item in generator:
+                    if stopped.is_set():
+                        return
+                    items.put(("item", item))
+                if not stopped.is_set():
+                    items.put(("done", None))
+            except BaseException as e:
+                if not stopped.is_set():
+                    items.put(("error", e))
+            finally:
+                close = getattr(generator, "close", None)
+                if close:
+                    close()
+
+        def on_done(f: concurrent.futures.Future):
+            if not f.cancelled() and f.exception() is None and f.result() is COALESCED:
+                items.put(("coalesced", None))
+
+        future = self.submit(key, run, payload, merge)
+        future.add_done_callback(on_done)
+        ended = False
+        try:
+            while True:
+                kind, value = items.get()
+                if kind == "item":
+                    yield value
+                elif kind == "coalesced":
+                    ended = True
+                    yield COALESCED
+                    return
+                elif kind == "error":
+                    ended = True
+                    raise value
+                else:
+                    ended = True
+                    return
+        finally:
+            # 调用方提前放弃：排队中的轮次直接取消；执行中的轮次经 on_abandon 中止，并在下一次产出时停止。
+            # 清空队列让阻塞在 put 上的工作线程继续，之后它会看到停止标记
+            stopped.set()
+            future.cancel()
+            if not ended and on_abandon is not None:
+                on_abandon()
+            while True:
+                try:
+                    items.get_nowait()
+                except queue.Empty:
+                    break
+
+    def depth(self, key: Hashable) -> int:
+        """该键排队中与执行中的轮次数"""
+        with self._lock:
+            return len(self._mailboxes.get(key, ())) + (1 if key in self._busy else 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """每个会话的排队深度（含执行中的轮次）与累计统计"""
+        with self._lock:
+            depths = {str(key): len(box) + (1 if key in self._busy else 0) for key, box in self._mailboxes.items()}
+            stats = dict(self._stats)
+            stats["running"] = len(self._busy)
+        stats["threads"] = depths
+        stats["queued"] = sum(depths.values()) - stats["running"]
+        return stats
+
+    def stats(self) -> Dict[str, int]:
+        snapshot = self.snapshot()
+        snapshot.pop("threads")
+        return snapshot
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+
+def merge_user_inputs(earlier: str, later: str) -> str:
+    """合并排队的两条用户输入；连按回车产生的重复输入只保留一条"""
+    if earlier.strip() == later.strip():
+        return later
+    return f"{earlier}\n{later}"
+
+
+def merge_turn_inputs(earlier: Dict[str, Any], later: Dict[str, Any]) -> Dict[str, Any]:
+    """合并排队的两个工作流输入状态：消息按顺序拼接，内容重复的消息只保留一条"""
+    messages = list(earlier.get("messages", []))
+    seen = {m.content for m in messages}
+    messages += [m for m in later.get("messages", []) if m.content not in seen]
+    return {**earlier, **later, "messages": messages}
+
+
+# 对话轮次共用的邮箱：键为 thread_id
+turn_mailbox = MailboxExecutor(TURN_MAX_WORKERS, name="turns")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+并发执行一条 AI 消息中的全部工具调用
+
+原先 tool_node 逐个执行且只认 manage_memory，agent 发出的 web_search 被丢弃；
+get_streaming_response 只执行第一个 web_search 调用（break）。ToolExecutor：
+1. 同一条消息中的工具调用在共享线程池上并发执行，返回的 ToolMessage 与调用顺序一致；
+2. 每个调用有自己的截止时间：min(该工具的超时, 本轮剩余时间)，在工作线程中激活，
+   搜索等工具到期后停止发起新请求、返回已有结果；本轮取消时随之取消；
+3. 每种工具另有并发上限（跨所有轮次，例如 web_search 避免触发搜索限流）；
+4. 传入 batch_handlers 的工具（manage_memory）同一条消息中的调用合并为一次处理，
+   例如在一个事务中写入全部记忆；
+5. 超时、参数错误和未知工具都以 status="error" 的 ToolMessage 返回，不影响其他调用。
+"""
+
+import concurrent.futures
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Sequence
+
+from langchain_core.messages import ToolMessage
+from langchain_core.tools import BaseTool
+
+from deadline import Deadline, activate, current_deadline
+
+TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", "8"))          # 所有轮次共享的工具线程数
+TOOL_DEFAULT_TIMEOUT = float(os.getenv("TOOL_DEFAULT_TIMEOUT", "20"))
+TOOL_TIMEOUTS = {
+    "web_search": float(os.getenv("TOOL_TIMEOUT_WEB_SEARCH", "15")),
+    "manage_memory": float(os.getenv("TOOL_TIMEOUT_MANAGE_MEMORY", "5")),
+}
+TOOL_CONCURRENCY_LIMITS = {
+    "web_search": int(os.getenv("TOOL_LIMIT_WEB_SEARCH", "2")),
+}
+TOOL_TIMEOUT_GRACE = 1.0   # 截止时间到后再等待工具收尾（返回部分结果）的秒数
+
+BatchHandler = Callable[[List[dict]], List[str]]
+
+
+class ToolExecutor:
+    """按调用顺序返回 ToolMessage 的并发工具执行器（线程安全，可在多个轮次间共享）"""
+
+    def __init__(self, tools: Sequence[BaseTool], timeouts: Optional[Dict[str, float]] = None,
+                 limits: Optional[Dict[str, int]] = None, max_workers: int = TOOL_MAX_WORKERS,
+                 default_timeout: float = TOOL_DEFAULT_TIMEOUT):
+        self.tools = {t.name: t for t in tools}
+        self.timeouts = dict(TOOL_TIMEOUTS if timeouts is None else timeouts)
+        self.default_timeout = default_timeout
+        limits = TOOL_CONCURRENCY_LIMITS if limits is None else limits
+        self._semaphores = {name: threading.BoundedSemaphore(n) for name, n in limits.items()}
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self._lock = threading.Lock()
+        self._stats = {"messages": 0, "calls": 0, "batched": 0, "errors": 0, "timeouts": 0}
+
+    def run(self, tool_calls: Sequence[dict],
+            batch_handlers: Optional[Dict[str, BatchHandler]] = None) -> List[ToolMessage]:
+        """执行一条 AI 消息的全部工具调用，按原顺序返回 ToolMessage"""
+        batch_handlers = batch_handlers or {}
+        parent = current_deadline()
+        contents: List[Optional[str]] = [None] * len(tool_calls)
+        errors: List[bool] = [False] * len(tool_calls)
+
+        # 任务：(调用下标列表, 工具名, 可执行体)；批量工具同名调用合并成一个任务
+        tasks = []
+        batches: Dict[str, List[int]] = {}
+        for i, call in enumerate(tool_calls):
+            name = call["name"]
+            if name in batch_handlers:
+                batches.setdefault(name, []).append(i)
+            elif name in self.tools:
+                tasks.append(([i], name, lambda call=call: [str(self.tools[call["name"]].invoke(call["args"]))]))
+            else:
+                contents[i], errors[i] = f"未知工具: {name}", True
+        for name, indices in batches.items():
+            calls = [tool_calls[i] for i in indices]
+            tasks.append((indices, name, lambda handler=batch_handlers[name], calls=calls: handler(calls)))
+
+        with self._lock:
+            self._stats["messages"] += 1
+            self._stats["calls"] += len(tool_calls)
+            self._stats["batched"] += sum(len(indices) for indices in batches.values())
+
+        futures = []
+        for indices, name, fn in tasks:
+            timeout = self.timeouts.get(name, self.default_timeout)
+            if parent is not None:
+                timeout = min(timeout, parent.remaining())
+            deadline = Deadline(timeout)
+            unregister = parent.on_cancel(deadline.cancel) if parent is not None else (lambda: None)
+            futures.append((indices, name, deadline, unregister,
+                            self._pool.submit(self._execute, name, fn, deadline)))
+
+        for indices, name, deadline, unregister, future in futures:
+            try:
+                # 截止时间到后工具会停止后续请求并尽快返回，多等一小段时间收取部分结果
+                results = future.result(timeout=deadline.remaining() + TOOL_TIMEOUT_GRACE)
+                if len(results) != len(indices):
+                    raise ValueError(f"批量处理返回 {len(results)} 个结果，应为 {len(indices)} 个")
+                for i, content in zip(indices, results):
+                    contents[i] = str(content)
+            except (concurrent.futures.TimeoutError, TimeoutError):
+                deadline.cancel(reason="timeout")
+                with self._lock:
+                    self._stats["timeouts"] += len(indices)
+                print(f"⏰ 工具 {name} 执行超时（{deadline.timeout_seconds:.1f}s）")
+                for i in indices:
+                    contents[i] = f"工具 {name} 执行超时，请根据已有信息回答"
+                    errors[i] = True
+            except Exception as e:
+                print(f"❌ 工具 {name} 执行失败: {e}")
+                for i in indices:
+                    contents[i] = f"工具 {name} 执行失败: {e}"
+                    errors[i] = True
+            finally:
+                deadline.release()
+                unregister()
+
+        with self._lock:
+            self._stats["errors"] += sum(errors)
+        return [
+            ToolMessage(content=contents[i], tool_call_id=call["id"], name=call["name"],
+                        status="error" if errors[i] else "success")
+            for i, call in enumerate(tool_calls)
+        ]
+
+    def _execute(self, name: str, fn: Callable[[], List[str]], deadline: Deadline) -> List[str]:
+        """在工作线程中执行：先取得该工具的并发名额，再在截止时间内运行"""
+        semaphore = self._semaphores.get(name)
+        if semaphore is not None and not semaphore.acquire(timeout=deadline.remaining()):
+            raise TimeoutError(f"等待 {name} 并发名额超时")
+        try:
+            with activate(deadline):
+                return fn()
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+工具绑定注册表：预先计算并缓存 llm.bind_tools(...) 的结果
+
+每次 bind_tools 都会从工具函数的签名和文档字符串重新生成 OpenAI 工具 schema，
+这里按启用的工具集合（如 仅记忆 / 记忆+搜索）缓存绑定后的 Runnable，
+并让所有 ChatOpenAI 实例共用一个带 keep-alive 的 HTTP 客户端；
+发往 vLLM 的请求先经 llm_pool.LLMScheduler 按优先级准入，再由 EndpointPool 在多个副本间路由。
+"""
+
+import threading
+from typing import Dict, FrozenSet, Iterable, List
+
+import httpx
+
+from cassette import wrap_transport
+from deadline import DeadlineTransport
+from llm_pool import LLM_BASE_URLS, EndpointPool, LLMScheduler
+
+# 共享 HTTP 客户端的连接池参数
+HTTP_MAX_CONNECTIONS = 32
+HTTP_MAX_KEEPALIVE = 16
+HTTP_KEEPALIVE_EXPIRY = 120  # 秒
+
+_shared_http_client = None
+_llm_pool = None
+_llm_scheduler = None
+_client_lock = threading.Lock()
+
+
+def get_shared_http_client() -> httpx.Client:
+    """返回进程内共享的 HTTP 客户端（懒加载），复用到 vLLM 服务的长连接；
+    请求受当前激活的 Deadline 约束，取消时立即中止"""
+    global _shared_http_client, _llm_pool, _llm_scheduler
+    if _shared_http_client is None:
+        with _client_lock:
+            if _shared_http_client is None:
+                limits = httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                )
+                _llm_pool = EndpointPool(LLM_BASE_URLS, transport=httpx.HTTPTransport(limits=limits))
+                # 开启磁带（LLM_CASSETTE_MODE）时在端点池之前录制 / 回放请求
+                _llm_scheduler = LLMScheduler(wrap_transport(_llm_pool))
+                _shared_http_client = httpx.Client(
+                    transport=DeadlineTransport(_llm_scheduler),
+                )
+    return _shared_http_client
+
+
+def get_llm_pool() -> EndpointPool:
+    """共享客户端使用的 vLLM 端点池；ChatOpenAI 的 openai_api_base 应取 get_llm_pool().base_url"""
+    get_shared_http_client()
+    return _llm_pool
+
+
+def get_llm_scheduler() -> LLMScheduler:
+    """共享客户端使用的 LLM 调度器（排队指标见 snapshot()）"""
+    get_shared_http_client()
+    return _llm_scheduler
+
+
+class ToolRegistry:
+    """按工具集合缓存 bind_tools 结果的注册表"""
+
+    def __init__(self, llm, tools: Iterable):
+        self.llm = llm
+        # 保持注册顺序，保证同一工具集合生成的 schema 顺序稳定
+        self._tools = {t.name: t for t in tools}
+        self._bound: Dict[FrozenSet[str], object] = {}
+        self._lock = threading.Lock()
+
+    def get(self, *tool_names: str):
+        """获取绑定了指定工具的 Runnable，首次使用时计算并缓存"""
+        key = frozenset(tool_names)
+        bound = self._bound.get(key)
+        if bound is None:
+            with self._lock:
+                bound = self._bound.get(key)
+                if bound is None:
+                    unknown = key - self._tools.keys()
+                    if unknown:
+                        raise KeyError(f"未注册的工具: {sorted(unknown)}")
+                    ordered = [t for name, t in self._tools.items() if name in key]
+                    bound = self.llm.bind_tools(ordered)
+                    self._bound[key] = bound
+        return bound
+
+    def warmup(self, *tool_sets: List[str]):
+        """预先计算常用工具集合的绑定，避免首个请求承担 schema 生成开销"""
+        for names in tool_sets:
+            self.get(*names)